@@ -66,6 +66,37 @@ New-Item -ItemType Directory -Force -Path "$appPath\logs" | Out-Null
 & $nssmPath set $serviceName AppRestartDelay 5000
 & $nssmPath set $serviceName AppThrottle 0
 
+# Служба отправки уведомлений в MES (manage.py deliver_webhooks); адрес приемника —
+# переменная WEBHOOK_URL, без нее события не накапливаются
+$workerName = "${serviceName}Webhooks"
+if (Get-Service $workerName -ErrorAction SilentlyContinue) {
+    Stop-Service $workerName -Force -ErrorAction SilentlyContinue
+    & $nssmPath remove $workerName confirm
+    Start-Sleep -Seconds 2
+}
+& $nssmPath install $workerName $pythonPath "manage.py deliver_webhooks --settings=production_calculator.settings_prod"
+& $nssmPath set $workerName DisplayName "$displayName (уведомления MES)"
+& $nssmPath set $workerName Start SERVICE_AUTO_START
+& $nssmPath set $workerName AppDirectory $appPath
+& $nssmPath set $workerName AppStdout "$appPath\logs\webhooks.log"
+& $nssmPath set $workerName AppStderr "$appPath\logs\webhooks-error.log"
+& $nssmPath set $workerName AppRestartDelay 5000
+
+# Служба фоновых задач (manage.py run_jobs): копирование больших заказов, пересчет масс деталей
+$jobsName = "${serviceName}Jobs"
+if (Get-Service $jobsName -ErrorAction SilentlyContinue) {
+    Stop-Service $jobsName -Force -ErrorAction SilentlyContinue
+    & $nssmPath remove $jobsName confirm
+    Start-Sleep -Seconds 2
+}
+& $nssmPath install $jobsName $pythonPath "manage.py run_jobs --settings=production_calculator.settings_prod"
+& $nssmPath set $jobsName DisplayName "$displayName (фоновые задачи)"
+& $nssmPath set $jobsName Start SERVICE_AUTO_START
+& $nssmPath set $jobsName AppDirectory $appPath
+& $nssmPath set $jobsName AppStdout "$appPath\logs\jobs.log"
+& $nssmPath set $jobsName AppStderr "$appPath\logs\jobs-error.log"
+& $nssmPath set $jobsName AppRestartDelay 5000
+
 # Даем права на папку
 Write-Host "Настройка прав доступа..." -ForegroundColor Yellow
 icacls $appPath /grant "NT AUTHORITY\SYSTEM:(OI)(CI)F" /T
@@ -74,6 +105,8 @@ icacls $appPath\logs /grant "NT AUTHORITY\SYSTEM:(OI)(CI)F" /T
 # Запускаем службу
 Write-Host "Запуск службы..." -ForegroundColor Yellow
 Start-Service $serviceName
+Start-Service $workerName
+Start-Service $jobsName
 
 # Проверяем статус
 Start-Sleep -Seconds 3
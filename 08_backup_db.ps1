@@ -4,24 +4,30 @@ Write-Host "========================================" -ForegroundColor Green
 Write-Host ""
 
 $appPath = "C:\ProgramData\ProductionCalculator"
+$pythonPath = "$appPath\venv\Scripts\python.exe"
 $backupPath = "C:\ProgramData\ProductionCalculator\backups"
-$date = Get-Date -Format "yyyy-MM-dd_HH-mm"
 
-# Создаем папку для бэкапов
-New-Item -ItemType Directory -Force -Path $backupPath | Out-Null
-
-# Копируем базу данных
+# Копия снимается через online backup API SQLite: служба может продолжать работу.
+# Копия проверяется (integrity_check), сжимается; хранятся 14 последних копий.
+# База архива заказов (archive.sqlite3), если есть, копируется в парный файл archive_*
+# и восстанавливается вместе с копией db_*.
+# Восстановление: manage.py restore_db <файл копии db_*>
 if (Test-Path "$appPath\db.sqlite3") {
-    $backupFile = "$backupPath\db_$date.sqlite3"
-    Copy-Item "$appPath\db.sqlite3" $backupFile
-    Write-Host "✓ База данных сохранена: $backupFile" -ForegroundColor Green
+    Push-Location $appPath
+    & $pythonPath manage.py backup_db --dir $backupPath --keep 14
+    if ($LASTEXITCODE -eq 0) {
+        Write-Host "✓ База данных сохранена" -ForegroundColor Green
+    } else {
+        Write-Host "✗ Ошибка резервного копирования!" -ForegroundColor Red
+    }
+    Pop-Location
 } else {
     Write-Host "✗ Файл базы данных не найден!" -ForegroundColor Red
 }
 
-# Показываем последние 5 бэкапов
+# Показываем последние 5 бэкапов (с парными копиями архива)
 Write-Host ""
 Write-Host "Последние резервные копии:" -ForegroundColor Yellow
-Get-ChildItem $backupPath -Filter "*.sqlite3" | Sort-Object LastWriteTime -Descending | Select-Object -First 5 | Format-Table Name, LastWriteTime
+Get-ChildItem $backupPath -Include "db_*.sqlite3*", "archive_*.sqlite3*" -Path "$backupPath\*" | Sort-Object LastWriteTime -Descending | Select-Object -First 10 | Format-Table Name, LastWriteTime
 
-pause
\ No newline at end of file
+pause
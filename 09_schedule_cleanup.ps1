@@ -0,0 +1,30 @@
+# Запустите от имени администратора
+Write-Host "========================================" -ForegroundColor Green
+Write-Host "   ПЛАНИРОВАНИЕ ОЧИСТКИ СЕССИЙ" -ForegroundColor Green
+Write-Host "========================================" -ForegroundColor Green
+Write-Host ""
+
+$appPath = "C:\ProgramData\ProductionCalculator"
+$pythonPath = "$appPath\venv\Scripts\python.exe"
+$taskName = "ProductionCalculatorCleanupSessions"
+
+if (-not (Test-Path $pythonPath)) {
+    Write-Host "ОШИБКА: Python не найден по пути: $pythonPath" -ForegroundColor Red
+    pause
+    exit
+}
+
+# Удаляем старую задачу если есть
+if (Get-ScheduledTask -TaskName $taskName -ErrorAction SilentlyContinue) {
+    Unregister-ScheduledTask -TaskName $taskName -Confirm:$false
+}
+
+# Ежедневно в 03:00 удаляем просроченные сессии и сжимаем журнал ленты изменений
+$action = New-ScheduledTaskAction -Execute $pythonPath -Argument "manage.py cleanup_sessions" -WorkingDirectory $appPath
+$pruneAction = New-ScheduledTaskAction -Execute $pythonPath -Argument "manage.py prune_change_log" -WorkingDirectory $appPath
+$trigger = New-ScheduledTaskTrigger -Daily -At 3am
+Register-ScheduledTask -TaskName $taskName -Action $action, $pruneAction -Trigger $trigger -User "SYSTEM" -RunLevel Highest | Out-Null
+
+Write-Host "✓ Задача '$taskName' создана (ежедневно в 03:00)" -ForegroundColor Green
+
+pause
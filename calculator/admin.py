@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 from django import forms
-from .models import Material, PartName, StockItem, Order, OrderItem, Profile
+from .models import Material, PartName, StockItem, Order, OrderItem, Profile, CuttingRoute
 
 # Inline для профиля в админке пользователя
 class ProfileInline(admin.StackedInline):
@@ -111,4 +111,13 @@ class OrderAdmin(admin.ModelAdmin):
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['id', 'order', 'sequence_number', 'part_name', 'material', 'quantity', 'is_special']
     list_filter = ['order', 'material', 'part_name', 'is_special']
-    search_fields = ['order__order_number', 'part_name__name']
\ No newline at end of file
+    search_fields = ['order__order_number', 'part_name__name']
+
+@admin.register(CuttingRoute)
+class CuttingRouteAdmin(admin.ModelAdmin):
+    list_display = ['id', 'priority', 'section_type', 'material_pattern', 'min_diameter', 'max_diameter',
+                    'target_section', 'is_active']
+    list_display_links = ['id']
+    list_editable = ['priority', 'section_type', 'material_pattern', 'min_diameter', 'max_diameter',
+                     'target_section', 'is_active']
+    list_filter = ['target_section', 'section_type', 'is_active']
@@ -3,4 +3,10 @@ from django.apps import AppConfig
 class CalculatorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'calculator'
-    verbose_name = 'Калькулятор расходов материалов'
\ No newline at end of file
+    verbose_name = 'Калькулятор расходов материалов'
+
+    def ready(self):
+        # Подключение базы архива к соединениям (archive.attach_archive)
+        from . import archive  # noqa: F401
+        # Журнал редакций заказов (history.order_saved, history.order_item_changed)
+        from . import history  # noqa: F401
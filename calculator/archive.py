@@ -0,0 +1,282 @@
+"""Холодный архив заказов
+
+Заказы старше ARCHIVE_AFTER_DAYS переносятся вместе с деталями и счетчиком
+номеров в отдельную базу SQLite (ARCHIVE_DB_PATH), подключенную к
+соединению как схема archive. Таблицы основной базы, по которым строятся
+списки, поиск и счетчики, остаются небольшими. Файл архива создает первый
+перенос; пока его нет, архив пуст и к соединениям не подключается. Перенос идет порциями
+INSERT ... SELECT между схемами, без чтения строк в Python.
+
+Архив доступен только для чтения — поиск по собственному индексу FTS5,
+просмотр и печать; по запросу заказ возвращается в основную базу с прежним id.
+Ссылки складского журнала и деловых остатков на архивный заказ (SET_NULL)
+запоминаются и восстанавливаются вместе с заказом. Заказы с резервом
+сортамента не архивируются.
+"""
+import json
+import os
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from . import search
+from .models import (Order, OrderHistory, OrderItem, OrderRevision, OrderSequence, OrderSnapshot,
+                     StockReservation)
+
+SCHEMA = 'archive'
+ORDER_FTS = f'{SCHEMA}.{search.ORDER_FTS}'
+LINKS = 'calculator_archive_link'
+
+# Переносимые таблицы: модель и столбец с id заказа (в порядке вставки)
+TABLES = (
+    (Order, 'id'), (OrderItem, 'order_id'), (OrderSequence, 'order_id'), (OrderSnapshot, 'order_id'),
+    (OrderHistory, 'order_id'), (OrderRevision, 'order_id'),
+)
+
+_schema_ready = set()  # базы, для которых схема архива уже проверена этим процессом
+
+
+def location(conn=None):
+    """Путь к базе архива (для тестовой базы в памяти — URI общей памяти)"""
+    conn = conn or connection
+    if conn.is_in_memory_db():
+        return f'file:memorydb_{SCHEMA}?mode=memory&cache=shared'
+    return settings.ARCHIVE_DB_PATH
+
+
+def _attach(conn, create=False):
+    """Подключает архив к соединению; False — архива нет (файл создается только при create)
+
+    ATTACH невозможен внутри транзакции: в ней подключается только уже подключенный архив.
+    """
+    raw = conn.connection
+    if any(row[1] == SCHEMA for row in raw.execute('PRAGMA database_list')):
+        return True
+    path = location(conn)
+    if not (create or conn.is_in_memory_db() or os.path.exists(path)) or conn.in_atomic_block:
+        return False
+    raw.execute(f'ATTACH DATABASE ? AS {SCHEMA}', [path])
+    return True
+
+
+@receiver(connection_created)
+def attach_archive(sender, connection, **kwargs):
+    """Архив подключается при открытии соединения, если его файл уже есть"""
+    if connection.vendor == 'sqlite' and connection.alias == 'default':
+        _attach(connection)
+
+
+def attached(create=False):
+    """Архив подключен к текущему соединению (подключается, если файл появился позже)"""
+    connection.ensure_connection()
+    return _attach(connection, create)
+
+
+def _columns(cursor, schema, table):
+    cursor.execute(f'PRAGMA {schema}.table_info({table})')
+    return [row[1] for row in cursor.fetchall()]
+
+
+def _id_list(ids):
+    return ', '.join(str(int(order_id)) for order_id in ids)
+
+
+def _links():
+    """Ссылки на заказ, которые при удалении заказа обнуляются: [(таблица, столбец)]"""
+    return [
+        (relation.related_model._meta.db_table, relation.field.column)
+        for relation in Order._meta.related_objects
+        if relation.on_delete is models.SET_NULL
+    ]
+
+
+def _dependent_tables():
+    """Прочие таблицы, удаляемые вместе с заказом (кэш шаблона детали и т.п.)"""
+    archived = {model for model, _ in TABLES}
+    return [
+        (relation.related_model._meta.db_table, relation.field.column)
+        for relation in Order._meta.related_objects
+        if relation.on_delete is models.CASCADE and relation.related_model not in archived
+    ]
+
+
+def ensure_schema(cursor):
+    """Создает таблицы архива и добавляет столбцы, появившиеся в основной базе после миграций"""
+    name = connection.settings_dict['NAME']
+    if name in _schema_ready:
+        return
+    for model, key in TABLES:
+        table = model._meta.db_table
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {SCHEMA}.{table} AS SELECT * FROM main.{table} WHERE 0')
+        archived = set(_columns(cursor, SCHEMA, table))
+        for column in _columns(cursor, 'main', table):
+            if column not in archived:
+                cursor.execute(f'ALTER TABLE {SCHEMA}.{table} ADD COLUMN "{column}"')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {SCHEMA}.{table}_archive_idx ON {table} ({key})')
+    cursor.execute(
+        f'CREATE TABLE IF NOT EXISTS {SCHEMA}.{LINKS} '
+        f'(order_id INTEGER NOT NULL, table_name TEXT NOT NULL, column_name TEXT NOT NULL, row_id INTEGER NOT NULL)'
+    )
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {SCHEMA}.{LINKS}_order_idx ON {LINKS} (order_id)')
+    cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {ORDER_FTS} USING fts5({search.ORDER_FTS_COLUMNS})')
+    # Схема считается готовой только после фиксации (DDL откатывается вместе с транзакцией)
+    transaction.on_commit(lambda: _schema_ready.add(name))
+
+
+def _copy(cursor, source, target, table, key, id_list):
+    columns = set(_columns(cursor, source, table))
+    columns = ', '.join(f'"{column}"' for column in _columns(cursor, target, table) if column in columns)
+    cursor.execute(
+        f'INSERT INTO {target}.{table} ({columns}) SELECT {columns} FROM {source}.{table} WHERE {key} IN ({id_list})'
+    )
+
+
+def candidates(before):
+    """id заказов, созданных до before и не держащих резерв сортамента"""
+    return (Order.objects.filter(created_at__lt=before)
+            .exclude(id__in=StockReservation.objects.values('order_id'))
+            .order_by('id').values_list('id', flat=True))
+
+
+def archive_orders(ids):
+    """Переносит заказы в архив одной транзакцией; возвращает число перенесенных"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    if not attached(create=True):
+        raise RuntimeError('Архив не подключен: первый перенос нельзя выполнять внутри транзакции')
+    id_list = _id_list(ids)
+    with transaction.atomic(), connection.cursor() as cursor:
+        ensure_schema(cursor)
+        for model, key in TABLES:
+            _copy(cursor, 'main', SCHEMA, model._meta.db_table, key, id_list)
+        search.insert_order_documents(cursor, f'o.id IN ({id_list})', ORDER_FTS)
+        for table, column in _links():
+            cursor.execute(
+                f'INSERT INTO {SCHEMA}.{LINKS} (order_id, table_name, column_name, row_id) '
+                f'SELECT {column}, %s, %s, id FROM main.{table} WHERE {column} IN ({id_list})',
+                [table, column],
+            )
+            cursor.execute(f'UPDATE main.{table} SET {column} = NULL WHERE {column} IN ({id_list})')
+        for table, column in _dependent_tables():
+            cursor.execute(f'DELETE FROM main.{table} WHERE {column} IN ({id_list})')
+        # Заказы удаляются раньше деталей: триггер поиска по удаленной детали тогда
+        # не пересобирает документ заказа (внешние ключи проверяются при фиксации)
+        for model, key in TABLES:
+            cursor.execute(f'DELETE FROM main.{model._meta.db_table} WHERE {key} IN ({id_list})')
+    return len(ids)
+
+
+def archive_before(before, batch_size=200, progress=None):
+    """Архивирует все подходящие заказы порциями по batch_size (транзакция на порцию)"""
+    total = 0
+    while True:
+        ids = list(candidates(before)[:batch_size])
+        if not ids:
+            return total
+        total += archive_orders(ids)
+        if progress:
+            progress(total)
+
+
+def restore_orders(ids):
+    """Возвращает заказы из архива в основную базу с прежними id; возвращает число восстановленных"""
+    if not attached():
+        return 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        ensure_schema(cursor)
+        cursor.execute(f'SELECT id FROM {SCHEMA}.{Order._meta.db_table} WHERE id IN ({_id_list(ids) or "NULL"})')
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return 0
+        id_list = _id_list(ids)
+        for model, key in TABLES:
+            _copy(cursor, SCHEMA, 'main', model._meta.db_table, key, id_list)
+            cursor.execute(f'DELETE FROM {SCHEMA}.{model._meta.db_table} WHERE {key} IN ({id_list})')
+        for table, column in _links():
+            cursor.execute(
+                f'UPDATE main.{table} SET {column} = ('
+                f'SELECT l.order_id FROM {SCHEMA}.{LINKS} l WHERE l.table_name = %s AND l.column_name = %s '
+                f'AND l.row_id = main.{table}.id AND l.order_id IN ({id_list})) '
+                f'WHERE {column} IS NULL AND id IN ('
+                f'SELECT row_id FROM {SCHEMA}.{LINKS} WHERE table_name = %s AND column_name = %s '
+                f'AND order_id IN ({id_list}))',
+                [table, column, table, column],
+            )
+        cursor.execute(f'DELETE FROM {SCHEMA}.{LINKS} WHERE order_id IN ({id_list})')
+        cursor.execute(f'DELETE FROM {ORDER_FTS} WHERE rowid IN ({id_list})')
+    return len(ids)
+
+
+def is_archived(order_id):
+    if not attached():
+        return False
+    with connection.cursor() as cursor:
+        ensure_schema(cursor)
+        cursor.execute(f'SELECT 1 FROM {SCHEMA}.{Order._meta.db_table} WHERE id = %s', [order_id])
+        return cursor.fetchone() is not None
+
+
+def find_orders(text=None, limit=200):
+    """Архивные заказы: по запросу — от наиболее релевантного, без запроса — новые первыми"""
+    table = f'{SCHEMA}.{Order._meta.db_table}'
+    query = search.match_query(text) if text else None
+    if not attached():
+        return []
+    with connection.cursor() as cursor:
+        ensure_schema(cursor)
+    if text and query is None:
+        return []
+    if query:
+        weights = ', '.join(map(str, search.ORDER_WEIGHTS))
+        sql = (f'SELECT o.* FROM {ORDER_FTS} f JOIN {table} o ON o.id = f.rowid '
+               f'WHERE {search.ORDER_FTS} MATCH %s ORDER BY bm25({search.ORDER_FTS}, {weights}) LIMIT %s')
+        params = [query, limit]
+    else:
+        sql = f'SELECT * FROM {table} ORDER BY created_at DESC LIMIT %s'
+        params = [limit]
+    return list(Order.objects.raw(sql, params).prefetch_related('user'))
+
+
+def count_matches(text):
+    """Число архивных заказов, подходящих под поисковый запрос"""
+    query = search.match_query(text)
+    if query is None or not attached():
+        return 0
+    with connection.cursor() as cursor:
+        ensure_schema(cursor)
+        cursor.execute(f'SELECT count(*) FROM {ORDER_FTS} WHERE {search.ORDER_FTS} MATCH %s', [query])
+        return cursor.fetchone()[0]
+
+
+def load_order(order_id):
+    """Архивный заказ и его детали — несохраняемые модели для просмотра и печати; None, если нет"""
+    if not attached():
+        return None, []
+    with connection.cursor() as cursor:
+        ensure_schema(cursor)
+    orders = list(Order.objects.raw(f'SELECT * FROM {SCHEMA}.{Order._meta.db_table} WHERE id = %s', [order_id]))
+    if not orders:
+        return None, []
+    order = orders[0]
+    items = list(
+        OrderItem.objects.raw(f'SELECT * FROM {SCHEMA}.{OrderItem._meta.db_table} WHERE order_id = %s', [order_id])
+        .prefetch_related('part_name', 'material', 'stock_item')
+    )
+    for item in items:
+        item.order = order
+    items.sort(key=lambda item: (item.sort_key, item.part_name.name if item.part_name else ''))
+    return order, items
+
+
+def load_report(order_id, name):
+    """HTML печатной формы из снимка архивного заказа; None — заказ не выпускался"""
+    if not attached():
+        return None
+    with connection.cursor() as cursor:
+        ensure_schema(cursor)
+        cursor.execute(f'SELECT reports FROM {SCHEMA}.{OrderSnapshot._meta.db_table} WHERE order_id = %s', [order_id])
+        row = cursor.fetchone()
+    return json.loads(row[0])[name] if row else None
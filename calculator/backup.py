@@ -0,0 +1,197 @@
+"""Резервные копии базы SQLite без остановки сервиса
+
+Копия снимается через online backup API SQLite порциями по несколько сотен
+страниц с паузой между ними: чтение базы блокируется только на время одной
+порции, а если во время копирования база изменилась, SQLite продолжает копию
+с учетом изменений — файл копии всегда согласован. Готовая копия проверяется
+PRAGMA integrity_check, сжимается gzip и только после этого появляется в
+каталоге под окончательным именем; старые копии сверх заданного числа удаляются.
+
+Если подключен архив заказов (archive.py), его база копируется тем же способом
+в парный файл archive_<время>: копия db_<время> и ее пара восстанавливаются и
+удаляются вместе.
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+from . import archive
+
+PREFIX = 'db_'
+ARCHIVE_PREFIX = 'archive_'
+SUFFIXES = ('.sqlite3.gz', '.sqlite3')
+
+
+class BackupError(Exception):
+    """Копия не создана или не прошла проверку"""
+
+
+def backup_dir():
+    return Path(settings.BACKUP_DIR)
+
+
+def list_backups(directory=None):
+    """Копии в каталоге, от новой к старой"""
+    directory = Path(directory or backup_dir())
+    if not directory.is_dir():
+        return []
+    backups = [path for path in directory.iterdir()
+               if path.name.startswith(PREFIX) and path.name.endswith(SUFFIXES)]
+    return sorted(backups, key=lambda path: path.name, reverse=True)
+
+
+def archive_copy(path):
+    """Парная копия базы архива для копии path (файла может не быть)"""
+    path = Path(path)
+    return path.with_name(ARCHIVE_PREFIX + path.name[len(PREFIX):])
+
+
+def check_integrity(path):
+    """Результат PRAGMA integrity_check; пустой список — файл исправен"""
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = [row[0] for row in connection.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:
+        rows = [str(e)]
+    finally:
+        connection.close()
+    return [] if rows == ['ok'] else rows
+
+
+def _raw_connection():
+    """sqlite3-соединение Django (то же, что у сервиса, в том числе в тестах)"""
+    connection = connections['default']
+    connection.ensure_connection()
+    return connection.connection
+
+
+def _copy(source, target, pages, sleep, progress=None, busy_timeout=60, name='main'):
+    """Копирование backup API; если база занята дольше busy_timeout секунд — ошибка"""
+    busy_steps = [0]
+
+    def report(status, remaining, total):
+        if status in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+            busy_steps[0] += 1
+            if busy_steps[0] * max(sleep, 0.001) > busy_timeout:
+                raise BackupError('База занята другой транзакцией — копирование прервано')
+            return
+        busy_steps[0] = 0
+        if progress:
+            progress(total - remaining, total)
+    source.backup(target, pages=pages, progress=report, sleep=sleep, name=name)
+
+
+def _snapshot(source, name, target_path, pages, sleep, progress):
+    """Копия схемы name соединения source: проверка, сжатие, переименование в target_path"""
+    directory = target_path.parent
+    fd, raw_path = tempfile.mkstemp(prefix='.backup-', suffix='.sqlite3', dir=directory)
+    os.close(fd)
+    try:
+        target = sqlite3.connect(raw_path)
+        try:
+            _copy(source, target, pages, sleep, progress, name=name)
+        finally:
+            target.close()
+
+        errors = check_integrity(raw_path)
+        if errors:
+            raise BackupError('Копия не прошла проверку целостности: ' + '; '.join(errors[:5]))
+
+        partial_path = directory / ('.' + target_path.name + '.partial')
+        if target_path.name.endswith('.gz'):
+            with open(raw_path, 'rb') as raw, gzip.open(partial_path, 'wb', compresslevel=6) as packed:
+                shutil.copyfileobj(raw, packed, 1024 * 1024)
+        else:
+            shutil.copyfile(raw_path, partial_path)
+        os.replace(partial_path, target_path)
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+
+def create_backup(directory=None, pages=256, sleep=0.005, compress=True, keep=None, progress=None):
+    """Снимает копию базы (и архива, если он есть); возвращает путь к файлу копии базы
+
+    pages — страниц за один шаг (чем меньше, тем короче блокировки),
+    keep — сколько последних копий оставить (None — не удалять).
+    """
+    directory = Path(directory or backup_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{PREFIX}{datetime.now():%Y-%m-%d_%H-%M-%S}.sqlite3"
+    target_path = directory / (name + '.gz' if compress else name)
+
+    # Архив копируется первым: файл копии базы появляется, только когда пара готова
+    source = _raw_connection()
+    if archive.attached():
+        _snapshot(source, archive.SCHEMA, archive_copy(target_path), pages, sleep, progress)
+    try:
+        _snapshot(source, 'main', target_path, pages, sleep, progress)
+    except BaseException:
+        archive_copy(target_path).unlink(missing_ok=True)
+        raise
+
+    if keep is not None:
+        rotate(directory, keep)
+    return target_path
+
+
+def rotate(directory, keep):
+    """Удаляет копии сверх keep последних; возвращает удаленные файлы"""
+    removed = list_backups(directory)[max(keep, 1):]
+    for path in removed:
+        path.unlink()
+        archive_copy(path).unlink(missing_ok=True)
+    return removed
+
+
+def _unpacked(path, directory):
+    """Несжатый файл копии для восстановления (временный, если копия сжата)"""
+    if not str(path).endswith('.gz'):
+        return Path(path), False
+    fd, raw_path = tempfile.mkstemp(prefix='.restore-', suffix='.sqlite3', dir=directory)
+    with os.fdopen(fd, 'wb') as raw, gzip.open(path, 'rb') as packed:
+        shutil.copyfileobj(packed, raw, 1024 * 1024)
+    return Path(raw_path), True
+
+
+def restore_backup(path, progress=None):
+    """Восстанавливает базу (и архив, если у копии есть пара) из копии поверх текущей
+
+    Копии проверяются до того, как текущая база будет затронута. Данные
+    переносятся тем же backup API одним шагом: соединения других процессов
+    остаются открытыми и при следующем запросе видят восстановленную базу.
+    """
+    path = Path(path)
+    if not path.is_file():
+        raise BackupError(f'Файл копии не найден: {path}')
+    copies = [path] + [copy for copy in [archive_copy(path)] if copy.is_file()]
+    unpacked = []
+    try:
+        for copy in copies:
+            raw_path, temporary = _unpacked(copy, copy.parent)
+            unpacked.append((raw_path, temporary))
+            errors = check_integrity(raw_path)
+            if errors:
+                raise BackupError(f'Копия {copy.name} повреждена: ' + '; '.join(errors[:5]))
+        for copy, (raw_path, _) in zip(copies, unpacked):
+            # Архив — отдельная база: его копия пишется в файл архива своим соединением
+            main = copy == path
+            target = _raw_connection() if main else sqlite3.connect(archive.location(), uri=True)
+            source = sqlite3.connect(f'file:{raw_path}?mode=ro', uri=True)
+            try:
+                _copy(source, target, -1, 0, progress)
+            finally:
+                source.close()
+                if not main:
+                    target.close()
+    finally:
+        for raw_path, temporary in unpacked:
+            if temporary:
+                os.remove(raw_path)
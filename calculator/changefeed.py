@@ -0,0 +1,98 @@
+"""Лента изменений для внешних систем (ERP)
+
+Каждая вставка, изменение и удаление строк таблиц FEED дописывает триггером
+базы строку в ChangeLog: тип объекта, id и признак удаления. Триггеры, как и у
+поиска, учитывают массовые операции без сигналов (update, bulk_create,
+пересчет весов деталей). Архивирование заказа для ленты выглядит как удаление,
+возврат из архива — как создание.
+
+Потребитель запоминает курсор — id последней полученной записи — и
+запрашивает changes(since=курсор). Порция сжимается: на каждый объект одна
+запись — последняя в порции, со значениями полей на момент запроса (по
+запросу на тип объекта). Первый запрос с since=0 отдает все объекты: миграция
+заполнила журнал текущими строками.
+
+Триггеры созданы миграцией 0025. Журнал сжимает prune() (команда
+prune_change_log по расписанию): записи старше CHANGE_LOG_KEEP_DAYS дней,
+после которых у объекта есть более новая запись, и старые записи об удалении.
+Потребитель, отстающий больше чем на этот срок, может пропустить удаления.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChangeLog, Material, Order, OrderItem, PartName, StockItem
+
+FEED = {'order': Order, 'item': OrderItem, 'material': Material, 'stock': StockItem, 'part': PartName}
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 5000
+
+def _fields(model):
+    return [field.attname for field in model._meta.concrete_fields]
+
+
+@transaction.atomic
+def changes(since=0, limit=DEFAULT_LIMIT):
+    """Порция изменений после курсора since: {'next', 'more', 'changes': [...]}
+
+    Запись порции — {'seq', 'type', 'id', 'deleted', 'data'}; data — значения
+    полей объекта, у удаленного — None. Чтение идет в одной транзакции, поэтому
+    журнал и значения согласованы между собой.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    entries = list(ChangeLog.objects.filter(id__gt=since).order_by('id')
+                   .values_list('id', 'kind', 'object_id', 'deleted')[:limit])
+    latest = {}
+    for seq, kind, object_id, deleted in entries:
+        latest[kind, object_id] = (seq, deleted)
+
+    ids = {}
+    for (kind, object_id), (_, deleted) in latest.items():
+        if not deleted and kind in FEED:
+            ids.setdefault(kind, []).append(object_id)
+    rows = {}
+    for kind, object_ids in ids.items():
+        model = FEED[kind]
+        for row in model.objects.filter(id__in=object_ids).order_by().values(*_fields(model)):
+            rows[kind, row['id']] = row
+
+    result = []
+    for (kind, object_id), (seq, _) in sorted(latest.items(), key=lambda item: item[1][0]):
+        data = rows.get((kind, object_id))
+        # Строка удалена после записи в журнал — удаление придет позже, но его можно отдать уже сейчас
+        result.append({'seq': seq, 'type': kind, 'id': object_id, 'deleted': data is None, 'data': data})
+    return {
+        'next': entries[-1][0] if entries else since,
+        'more': len(entries) == limit,
+        'changes': result,
+    }
+
+
+def prune(days=None, batch_size=1000):
+    """Удаляет записи старше days дней, уже не нужные для ленты; возвращает число удаленных
+
+    Остается последняя запись каждого существующего объекта, поэтому чтение с
+    любого курсора по-прежнему отдает все объекты. Удаление идет порциями в
+    отдельных транзакциях, чтобы не блокировать запись в SQLite надолго.
+    """
+    before = timezone.now() - timedelta(days=days or settings.CHANGE_LOG_KEEP_DAYS)
+    # id и created_at растут вместе: граница по дате — наибольший id старше нее
+    boundary = (ChangeLog.objects.filter(created_at__lt=before).order_by('-id')
+                .values_list('id', flat=True).first())
+    if boundary is None:
+        return 0
+    latest = {}
+    for seq, kind, object_id in ChangeLog.objects.order_by('id').values_list('id', 'kind', 'object_id').iterator():
+        latest[kind, object_id] = seq
+    obsolete = [
+        seq for seq, kind, object_id, deleted in
+        ChangeLog.objects.filter(id__lte=boundary).order_by('id')
+        .values_list('id', 'kind', 'object_id', 'deleted').iterator()
+        if deleted or latest.get((kind, object_id)) != seq
+    ]
+    for start in range(0, len(obsolete), batch_size):
+        with transaction.atomic():
+            ChangeLog.objects.filter(id__in=obsolete[start:start + batch_size]).delete()
+    return len(obsolete)
@@ -0,0 +1,142 @@
+"""Сравнение двух заказов (например, исходного и его копии после правок)
+
+Детали обоих заказов читаются одним запросом. Строки сопоставляются через
+словари по ключам убывающей строгости: (номер, деталь, обозначение), затем
+(деталь, обозначение) — перенумерованные строки, затем номер — замененная
+деталь на той же позиции. Каждый проход линейный и идет только по строкам,
+не сопоставленным ранее, а массы позиций и итоги по материалам считаются в том
+же проходе, в котором строки раскладываются по заказам. Заказы на несколько
+тысяч строк сравниваются за доли секунды.
+"""
+from collections import defaultdict, deque
+
+from . import weights
+from .history import ITEM_FIELDS, ITEM_LABELS, ORDER_FIELDS, ORDER_LABELS
+from .models import OrderItem, StockItem, sequence_prefix
+
+MATCH_KEYS = (
+    ('sequence_number', 'part_name_id', 'designation'),
+    ('part_name_id', 'designation'),
+    ('sequence_number',),
+)
+ROW_FIELDS = ('id', 'order_id', 'weight_mg', 'part_name__name', 'material__name') + ITEM_FIELDS
+NAMES = {'part_name_id': 'part_name__name', 'material_id': 'material__name'}
+
+
+def _sort_key(row):
+    prefix = sequence_prefix(row['sequence_number'] or '')
+    return (prefix is None, prefix or 0, row['sequence_number'] or '')
+
+
+def _display(field, value, row, stock_names):
+    if value is None or value == '':
+        return '—'
+    if field in NAMES:
+        return row[NAMES[field]]
+    if field == 'stock_item_id':
+        return stock_names.get(value, f'#{value}')
+    if isinstance(value, bool):
+        return 'да' if value else 'нет'
+    return value
+
+
+def _load(old_order, new_order, materials):
+    """Строки обоих заказов с массой позиции; попутно — итоги по материалам
+
+    Стороны различаются позицией, а не id заказа: заказ, сравниваемый сам с
+    собой, попадает на обе стороны копиями строк.
+    """
+    sides = defaultdict(list)
+    for side, order in enumerate((old_order, new_order)):
+        sides[order.id].append((weights.coefficient_units(order.coefficient), order.order_quantity, side))
+    rows = ([], [])
+    for values in OrderItem.objects.filter(order_id__in=list(sides)).order_by('id').values_list(*ROW_FIELDS):
+        for coefficient, quantity, side in sides[values[1]]:
+            row = dict(zip(ROW_FIELDS, values))
+            row['total_mg'] = weights.total_mg(row['weight_mg'], row['quantity'], coefficient) * quantity
+            materials[row['material__name'] or '—'][side] += row['total_mg']
+            rows[side].append(row)
+    return rows
+
+
+def _match(old_rows, new_rows):
+    """Пары сопоставленных строк и оставшиеся без пары строки обоих заказов"""
+    pairs = []
+    for fields in MATCH_KEYS:
+        if not old_rows or not new_rows:
+            break
+        index = defaultdict(deque)
+        for row in old_rows:
+            index[tuple(row[field] for field in fields)].append(row)
+        rest = []
+        for row in new_rows:
+            bucket = index.get(tuple(row[field] for field in fields))
+            if bucket:
+                pairs.append((bucket.popleft(), row))
+            else:
+                rest.append(row)
+        matched = {id(old) for old, _ in pairs}
+        old_rows = [row for row in old_rows if id(row) not in matched]
+        new_rows = rest
+    return pairs, old_rows, new_rows
+
+
+def compare_orders(old_order, new_order, limit=500):
+    """Различия заказов: поля заказа, добавленные/удаленные/измененные строки и массы по материалам
+
+    limit — сколько строк каждого вида вернуть для показа (счетчики — полные).
+    """
+    materials = defaultdict(lambda: [0, 0])
+    old_rows, new_rows = _load(old_order, new_order, materials)
+    pairs, removed, added = _match(old_rows, new_rows)
+
+    changed = []
+    unchanged = 0
+    for old, new in pairs:
+        fields = [field for field in ITEM_FIELDS if old[field] != new[field]]
+        if fields:
+            changed.append((old, new, fields))
+        else:
+            unchanged += 1
+    changed.sort(key=lambda change: _sort_key(change[1]))
+    added.sort(key=_sort_key)
+    removed.sort(key=_sort_key)
+
+    # Наименования сортамента нужны только для показываемых изменений сортамента
+    stock_ids = {row[0]['stock_item_id'] for row in changed[:limit] if 'stock_item_id' in row[2]}
+    stock_ids |= {row[1]['stock_item_id'] for row in changed[:limit] if 'stock_item_id' in row[2]}
+    stock_ids.discard(None)
+    stock_names = ({pk: str(stock) for pk, stock in
+                    StockItem.objects.select_related('material').in_bulk(stock_ids).items()} if stock_ids else {})
+
+    order_rows = []
+    for field in ORDER_FIELDS:
+        before, after = getattr(old_order, field), getattr(new_order, field)
+        if before != after:
+            order_rows.append({'label': ORDER_LABELS[field], 'old': before if before not in (None, '') else '—',
+                               'new': after if after not in (None, '') else '—'})
+
+    material_rows = [
+        {'name': name, 'old': weights.mg_to_kg(old_mg), 'new': weights.mg_to_kg(new_mg),
+         'delta_mg': new_mg - old_mg, 'delta': weights.mg_to_kg(abs(new_mg - old_mg))}
+        for name, (old_mg, new_mg) in sorted(materials.items())
+    ]
+    old_total = sum(old_mg for old_mg, _ in materials.values())
+    new_total = sum(new_mg for _, new_mg in materials.values())
+    return {
+        'order': order_rows,
+        'added': added[:limit],
+        'removed': removed[:limit],
+        'changed': [{
+            'old': old,
+            'new': new,
+            'delta_mg': new['total_mg'] - old['total_mg'],
+            'fields': [{'label': ITEM_LABELS[field], 'old': _display(field, old[field], old, stock_names),
+                        'new': _display(field, new[field], new, stock_names)} for field in fields],
+        } for old, new, fields in changed[:limit]],
+        'counts': {'added': len(added), 'removed': len(removed), 'changed': len(changed), 'unchanged': unchanged},
+        'materials': material_rows,
+        'total': {'old': weights.mg_to_kg(old_total), 'new': weights.mg_to_kg(new_total),
+                  'delta_mg': new_total - old_total, 'delta': weights.mg_to_kg(abs(new_total - old_total))},
+        'limit': limit,
+    }
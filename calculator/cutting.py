@@ -0,0 +1,167 @@
+"""Задание на заготовку: разделы задания и сводный план раскроя по нескольким заказам
+
+Разделы определяются правилами CuttingRoute. Правила компилируются в таблицу
+по паре (материал, сортамент): для каждой пары остается упорядоченный список
+порогов диаметра с разделом, обычно из одного элемента без порогов. Таблица
+заполняется по мере обращения и сбрасывается вместе с версией справочников,
+поэтому раздел детали — поиск в словаре.
+"""
+import threading
+
+from . import weights
+from .models import CuttingRoute, OrderItem, StockItem
+from .reference_cache import get_reference_version
+from .templatetags.custom_filters import format_decimal
+
+SECTION_ORDER = ('sheet', 'round', 'tube')
+SECTION_TITLES = {
+    'sheet': 'Листовой материал',
+    'round': 'Круг / лист (специальные материалы)',
+    'tube': 'Труба',
+}
+
+_lock = threading.Lock()
+_table = None  # (версия справочников, правила, {(material_id, stock_item_id): маршруты})
+
+
+def _load_rules():
+    return [
+        (
+            rule.material_pattern.strip().upper(), rule.section_type,
+            None if rule.min_diameter is None else weights.to_um(rule.min_diameter),
+            None if rule.max_diameter is None else weights.to_um(rule.max_diameter),
+            None if rule.target_section == 'skip' else rule.target_section,
+        )
+        for rule in CuttingRoute.objects.filter(is_active=True).order_by('priority', 'id')
+    ]
+
+
+def _get_table():
+    global _table
+    version = get_reference_version()
+    current = _table
+    if current is not None and current[0] == version:
+        return current
+    with _lock:
+        if _table is None or _table[0] != version:
+            _table = (version, _load_rules(), {})
+        return _table
+
+
+def compile_routes(rules, material_name, section_type):
+    """Правила, применимые к паре (материал, тип сортамента): [(от, до, раздел)] в мкм
+
+    Список обрывается на первом правиле без порогов диаметра — дальше
+    правила уже не проверяются.
+    """
+    name = (material_name or '').strip().upper()
+    routes = []
+    for pattern, rule_section_type, min_diameter, max_diameter, target in rules:
+        if rule_section_type and rule_section_type != section_type:
+            continue
+        if pattern and pattern not in name:
+            continue
+        routes.append((min_diameter, max_diameter, target))
+        if min_diameter is None and max_diameter is None:
+            break
+    return tuple(routes)
+
+
+def cutting_section(material_id, material_name, stock_item_id, section_type, diameter):
+    """Раздел задания на заготовку для детали; None — деталь в задание не входит"""
+    _, rules, table = _get_table()
+    key = (material_id, stock_item_id)
+    routes = table.get(key)
+    if routes is None:
+        routes = table[key] = compile_routes(rules, material_name, section_type)
+    if len(routes) == 1 and routes[0][0] is None and routes[0][1] is None:
+        return routes[0][2]
+    diameter_um = weights.to_um(diameter) if diameter else None
+    for min_diameter, max_diameter, target in routes:
+        if min_diameter is not None and (diameter_um is None or diameter_um <= min_diameter):
+            continue
+        if max_diameter is not None and (diameter_um is None or diameter_um > max_diameter):
+            continue
+        return target
+    return None
+
+
+def item_section(item):
+    """Раздел задания для модели детали заказа"""
+    return cutting_section(
+        item.material_id, item.material.name if item.material else '',
+        item.stock_item_id, item.stock_item.section_type, item.diameter,
+    )
+
+
+PLAN_FIELDS = (
+    'order_id', 'order__order_number', 'order__order_quantity', 'order__coefficient',
+    'stock_item_id', 'stock_item__section_type', 'material_id', 'material__name',
+    'quantity', 'length', 'width', 'height', 'diameter', 'weight_mg',
+)
+
+
+def blank_label(row):
+    if row['stock_item__section_type'] == 'sheet':
+        return f"{format_decimal(row['height'])}x{format_decimal(row['width'])}x{format_decimal(row['length'])}"
+    if row['stock_item__section_type'] == 'round':
+        return f"Ø{format_decimal(row['diameter'])}x{format_decimal(row['length'])}"
+    return f"L={format_decimal(row['length'])}"
+
+
+def blank_key(row):
+    """Одинаковые заготовки одного сортамента режутся за одну наладку"""
+    to_um = weights.to_um
+    return (to_um(row['length']), to_um(row['width']), to_um(row['height']), to_um(row['diameter']))
+
+
+def consolidated_plan(orders):
+    """Сводный план раскроя: заготовки выбранных заказов по сортаменту
+
+    Детали всех заказов читаются одним запросом без создания моделей,
+    сортамент — вторым. Для каждой заготовки сохраняется разбивка по заказам.
+    Возвращает список групп по разделам задания и сортаменту.
+    """
+    rows = (
+        OrderItem.objects.filter(order__in=orders, is_special=False, stock_item__isnull=False)
+        .order_by().values(*PLAN_FIELDS)
+    )
+    groups = {}
+    coefficients = {}
+    for row in rows.iterator(chunk_size=2000):
+        section = cutting_section(row['material_id'], row['material__name'], row['stock_item_id'],
+                                  row['stock_item__section_type'], row['diameter'])
+        if section is None:
+            continue
+        group = groups.setdefault((section, row['stock_item_id']), {
+            'section': section, 'stock_item_id': row['stock_item_id'], 'blanks': {},
+            'pieces': 0, 'length_um': 0, 'mass_mg': 0,
+        })
+        pieces = row['quantity'] * row['order__order_quantity']
+        coefficient = coefficients.get(row['order_id'])
+        if coefficient is None:
+            coefficient = coefficients[row['order_id']] = weights.coefficient_units(row['order__coefficient'])
+        blank = group['blanks'].setdefault(blank_key(row), {
+            'label': blank_label(row), 'pieces': 0, 'orders': {},
+        })
+        blank['pieces'] += pieces
+        blank['orders'][row['order__order_number']] = blank['orders'].get(row['order__order_number'], 0) + pieces
+        group['pieces'] += pieces
+        group['length_um'] += weights.to_um(row['length']) * pieces
+        group['mass_mg'] += weights.total_mg(row['weight_mg'], pieces, coefficient)
+
+    stock_items = StockItem.objects.select_related('material').in_bulk({key[1] for key in groups})
+    plan = []
+    for group in groups.values():
+        group['stock_item'] = stock_items[group['stock_item_id']]
+        group['title'] = SECTION_TITLES[group['section']]
+        # Крупные заготовки — первыми
+        group['blanks'] = [
+            dict(blank, orders=sorted(blank['orders'].items()))
+            for _, blank in sorted(group['blanks'].items(), reverse=True)
+        ]
+        group['length_mm'] = weights.um_to_mm(group['length_um'])
+        group['mass_kg'] = weights.mg_to_kg(group['mass_mg'])
+        plan.append(group)
+    plan.sort(key=lambda group: (SECTION_ORDER.index(group['section']), str(group['stock_item'])))
+    return plan
@@ -0,0 +1,239 @@
+"""Генератор синтетических данных для нагрузочных тестов и бенчмарков
+
+Все данные детерминированы зерном генератора, вставка выполняется порциями
+через bulk_create, поэтому база на миллион деталей строится за минуты.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Material, PartName, StockItem, Order, OrderItem, OrderSequence, sequence_prefix
+from . import weights
+
+# (название, плотность г/см³, относительная частота в заказах)
+MATERIALS = [
+    ('Сталь 45', '7.85', 30), ('Сталь 40Х', '7.85', 15), ('Сталь 20', '7.86', 8),
+    ('Ст3', '7.85', 10), ('12Х18Н10Т', '7.90', 6), ('1.2343', '7.80', 4),
+    ('4Х5МФС', '7.80', 4), ('65Г', '7.85', 3), ('У8А', '7.83', 2), ('ШХ15', '7.81', 2),
+    ('Д16Т', '2.78', 5), ('АМг6', '2.64', 4), ('ЛС59-1', '8.45', 2), ('БрАЖ9-4', '7.50', 1),
+]
+
+PART_NAMES = [
+    'Вал', 'Втулка', 'Фланец', 'Шестерня', 'Ось', 'Корпус', 'Крышка', 'Пластина',
+    'Кронштейн', 'Шайба', 'Гайка', 'Штуцер', 'Палец', 'Планка', 'Основание',
+    'Матрица', 'Пуансон', 'Прокладка', 'Стойка', 'Упор', 'Ролик', 'Кольцо',
+    'Направляющая', 'Рычаг', 'Толкатель', 'Съемник', 'Фиксатор', 'Проставка',
+]
+
+PART_MODIFIERS = [
+    '', 'ведущий', 'ведомый', 'распорная', 'опорная', 'промежуточная', 'нижняя',
+    'верхняя', 'регулировочная', 'установочный', 'малый', 'большой', 'левый', 'правый',
+]
+
+ORDER_NAMES = [
+    'Пресс-форма', 'Штамп вырубной', 'Штамп гибочный', 'Кондуктор', 'Приспособление',
+    'Редуктор', 'Оснастка', 'Ремонт узла', 'Литьевая форма', 'Станина',
+]
+
+# Типовые размеры сортамента по типам
+SHEET_THICKNESS = [1, 2, 3, 4, 5, 6, 8, 10, 12, 16, 20, 25, 30, 40, 50, 60, 80]
+ROUND_DIAMETERS = [8, 10, 12, 16, 20, 25, 30, 36, 40, 45, 50, 56, 63, 70, 80, 90, 100, 120, 140, 160, 200]
+HEX_SIZES = [10, 12, 14, 17, 19, 22, 24, 27, 30, 36, 41, 46, 55]
+TUBE_SIZES = [(20, 2), (25, 2.5), (32, 3), (42, 3.5), (57, 4), (76, 5), (89, 6), (108, 6), (133, 8)]
+
+# Доли типов сортамента среди позиций заказа
+SECTION_WEIGHTS = [('round', 45), ('sheet', 35), ('hexagon', 10), ('tube', 10)]
+
+SPECIAL_ITEM_RATE = 0.03
+SUB_ITEM_RATE = 0.08
+DESIGNATION_RATE = 0.4
+
+
+class DatasetGenerator:
+    """Создает справочники, заказы и детали порциями по chunk_size строк"""
+
+    def __init__(self, seed=0, chunk_size=5000, log=None):
+        self.rng = random.Random(seed)
+        self.chunk_size = chunk_size
+        self.log = log or (lambda message: None)
+
+    # ---- Справочники ----
+
+    def users(self, count, password=None, prefix='user_'):
+        users = []
+        for n in range(1, count + 1):
+            user, _ = User.objects.get_or_create(
+                username=f'{prefix}{n:02d}',
+                defaults={'last_name': self.rng.choice(['Иванов', 'Петров', 'Сидоров', 'Кузнецов', 'Смирнов']),
+                          'first_name': self.rng.choice(['Иван', 'Петр', 'Алексей', 'Сергей', 'Андрей'])},
+            )
+            if password:
+                user.set_password(password)
+                user.save()
+            users.append(user)
+        return users
+
+    def materials(self, count):
+        objs = []
+        for n in range(count):
+            name, density, _ = MATERIALS[n % len(MATERIALS)]
+            if n >= len(MATERIALS):
+                name = f'{name} вар. {n // len(MATERIALS)}'
+            objs.append(Material(name=name, density=Decimal(density)))
+        existing = set(Material.objects.values_list('name', flat=True))
+        Material.objects.bulk_create([m for m in objs if m.name not in existing], batch_size=self.chunk_size)
+        return list(Material.objects.filter(name__in=[m.name for m in objs]).order_by('id'))
+
+    def part_names(self, count):
+        names = []
+        for n in range(count):
+            base = PART_NAMES[n % len(PART_NAMES)]
+            modifier = PART_MODIFIERS[(n // len(PART_NAMES)) % len(PART_MODIFIERS)]
+            name = f'{base} {modifier}'.strip()
+            variant = n // (len(PART_NAMES) * len(PART_MODIFIERS))
+            if variant:
+                name = f'{name} {variant}'
+            names.append(name)
+        PartName.objects.bulk_create(
+            [PartName(name=name) for name in names], batch_size=self.chunk_size, ignore_conflicts=True
+        )
+        return list(PartName.objects.filter(name__in=names).order_by('name'))
+
+    def stock_items(self, materials, per_material):
+        objs = []
+        for material in materials:
+            for n in range(per_material):
+                section_type = self._section_type()
+                if section_type == 'sheet':
+                    objs.append(StockItem(material=material, section_type='sheet',
+                                          width=SHEET_THICKNESS[n % len(SHEET_THICKNESS)]))
+                elif section_type == 'round':
+                    objs.append(StockItem(material=material, section_type='round',
+                                          diameter=ROUND_DIAMETERS[n % len(ROUND_DIAMETERS)]))
+                elif section_type == 'hexagon':
+                    objs.append(StockItem(material=material, section_type='hexagon',
+                                          key_size=HEX_SIZES[n % len(HEX_SIZES)]))
+                else:
+                    outer, wall = TUBE_SIZES[n % len(TUBE_SIZES)]
+                    objs.append(StockItem(material=material, section_type='tube',
+                                          outer_diameter=outer, wall_thickness=Decimal(str(wall))))
+        # bulk_create не вызывает сигналы — характеристики сечения заполняем сами
+        for stock_item in objs:
+            stock_item.update_section_properties()
+        return StockItem.objects.bulk_create(objs, batch_size=self.chunk_size)
+
+    # ---- Заказы ----
+
+    def orders(self, count, users, stock_items, part_names, items_per_order=50, days=730):
+        """Создает count заказов со средним числом деталей items_per_order; возвращает число деталей"""
+        frequency = {name: weight for name, _, weight in MATERIALS}
+        material_weights = {
+            material_id: frequency.get(name.split(' вар. ')[0], 1)
+            for material_id, name in Material.objects.filter(
+                id__in={s.material_id for s in stock_items}
+            ).values_list('id', 'name')
+        }
+        by_section = {}
+        for stock_item in sorted(stock_items, key=lambda s: s.id):
+            by_section.setdefault(stock_item.section_type, []).append(stock_item)
+        self._stock_weights = {
+            section: [material_weights.get(s.material_id, 1) for s in section_stock]
+            for section, section_stock in by_section.items()
+        }
+        self._by_section = by_section
+        self._part_names = part_names
+
+        now = timezone.now()
+        orders_per_chunk = max(1, self.chunk_size // max(1, items_per_order))
+        total_items = 0
+        for start in range(0, count, orders_per_chunk):
+            size = min(orders_per_chunk, count - start)
+            with transaction.atomic():
+                orders = Order.objects.bulk_create([
+                    self._order(start + n, users) for n in range(size)
+                ])
+                # auto_now_add перезаписывает дату при вставке — распределяем по истории отдельно
+                for order in orders:
+                    order.created_at = now - timedelta(seconds=self.rng.randint(0, days * 86400))
+                Order.objects.bulk_update(orders, ['created_at'], batch_size=self.chunk_size)
+
+                items = []
+                sequences = []
+                for order in orders:
+                    order_items = self._order_items(order, items_per_order)
+                    items.extend(order_items)
+                    # Счетчик номеров сразу: иначе его создает первый запрос формы детали
+                    sequences.append(OrderSequence(order=order, last_number=max(
+                        sequence_prefix(item.sequence_number) or 0 for item in order_items)))
+                OrderItem.objects.bulk_create(items, batch_size=self.chunk_size)
+                OrderSequence.objects.bulk_create(sequences, batch_size=self.chunk_size)
+            total_items += len(items)
+            self.log(f'Заказов: {start + size}/{count}, деталей: {total_items}')
+        return total_items
+
+    def _section_type(self):
+        return self.rng.choices([s for s, _ in SECTION_WEIGHTS], [w for _, w in SECTION_WEIGHTS])[0]
+
+    def _order(self, n, users):
+        rng = self.rng
+        year = rng.randint(2019, 2025)
+        return Order(
+            order_number=f'{year}-{n + 1:05d}',
+            order_name=f'{rng.choice(ORDER_NAMES)} {rng.randint(1, 999):03d}',
+            drawing_number=f'ДМ-{rng.randint(100, 999)}-{year}' if rng.random() < 0.7 else None,
+            user=rng.choice(users),
+            coefficient=Decimal(rng.choice(['1.00', '1.00', '1.05', '1.10', '1.15', '1.20', '1.50'])),
+            order_quantity=rng.choice([1, 1, 1, 1, 2, 2, 3, 4, 5, 10]),
+        )
+
+    def _order_items(self, order, mean):
+        rng = self.rng
+        count = max(1, min(mean * 10, int(rng.expovariate(1 / mean)) + 1))
+        drawing = order.drawing_number or f'ДМ-{order.order_number}'
+        items = []
+        number = 0
+        while len(items) < count:
+            number += 1
+            items.append(self._item(order, str(number), drawing))
+            # Подпозиции вида «15-01», «15-02»
+            if rng.random() < SUB_ITEM_RATE:
+                for sub in range(1, rng.randint(2, 4)):
+                    items.append(self._item(order, f'{number}-{sub:02d}', drawing))
+        return items[:count]
+
+    def _item(self, order, sequence_number, drawing):
+        rng = self.rng
+        item = OrderItem(
+            order=order,
+            sequence_number=sequence_number,
+            part_name=rng.choice(self._part_names),
+            quantity=rng.choice([1, 1, 2, 2, 4, 5, 8, 10, 20, 50]),
+            designation=f'{drawing}.{sequence_number}' if rng.random() < DESIGNATION_RATE else None,
+        )
+        if rng.random() < SPECIAL_ITEM_RATE:
+            item.is_special = True
+            item.length = rng.randint(100, 6000) if rng.random() < 0.5 else None
+            return item
+
+        section_type = self._section_type()
+        while section_type not in self._by_section:
+            section_type = self._section_type()
+        stock_item = rng.choices(self._by_section[section_type], self._stock_weights[section_type])[0]
+        item.stock_item = stock_item
+        item.section_type = section_type
+        item.material = stock_item.material
+        item.length = Decimal(rng.randint(5, 800))
+        if section_type == 'sheet':
+            item.width = Decimal(rng.randint(20, 400))
+            item.height = Decimal(rng.randint(20, 400))
+        elif section_type == 'round':
+            item.diameter = max(Decimal(1), stock_item.diameter - rng.randint(1, 5))
+            item.use_iz_prefix = rng.random() < 0.2
+        elif section_type == 'hexagon':
+            item.key_size = stock_item.key_size
+        item.weight_mg = weights.item_weight_mg(item)
+        return item
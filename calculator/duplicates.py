@@ -0,0 +1,62 @@
+"""Одинаковые строки заказа
+
+Форма добавления детали дубли не запрещает, и в больших заказах
+накапливаются одинаковые строки, которые раздувают задание на заготовку.
+Строки одинаковы, если совпадают все поля DUPLICATE_FIELDS; группы ищутся
+одним проходом по строкам заказа через словарь по этим полям. Слияние
+оставляет в группе строку с меньшим номером, прибавляет к ней количество
+остальных и удаляет их — все в одной транзакции.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, IntegerField, Value, When
+
+from .models import OrderItem, sequence_prefix
+
+DUPLICATE_FIELDS = ('part_name_id', 'material_id', 'stock_item_id', 'designation', 'length', 'width', 'height',
+                    'diameter', 'key_size', 'use_iz_prefix', 'is_special')
+ROW_FIELDS = ('id', 'sequence_number', 'quantity', 'part_name__name', 'material__name') + DUPLICATE_FIELDS
+
+
+def _key(row):
+    # Decimal('100.00') и Decimal('100') равны и имеют одинаковый хэш; пустое обозначение — как его отсутствие
+    return tuple(row[field] or None if field == 'designation' else row[field] for field in DUPLICATE_FIELDS)
+
+
+def _sort_key(row):
+    prefix = sequence_prefix(row['sequence_number'])
+    return (prefix is None, prefix or 0, row['sequence_number'], row['id'])
+
+
+def find_duplicates(order_id):
+    """Группы одинаковых строк: [{'keeper': строка, 'duplicates': [строки], 'quantity': сумма}]"""
+    groups = defaultdict(list)
+    for row in OrderItem.objects.filter(order_id=order_id).order_by().values(*ROW_FIELDS):
+        groups[_key(row)].append(row)
+    result = []
+    for rows in groups.values():
+        if len(rows) > 1:
+            rows.sort(key=_sort_key)
+            result.append({'keeper': rows[0], 'duplicates': rows[1:], 'quantity': sum(row['quantity'] for row in rows)})
+    result.sort(key=lambda group: _sort_key(group['keeper']))
+    return result
+
+
+@transaction.atomic
+def merge_duplicates(order_id, keeper_ids=None):
+    """Сливает группы дублей (все или с оставляемыми строками keeper_ids); возвращает (групп, удалено строк)"""
+    groups = find_duplicates(order_id)
+    if keeper_ids is not None:
+        keeper_ids = set(keeper_ids)
+        groups = [group for group in groups if group['keeper']['id'] in keeper_ids]
+    if not groups:
+        return 0, 0
+    OrderItem.objects.filter(id__in=[group['keeper']['id'] for group in groups]).update(quantity=Case(
+        *[When(id=group['keeper']['id'], then=Value(group['quantity'])) for group in groups],
+        output_field=IntegerField(),
+    ))
+    removed = [row['id'] for group in groups for row in group['duplicates']]
+    # Удаление через модели: сигналы обновляют шаблон следующей детали и журнал изменений
+    OrderItem.objects.filter(id__in=removed).delete()
+    return len(groups), len(removed)
@@ -0,0 +1,199 @@
+"""Фасетные фильтры списка заказов
+
+Фильтры: пользователь, период создания, материал, тип сортамента и
+коэффициент. Счетчики каждого фасета считаются одним сгруппированным
+запросом по индексированным столбцам с учетом всех остальных фильтров,
+кроме собственного, — поэтому другие значения фасета остаются доступными.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.http import urlencode
+
+from .models import Order, OrderItem, StockItem
+from .reference_cache import get_reference_options
+
+FILTER_PARAMS = ('user', 'date_from', 'date_to', 'material', 'section', 'coefficient')
+SECTION_LABELS = dict(StockItem.SECTION_TYPE_CHOICES)
+MONTHS = ['январь', 'февраль', 'март', 'апрель', 'май', 'июнь', 'июль', 'август',
+          'сентябрь', 'октябрь', 'ноябрь', 'декабрь']
+
+
+# Наибольшее значение целочисленного столбца SQLite (id)
+MAX_ID = 2 ** 63 - 1
+_COEFFICIENT = Order._meta.get_field('coefficient')
+
+
+def parse_id(value):
+    """Неотрицательное целое из параметра запроса; None — пусто, не число или больше MAX_ID"""
+    # isdigit() пропускает и не-ASCII цифры ('²', '٣'), которые int() не принимает
+    if not value or not value.isascii() or not value.isdigit():
+        return None
+    number = int(value)
+    return number if number <= MAX_ID else None
+
+
+def parse_day(value):
+    """Дата ГГГГ-ММ-ДД из параметра запроса; None — пусто или несуществующая дата (2024-02-30)"""
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
+
+def _decimal(value):
+    """Коэффициент из параметра; NaN, бесконечность и значения, не помещающиеся в поле, отбрасываются"""
+    try:
+        number = Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+    if number is None or not number.is_finite():
+        return None
+    if abs(number) >= 10 ** (_COEFFICIENT.max_digits - _COEFFICIENT.decimal_places):
+        return None
+    return number
+
+
+def parse_filters(params):
+    """Значения фильтров из GET-параметров (некорректные отбрасываются)"""
+    section = params.get('section')
+    return {
+        'user': parse_id(params.get('user')),
+        'date_from': parse_day(params.get('date_from')),
+        'date_to': parse_day(params.get('date_to')),
+        'material': parse_id(params.get('material')),
+        'section': section if section in SECTION_LABELS else None,
+        'coefficient': _decimal(params.get('coefficient')),
+    }
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def apply_filters(orders, filters, exclude=()):
+    """Фильтрует заказы; exclude — фасеты, фильтр которых не применяется"""
+    if filters['user'] and 'user' not in exclude:
+        orders = orders.filter(user_id=filters['user'])
+    if 'date' not in exclude:
+        # Границы дня в часовом поясе проекта — сравнение по индексу created_at
+        if filters['date_from']:
+            orders = orders.filter(created_at__gte=_day_start(filters['date_from']))
+        if filters['date_to']:
+            orders = orders.filter(created_at__lt=_day_start(filters['date_to'] + timedelta(days=1)))
+    if filters['material'] and 'material' not in exclude:
+        orders = orders.filter(id__in=OrderItem.objects.filter(material_id=filters['material']).values('order_id'))
+    if filters['section'] and 'section' not in exclude:
+        orders = orders.filter(id__in=OrderItem.objects.filter(section_type=filters['section']).values('order_id'))
+    if filters['coefficient'] is not None and 'coefficient' not in exclude:
+        orders = orders.filter(coefficient=filters['coefficient'])
+    return orders
+
+
+def _link(params, **changes):
+    query = {key: params.get(key) for key in ('search',) + FILTER_PARAMS if params.get(key)}
+    for key, value in changes.items():
+        if value is None:
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return '?' + urlencode(query) if query else '?'
+
+
+def _values(params, name, rows, selected):
+    """Значения фасета: подпись, счетчик, ссылка (повторный выбор снимает фильтр)"""
+    values = []
+    for value, label, count in rows:
+        is_selected = selected is not None and value == selected
+        values.append({
+            'label': label,
+            'count': count,
+            'selected': is_selected,
+            'url': _link(params, **{name: None if is_selected else value}),
+        })
+    return values
+
+
+def _items(orders, filters, facet):
+    """Детали заказов для счетчика фасета по деталям
+
+    Без ограничений на заказы запрос идет только по покрывающему индексу
+    (значение, заказ) таблицы деталей.
+    """
+    scoped = apply_filters(orders, filters, exclude=(facet,))
+    items = OrderItem.objects.order_by()
+    if scoped.query.where:
+        items = items.filter(order__in=scoped)
+    return items
+
+
+def user_label(row):
+    full_name = f"{row['user__last_name']} {row['user__first_name']}".strip()
+    return full_name or row['user__username']
+
+
+def build_facets(orders, filters, params):
+    """Счетчики фасетов для базового набора заказов (до фасетных фильтров)
+
+    На каждый фасет — один запрос с GROUP BY.
+    """
+    facets = []
+
+    rows = (apply_filters(orders, filters, exclude=('user',)).order_by()
+            .values('user_id', 'user__username', 'user__last_name', 'user__first_name')
+            .annotate(count=Count('id')).order_by('-count', 'user__last_name'))
+    facets.append({'name': 'user', 'title': 'Создатель', 'values': _values(
+        params, 'user', [(row['user_id'], user_label(row), row['count']) for row in rows], filters['user'],
+    )})
+
+    rows = (apply_filters(orders, filters, exclude=('date',)).order_by()
+            .annotate(month=TruncMonth('created_at')).values('month')
+            .annotate(count=Count('id')).order_by('-month'))
+    months = []
+    for row in rows[:12]:
+        month = timezone.localtime(row['month']).date() if isinstance(row['month'], datetime) else row['month']
+        next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+        last_day = next_month - timedelta(days=1)
+        selected = filters['date_from'] == month and filters['date_to'] == last_day
+        months.append({
+            'label': f'{MONTHS[month.month - 1]} {month.year}',
+            'count': row['count'],
+            'selected': selected,
+            'url': _link(params, date_from=None if selected else month.isoformat(),
+                         date_to=None if selected else last_day.isoformat()),
+        })
+    facets.append({'name': 'date', 'title': 'Месяц', 'values': months})
+
+    material_names = {material['id']: material['name'] for material in get_reference_options()['materials']}
+    rows = (_items(orders, filters, 'material').filter(material__isnull=False).values('material_id')
+            .annotate(count=Count('order_id', distinct=True)).order_by('-count'))
+    facets.append({'name': 'material', 'title': 'Материал', 'values': _values(
+        params, 'material',
+        [(row['material_id'], material_names.get(row['material_id'], '—'), row['count']) for row in rows],
+        filters['material'],
+    )})
+
+    rows = (_items(orders, filters, 'section').filter(section_type__isnull=False).values('section_type')
+            .annotate(count=Count('order_id', distinct=True)).order_by('-count'))
+    facets.append({'name': 'section', 'title': 'Тип сортамента', 'values': _values(
+        params, 'section',
+        [(row['section_type'], SECTION_LABELS.get(row['section_type'], '—'), row['count']) for row in rows],
+        filters['section'],
+    )})
+
+    rows = (apply_filters(orders, filters, exclude=('coefficient',)).order_by()
+            .values('coefficient').annotate(count=Count('id')).order_by('coefficient'))
+    facets.append({'name': 'coefficient', 'title': 'Коэффициент', 'values': _values(
+        params, 'coefficient', [(row['coefficient'], row['coefficient'], row['count']) for row in rows],
+        filters['coefficient'],
+    )})
+    return facets
+
+
+def reset_url(params):
+    """Ссылка без фасетных фильтров (поиск сохраняется)"""
+    return _link(params, **dict.fromkeys(FILTER_PARAMS))
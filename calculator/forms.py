@@ -1,6 +1,7 @@
 from django import forms
 from .models import Material, PartName, StockItem, Order, OrderItem
 from django.contrib.auth.forms import AuthenticationForm
+from .reference_cache import get_reference_options
 
 class LoginForm(AuthenticationForm):
     username = forms.CharField(label='Фамилия и инициалы', widget=forms.TextInput(attrs={'class': 'form-control'}))
@@ -73,6 +74,61 @@ class StockItemForm(forms.ModelForm):
         
         return cleaned_data
 
+class StockReceiptForm(forms.Form):
+    """Поступление сортамента на склад"""
+    length_mm = forms.DecimalField(
+        label='Длина (мм)', max_digits=12, decimal_places=2, min_value=0.01,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
+        help_text='Общая длина поступивших прутков/труб (для листа — длина листов)',
+    )
+    mass_kg = forms.DecimalField(
+        label='Масса (кг)', max_digits=12, decimal_places=3, min_value=0, required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.001'}),
+        help_text='Если не указана, считается по сечению сортамента (для листа обязательна)',
+    )
+    comment = forms.CharField(
+        label='Комментарий', max_length=200, required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Накладная, поставщик'}),
+    )
+
+    def __init__(self, *args, stock_item=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stock_item = stock_item
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.stock_item and self.stock_item.section_type == 'sheet' and cleaned_data.get('mass_kg') is None:
+            self.add_error('mass_kg', 'Обязательное поле для листа')
+        return cleaned_data
+
+class RemnantForm(forms.Form):
+    """Регистрация делового остатка"""
+    length_mm = forms.DecimalField(
+        label='Длина (мм)', max_digits=12, decimal_places=2, min_value=0.01,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
+    )
+    width_mm = forms.DecimalField(
+        label='Ширина (мм)', max_digits=12, decimal_places=2, min_value=0.01, required=False,
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
+        help_text='Только для листа',
+    )
+    comment = forms.CharField(
+        label='Комментарий', max_length=200, required=False,
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Место хранения'}),
+    )
+
+    def __init__(self, *args, stock_item=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stock_item = stock_item
+        if stock_item and stock_item.section_type != 'sheet':
+            del self.fields['width_mm']
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if self.stock_item and self.stock_item.section_type == 'sheet' and cleaned_data.get('width_mm') is None:
+            self.add_error('width_mm', 'Обязательное поле для листа')
+        return cleaned_data
+
 class OrderForm(forms.ModelForm):
     class Meta:
         model = Order
@@ -152,6 +208,10 @@ class OrderItemForm(forms.ModelForm):
             'diameter',
             'key_size',
         )
+        # Готовые списки для шаблона из кэша справочников (без запроса на каждую позицию)
+        options = get_reference_options()
+        self.material_options = options['materials']
+        self.stock_item_options = options['stock_items']
         self.fields['stock_item'].label = 'Сортамент со склада'
         self.fields['stock_item'].empty_label = '---------'
         self.fields['use_iz_prefix'].label = 'Добавлять «из» в задании на заготовку (кругляк)'
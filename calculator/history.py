@@ -0,0 +1,270 @@
+"""История изменений заказов
+
+Состояние заказа — отслеживаемые поля заказа и его деталей (ORDER_FIELDS,
+ITEM_FIELDS). После фиксации транзакции, изменившей заказ или его детали,
+текущее состояние из базы сравнивается с последним записанным
+(OrderHistory.state), и в журнал OrderRevision дописывается только разница по
+полям. Каждая CHECKPOINT_EVERY-я редакция дополнительно хранит полное
+состояние, поэтому любая редакция восстанавливается из контрольной точки и не
+более чем CHECKPOINT_EVERY - 1 записей изменений. Таблицы заказов и деталей
+при этом не растут — копии строк не создаются.
+
+Массовые операции без сигналов (QuerySet.update, bulk_create) в журнал
+попадают при следующем сохранении заказа или детали через save().
+"""
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import webhooks
+from .models import (Material, Order, OrderHistory, OrderItem, OrderRevision, PartName, StockItem,
+                     sequence_prefix)
+
+ORDER_FIELDS = ('order_number', 'order_name', 'drawing_number', 'coefficient', 'order_quantity')
+ITEM_FIELDS = ('sequence_number', 'designation', 'part_name_id', 'material_id', 'stock_item_id', 'quantity',
+               'length', 'width', 'height', 'diameter', 'key_size', 'use_iz_prefix', 'is_special')
+CHECKPOINT_EVERY = 50
+
+EMPTY = {'order': {}, 'items': {}}
+
+_pending = threading.local()
+_user = ContextVar('history_user', default=None)
+
+
+# ---- Состояния и изменения ----
+
+def _value(value):
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def order_states(order_ids, order_model=Order, item_model=OrderItem):
+    """Текущие состояния заказов двумя запросами: {id заказа: {'order': {...}, 'items': {id: {...}}}}"""
+    states = {
+        row['id']: {'order': {field: _value(row[field]) for field in ORDER_FIELDS}, 'items': {}}
+        for row in order_model.objects.filter(id__in=order_ids).values('id', *ORDER_FIELDS)
+    }
+    rows = item_model.objects.filter(order_id__in=list(states)).order_by().values('id', 'order_id', *ITEM_FIELDS)
+    for row in rows:
+        states[row['order_id']]['items'][str(row['id'])] = {field: _value(row[field]) for field in ITEM_FIELDS}
+    return states
+
+
+def diff_states(old, new):
+    """Изменения между состояниями: {'order', 'added', 'changed', 'removed'} (пустые ключи опускаются)"""
+    changes = {}
+    order = {field: value for field, value in new['order'].items() if old['order'].get(field) != value}
+    if order:
+        changes['order'] = order
+    added, changed = {}, {}
+    for item_id, fields in new['items'].items():
+        before = old['items'].get(item_id)
+        if before is None:
+            added[item_id] = fields
+            continue
+        delta = {field: value for field, value in fields.items() if before.get(field) != value}
+        if delta:
+            changed[item_id] = delta
+    removed = sorted(old['items'].keys() - new['items'].keys(), key=int)
+    for key, value in (('added', added), ('changed', changed), ('removed', removed)):
+        if value:
+            changes[key] = value
+    return changes
+
+
+def apply_changes(state, changes):
+    """Состояние после изменений редакции (исходное состояние не меняется)"""
+    items = dict(state['items'])
+    items.update(changes.get('added', {}))
+    for item_id, delta in changes.get('changed', {}).items():
+        items[item_id] = {**items[item_id], **delta}
+    for item_id in changes.get('removed', ()):
+        items.pop(item_id, None)
+    return {'order': {**state['order'], **changes.get('order', {})}, 'items': items}
+
+
+def summarize(changes):
+    """Краткий итог редакции для журнала"""
+    return {
+        'order': len(changes.get('order', {})),
+        'added': len(changes.get('added', {})),
+        'changed': len(changes.get('changed', {})),
+        'removed': len(changes.get('removed', ())),
+    }
+
+
+# ---- Запись ----
+
+def record(order_ids, user=None):
+    """Дописывает редакции заказов, состояние которых изменилось; возвращает число редакций"""
+    with transaction.atomic():
+        states = order_states(order_ids)
+        heads = OrderHistory.objects.in_bulk(list(states))
+        new_heads, changed_heads, revisions = [], [], []
+        for order_id, state in states.items():
+            head = heads.get(order_id)
+            if head is None:
+                head = OrderHistory(order_id=order_id)
+                new_heads.append(head)
+                changes = diff_states(EMPTY, state)
+            else:
+                changes = diff_states(head.state, state)
+                if not changes:
+                    continue
+                changed_heads.append(head)
+            head.last_number += 1
+            head.state = state
+            revisions.append(OrderRevision(
+                order_id=order_id, number=head.last_number, user=user, changes=changes,
+                state=state if head.last_number % CHECKPOINT_EVERY == 1 else None,
+            ))
+        OrderHistory.objects.bulk_create(new_heads)
+        OrderHistory.objects.bulk_update(changed_heads, ['last_number', 'state'])
+        OrderRevision.objects.bulk_create(revisions)
+        webhooks.enqueue([
+            webhooks.event(
+                webhooks.ORDER_CREATED if revision.number == 1 else webhooks.ORDER_UPDATED, revision.order_id,
+                order_number=states[revision.order_id]['order']['order_number'], revision=revision.number,
+                changes=summarize(revision.changes), user=user.username if user else None,
+            )
+            for revision in revisions
+        ])
+    return len(revisions)
+
+
+@contextmanager
+def acting_user(user):
+    """Автор редакций, записанных внутри блока (middleware.RevisionUserMiddleware)"""
+    token = _user.set(user)
+    try:
+        yield
+    finally:
+        _user.reset(token)
+
+
+def _pending_ids():
+    if not hasattr(_pending, 'ids'):
+        _pending.ids = set()
+    return _pending.ids
+
+
+def mark_changed(order_id):
+    """Заказ изменен: редакция будет записана после фиксации транзакции"""
+    _pending_ids().add(order_id)
+    # Ошибка записи журнала не должна ломать уже зафиксированное изменение: пропущенная
+    # разница войдет в следующую редакцию, так как сравнение идет с OrderHistory.state
+    transaction.on_commit(flush, robust=True)
+
+
+def flush():
+    """Записывает редакции заказов, измененных в зафиксированных транзакциях потока"""
+    pending = _pending_ids()
+    if not pending:
+        return
+    order_ids = list(pending)
+    pending.clear()
+    user = _user.get()
+    record(order_ids, user if user is not None and user.is_authenticated else None)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        mark_changed(instance.pk)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_changed(sender, instance, raw=False, origin=None, **kwargs):
+    if raw or isinstance(origin, Order):
+        return
+    mark_changed(instance.order_id)
+
+
+# ---- Восстановление и сравнение ----
+
+def state_at(order_id, number):
+    """Состояние заказа на редакции number: контрольная точка и изменения после нее"""
+    if number <= 0:
+        return EMPTY
+    checkpoint = (OrderRevision.objects.filter(order_id=order_id, number__lte=number, state__isnull=False)
+                  .order_by('-number').values_list('number', 'state').first())
+    if checkpoint is None:
+        raise OrderRevision.DoesNotExist(f'Нет редакции {number} заказа {order_id}')
+    start, state = checkpoint
+    changes_list = (OrderRevision.objects.filter(order_id=order_id, number__gt=start, number__lte=number)
+                    .order_by('number').values_list('changes', flat=True))
+    for changes in changes_list:
+        state = apply_changes(state, changes)
+    return state
+
+
+ORDER_LABELS = {field: Order._meta.get_field(field).verbose_name for field in ORDER_FIELDS}
+ITEM_LABELS = {field: OrderItem._meta.get_field(field.removesuffix('_id')).verbose_name for field in ITEM_FIELDS}
+REFERENCES = {'part_name_id': PartName, 'material_id': Material, 'stock_item_id': StockItem}
+
+
+def _reference_names(item_groups):
+    """Наименования справочников, на которые ссылаются детали (по запросу на справочник)"""
+    ids = {field: set() for field in REFERENCES}
+    for items in item_groups:
+        for fields in items.values():
+            for field in REFERENCES:
+                if fields.get(field) is not None:
+                    ids[field].add(fields[field])
+    names = {}
+    for field, model in REFERENCES.items():
+        queryset = model.objects.select_related('material') if model is StockItem else model.objects
+        names[field] = {pk: str(obj) for pk, obj in queryset.in_bulk(ids[field]).items()} if ids[field] else {}
+    return names
+
+
+def _display(field, value, names):
+    if value is None or value == '':
+        return '—'
+    if field in REFERENCES:
+        return names[field].get(value, f'#{value} (удален)')
+    if isinstance(value, bool):
+        return 'да' if value else 'нет'
+    return value
+
+
+def _sort_key(fields):
+    number = fields.get('sequence_number') or ''
+    prefix = sequence_prefix(number)
+    return (prefix is None, prefix or 0, number)
+
+
+def _title(fields, names):
+    return f"№{fields.get('sequence_number')} {_display('part_name_id', fields.get('part_name_id'), names)}"
+
+
+def compare(old, new):
+    """Различия двух состояний заказа для показа (детали сопоставляются по id)"""
+    old_items, new_items = old['items'], new['items']
+    names = _reference_names([old_items, new_items])
+
+    def rows(fields, labels, before, after):
+        return [
+            {'label': labels[field], 'old': _display(field, before.get(field), names),
+             'new': _display(field, after.get(field), names)}
+            for field in fields if before.get(field) != after.get(field)
+        ]
+
+    changed = []
+    for key in sorted(old_items.keys() & new_items.keys(), key=lambda key: _sort_key(new_items[key])):
+        fields = rows(ITEM_FIELDS, ITEM_LABELS, old_items[key], new_items[key])
+        if fields:
+            changed.append({'title': _title(new_items[key], names), 'fields': fields})
+    return {
+        'order': rows(ORDER_FIELDS, ORDER_LABELS, old['order'], new['order']),
+        'added': [_title(fields, names) for fields in sorted(
+            (new_items[key] for key in new_items.keys() - old_items.keys()), key=_sort_key)],
+        'removed': [_title(fields, names) for fields in sorted(
+            (old_items[key] for key in old_items.keys() - new_items.keys()), key=_sort_key)],
+        'changed': changed,
+    }
@@ -0,0 +1,173 @@
+"""Складской учет сортамента: поступления, резервы под заказы, списание
+
+Каждая операция пишет запись в журнал StockMovement и в той же транзакции
+изменяет остаток StockBalance одним UPDATE с F-выражениями. Длина хранится
+в мкм, масса — в мг (как в weights.py), поэтому остатки не накапливают
+ошибок округления.
+"""
+from django.db import transaction
+from django.db.models import BigIntegerField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from . import remnants, weights
+from .models import OrderItem, StockBalance, StockMovement, StockReservation
+
+
+class InventoryError(Exception):
+    """Операция со складом невозможна (нехватка сортамента, повторная выдача)"""
+
+
+def _length_expression():
+    return ExpressionWrapper(weights.scaled_expression('length', 3) * F('quantity'),
+                             output_field=BigIntegerField())
+
+
+def _change_balance(stock_item_id, on_hand_um=0, on_hand_mg=0, reserved_um=0, reserved_mg=0):
+    StockBalance.objects.get_or_create(stock_item_id=stock_item_id)
+    StockBalance.objects.filter(stock_item_id=stock_item_id).update(
+        on_hand_length_um=F('on_hand_length_um') + on_hand_um,
+        on_hand_mg=F('on_hand_mg') + on_hand_mg,
+        reserved_length_um=F('reserved_length_um') + reserved_um,
+        reserved_mg=F('reserved_mg') + reserved_mg,
+        available_length_um=F('available_length_um') + on_hand_um - reserved_um,
+        available_mg=F('available_mg') + on_hand_mg - reserved_mg,
+    )
+
+
+@transaction.atomic
+def receive(stock_item, length_mm, mass_kg=None, user=None, comment=''):
+    """Поступление сортамента; масса по умолчанию считается по сечению (кроме листа)"""
+    length_um = weights.to_um(length_mm)
+    if mass_kg is None:
+        mass_mg = weights.stock_weight_mg(stock_item, length_mm)
+        if mass_mg is None:
+            raise InventoryError('Для листа укажите массу поступления')
+    else:
+        mass_mg = weights.kg_to_mg(mass_kg)
+    movement = StockMovement.objects.create(
+        stock_item=stock_item, kind='receipt', length_um=length_um, mass_mg=mass_mg,
+        user=user, comment=comment,
+    )
+    _change_balance(stock_item.id, on_hand_um=length_um, on_hand_mg=mass_mg)
+    return movement
+
+
+def order_availability(order, covered=None):
+    """Потребность заказа и свободный остаток по каждому сортаменту — один запрос
+
+    Остаток берется из StockBalance по первичному ключу, резерв этого заказа —
+    из StockReservation по уникальному индексу (заказ, сортамент). covered —
+    заготовки, закрытые деловыми остатками ({сортамент: (мкм, мг)}), они
+    вычитаются из потребности.
+    """
+    covered = covered or {}
+    reserved = StockReservation.objects.filter(order=order, stock_item=OuterRef('stock_item'))
+    rows = (
+        OrderItem.objects.filter(order=order, is_special=False, stock_item__isnull=False)
+        .order_by().values('stock_item_id')
+        .annotate(
+            need_length_um=Sum(_length_expression()),
+            need_mg=Sum(weights.total_expression()),
+            available_length_um=Coalesce(F('stock_item__balance__available_length_um'), Value(0)),
+            available_mg=Coalesce(F('stock_item__balance__available_mg'), Value(0)),
+            reserved_length_um=Coalesce(Subquery(reserved.values('length_um')[:1]), Value(0),
+                                        output_field=BigIntegerField()),
+            reserved_mg=Coalesce(Subquery(reserved.values('mass_mg')[:1]), Value(0),
+                                 output_field=BigIntegerField()),
+        )
+    )
+    result = []
+    for row in rows:
+        covered_um, covered_mg = covered.get(row['stock_item_id'], (0, 0))
+        need_um = max(0, (row['need_length_um'] or 0) * order.order_quantity - covered_um)
+        need_mg = max(0, (row['need_mg'] or 0) * order.order_quantity - covered_mg)
+        # Резерв самого заказа уже вычтен из свободного остатка
+        usable_um = row['available_length_um'] + row['reserved_length_um']
+        result.append({
+            'stock_item_id': row['stock_item_id'],
+            'need_length_um': need_um,
+            'need_mg': need_mg,
+            'covered_length_um': covered_um,
+            'available_length_um': row['available_length_um'],
+            'available_mg': row['available_mg'],
+            'reserved_length_um': row['reserved_length_um'],
+            'reserved_mg': row['reserved_mg'],
+            'shortage_length_um': max(0, need_um - usable_um),
+        })
+    return result
+
+
+@transaction.atomic
+def reserve_order(order, user=None):
+    """Резервирует сортамент под заказ (повторный вызов приводит резерв к текущему составу)"""
+    if order.stock_movements.filter(kind='consumption').exists():
+        raise InventoryError('Задание на заготовку уже выдано — резерв не требуется')
+    availability = order_availability(order)
+    shortages = [row for row in availability if row['shortage_length_um'] > 0]
+    if shortages:
+        raise InventoryError(f'Недостаточно сортамента на складе: позиций {len(shortages)}')
+
+    needed = {row['stock_item_id']: (row['need_length_um'], row['need_mg']) for row in availability}
+    for reservation in StockReservation.objects.filter(order=order):
+        if reservation.stock_item_id not in needed:
+            StockMovement.objects.create(
+                stock_item_id=reservation.stock_item_id, order=order, kind='release',
+                length_um=reservation.length_um, mass_mg=reservation.mass_mg, user=user,
+            )
+            reservation.delete()  # остаток возвращает сигнал release_deleted_reservation
+    current = {r.stock_item_id: r for r in StockReservation.objects.filter(order=order)}
+    for stock_item_id, (length_um, mass_mg) in needed.items():
+        reservation = current.get(stock_item_id)
+        delta_um = length_um - (reservation.length_um if reservation else 0)
+        delta_mg = mass_mg - (reservation.mass_mg if reservation else 0)
+        if not delta_um and not delta_mg:
+            continue
+        StockMovement.objects.create(
+            stock_item_id=stock_item_id, order=order,
+            kind='reservation' if delta_um >= 0 else 'release',
+            length_um=abs(delta_um), mass_mg=abs(delta_mg), user=user,
+        )
+        StockReservation.objects.update_or_create(
+            order=order, stock_item_id=stock_item_id,
+            defaults={'length_um': length_um, 'mass_mg': mass_mg},
+        )
+        _change_balance(stock_item_id, reserved_um=delta_um, reserved_mg=delta_mg)
+
+
+@transaction.atomic
+def release_order(order, user=None, comment=''):
+    """Снимает весь резерв заказа"""
+    for reservation in StockReservation.objects.filter(order=order):
+        StockMovement.objects.create(
+            stock_item_id=reservation.stock_item_id, order=order, kind='release',
+            length_um=reservation.length_um, mass_mg=reservation.mass_mg, user=user, comment=comment,
+        )
+        reservation.delete()
+
+
+@transaction.atomic
+def consume_order(order, user=None):
+    """Списывает сортамент при выдаче задания на заготовку (резерв заказа снимается)
+
+    Сначала заготовки раскладываются по деловым остаткам, со склада
+    списывается только оставшаяся потребность.
+    """
+    if order.stock_movements.filter(kind='consumption').exists():
+        raise InventoryError('Задание на заготовку по этому заказу уже выдано')
+    plan = remnants.plan_order(order)
+    availability = order_availability(order, plan['covered'])
+    shortages = [row for row in availability if row['shortage_length_um'] > 0]
+    if shortages:
+        raise InventoryError(f'Недостаточно сортамента на складе: позиций {len(shortages)}')
+
+    if not remnants.apply_plan(order, plan):
+        raise InventoryError('Деловые остатки изменились во время выдачи — повторите операцию')
+    StockReservation.objects.filter(order=order).delete()
+    for row in availability:
+        if not row['need_length_um'] and not row['need_mg']:
+            continue
+        StockMovement.objects.create(
+            stock_item_id=row['stock_item_id'], order=order, kind='consumption',
+            length_um=row['need_length_um'], mass_mg=row['need_mg'], user=user,
+        )
+        _change_balance(row['stock_item_id'], on_hand_um=-row['need_length_um'], on_hand_mg=-row['need_mg'])
@@ -0,0 +1,211 @@
+"""Фоновые задачи без внешнего брокера
+
+Тяжелые операции — копирование большого заказа, пересчет масс деталей после
+изменения плотности материала или размеров сортамента — ставятся в очередь
+(таблица Job) и выполняются командой run_jobs (отдельная служба) в пуле
+потоков. Запрос пользователя только создает задачу; страница задачи
+опрашивает ее состояние и может запросить отмену.
+
+Задача — функция, зарегистрированная декоратором @task(имя). Она получает
+Progress и параметры задачи; progress.step() сдвигает счетчик выполненного и
+проверяет запрос отмены, поднимая Cancelled. Задачи пишут порциями в
+отдельных транзакциях: одна долгая транзакция держала бы блокировку записи
+SQLite, и ни ход выполнения, ни запрос отмены не были бы видны до ее конца.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from . import history, weights
+from .models import Job, Order, OrderItem, OrderItemTemplate, OrderSequence
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+class Cancelled(Exception):
+    """Задача остановлена по запросу отмены"""
+
+
+def task(name):
+    """Регистрирует функцию как фоновую задачу name"""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def submit(name, user=None, **params):
+    """Ставит задачу в очередь; params должны сериализоваться в JSON"""
+    if name not in TASKS:
+        raise KeyError(f'Неизвестная задача: {name}')
+    return Job.objects.create(name=name, params=params,
+                              user=user if user is not None and user.is_authenticated else None)
+
+
+def cancel(job_id):
+    """Отменяет задачу: из очереди — сразу, выполняющуюся — при следующем шаге; False — уже завершена"""
+    if Job.objects.filter(id=job_id, status='queued').update(status='cancelled', finished_at=timezone.now()):
+        return True
+    return bool(Job.objects.filter(id=job_id, status='running').update(cancel_requested=True))
+
+
+class Progress:
+    """Ход выполнения задачи; в базу пишется не чаще раза в UPDATE_INTERVAL секунд"""
+    UPDATE_INTERVAL = 0.5
+
+    def __init__(self, job):
+        self.job = job
+        self.done = 0
+        self.total = 0
+        self._saved_at = 0.0
+
+    def start(self, total, message=''):
+        self.total = total
+        self.save(message)
+
+    def step(self, count=1, message=None):
+        self.done += count
+        if time.monotonic() - self._saved_at >= self.UPDATE_INTERVAL:
+            self.save(message)
+
+    def save(self, message=None):
+        fields = {'progress': self.done, 'total': self.total}
+        if message is not None:
+            fields['message'] = message[:200]
+        Job.objects.filter(id=self.job.id).update(**fields)
+        self._saved_at = time.monotonic()
+        if Job.objects.filter(id=self.job.id, cancel_requested=True).exists():
+            raise Cancelled
+
+
+# ---- Выполнение ----
+
+def claim():
+    """Следующая задача очереди, переведенная в running; None — очередь пуста"""
+    while True:
+        job = Job.objects.filter(status='queued').order_by('id').first()
+        if job is None:
+            return None
+        # Условное обновление: из нескольких потоков задачу получает только один
+        if Job.objects.filter(id=job.id, status='queued').update(status='running', started_at=timezone.now()):
+            job.status = 'running'
+            return job
+
+
+def run(job):
+    """Выполняет задачу и записывает итог: done, failed или cancelled"""
+    progress = Progress(job)
+    try:
+        with history.acting_user(job.user):
+            result = TASKS[job.name](progress, **job.params)
+    except Cancelled:
+        fields = {'status': 'cancelled', 'message': 'Отменена'}
+    except Exception as e:
+        logger.exception('Задача %s #%s завершилась ошибкой', job.name, job.id)
+        fields = {'status': 'failed', 'message': (str(e) or e.__class__.__name__)[:200]}
+    else:
+        fields = {'status': 'done', 'result': result, 'message': (result or {}).get('message', '')[:200]}
+    Job.objects.filter(id=job.id).update(progress=progress.done, total=progress.total,
+                                         finished_at=timezone.now(), **fields)
+    return fields['status']
+
+
+def run_pending():
+    """Выполняет задачи очереди, пока она не опустеет; возвращает число выполненных"""
+    count = 0
+    while (job := claim()) is not None:
+        run(job)
+        count += 1
+    return count
+
+
+def recover():
+    """Задачи, прерванные остановкой обработчика, помечаются как ошибочные (при его запуске)"""
+    return Job.objects.filter(status='running').update(
+        status='failed', message='Прервана перезапуском обработчика', finished_at=timezone.now(),
+    )
+
+
+def prune(days=None):
+    """Удаляет завершенные задачи старше days дней"""
+    before = timezone.now() - timedelta(days=days or settings.JOB_KEEP_DAYS)
+    return Job.objects.filter(status__in=Job.FINISHED, finished_at__lt=before).delete()[0]
+
+
+# ---- Задачи ----
+
+COPY_FIELDS = ('sequence_number', 'part_name_id', 'material_id', 'quantity', 'stock_item_id', 'length', 'width',
+               'height', 'diameter', 'key_size', 'is_special', 'weight_mg', 'section_type')
+
+
+def copy_order(original, order_number, order_name, user, progress=None, batch_size=500):
+    """Копия заказа с деталями от имени user; детали вставляются порциями по batch_size"""
+    new_order = Order.objects.create(
+        order_number=order_number,
+        order_name=order_name or original.order_name,
+        drawing_number=original.drawing_number,
+        user=user,
+        coefficient=original.coefficient,
+        order_quantity=original.order_quantity,
+    )
+    # Копия сохраняет номера деталей исходного заказа (по ним детали сверяются с чертежом),
+    # поэтому новые номера через OrderSequence.allocate не выдаются: счетчик копии продолжает
+    # счетчик исходного заказа, и следующая деталь копии получит тот же номер, что и в оригинале
+    OrderSequence.objects.create(order=new_order, last_number=OrderSequence.peek(original) - 1)
+    rows = original.items.order_by('id').values_list(*COPY_FIELDS)
+    batch = []
+    try:
+        if progress:
+            progress.start(rows.count(), f'Копирование заказа №{original.order_number}')
+        for values in rows.iterator(chunk_size=batch_size):
+            # bulk_create не вызывает pre_save — масса и тип сортамента те же, что у оригинала
+            batch.append(OrderItem(order=new_order, **dict(zip(COPY_FIELDS, values))))
+            if len(batch) == batch_size:
+                _insert_items(batch, progress)
+                batch = []
+        _insert_items(batch, progress)
+    except BaseException:
+        # Отмена или ошибка: неполная копия не остается
+        if progress:
+            new_order.delete()
+        raise
+    # bulk_create не вызывает сигналы: шаблон следующей детали (если форма уже открывалась)
+    # пересчитывается, а вставленные детали попадают в журнал изменений отдельной редакцией
+    OrderItemTemplate.refresh(new_order.id)
+    history.mark_changed(new_order.id)
+    return new_order
+
+
+def _insert_items(batch, progress):
+    if not batch:
+        return
+    with transaction.atomic():
+        OrderItem.objects.bulk_create(batch)
+    if progress:
+        progress.step(len(batch))
+
+
+@task('copy_order')
+def copy_order_task(progress, order_id, order_number, order_name=None):
+    original = Order.objects.get(id=order_id)
+    new_order = copy_order(original, order_number, order_name, progress.job.user, progress)
+    return {'url': reverse('order_detail', args=[new_order.id]), 'message': f'Создан заказ №{new_order.order_number}'}
+
+
+@task('refresh_weights')
+def refresh_weights_task(progress, material_id=None, stock_item_id=None):
+    items = OrderItem.objects.all()
+    if material_id is not None:
+        items = items.filter(material_id=material_id)
+    if stock_item_id is not None:
+        items = items.filter(stock_item_id=stock_item_id)
+    progress.start(items.count(), 'Пересчет масс деталей')
+    changed = weights.refresh_weights(items, progress=progress.step)
+    return {'message': f'Изменена масса деталей: {changed}'}
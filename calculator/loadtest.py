@@ -0,0 +1,266 @@
+"""Нагрузочное тестирование: асинхронный HTTP-клиент на stdlib и сценарии работы цеха
+
+Модуль не зависит от Django и обращается к уже запущенному серверу по HTTP.
+Каждый виртуальный пользователь («терминал») проходит сценарий: вход,
+список заказов, создание заказа, добавление деталей, смена коэффициента
+через AJAX и печать трёх отчётов.
+"""
+import asyncio
+import math
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+
+class LoadTestError(Exception):
+    """Ошибка выполнения сценария (неожиданный ответ сервера)"""
+
+
+@dataclass
+class Response:
+    status: int
+    headers: dict
+    body: bytes
+
+    @property
+    def location(self):
+        return self.headers.get('location', '')
+
+
+@dataclass
+class RouteStats:
+    """Время ответа (мс) и ошибки по одному маршруту"""
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        # Метод ближайшего ранга
+        rank = max(1, math.ceil(p / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+
+class HttpClient:
+    """Минимальный HTTP/1.1 клиент с cookie-сессией одного пользователя"""
+
+    def __init__(self, base_url, stats, timeout=60):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname or '127.0.0.1'
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.stats = stats
+        self.timeout = timeout
+        self.cookies = {}
+
+    @property
+    def csrf_token(self):
+        return self.cookies.get('csrftoken', '')
+
+    async def request(self, route, method, path, data=None, headers=None):
+        body = urlencode(data).encode() if data is not None else b''
+        lines = [
+            f'{method} {self.prefix}{path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Connection: close',
+            'User-Agent: production-calculator-loadtest',
+        ]
+        if self.cookies:
+            lines.append('Cookie: ' + '; '.join(f'{k}={v}' for k, v in self.cookies.items()))
+        if data is not None:
+            lines.append('Content-Type: application/x-www-form-urlencoded')
+            lines.append(f'Content-Length: {len(body)}')
+            lines.append(f'X-CSRFToken: {self.csrf_token}')
+        for name, value in (headers or {}).items():
+            lines.append(f'{name}: {value}')
+        raw_request = ('\r\n'.join(lines) + '\r\n\r\n').encode() + body
+
+        stats = self.stats.setdefault(route, RouteStats())
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self._send(raw_request), self.timeout)
+        except (OSError, asyncio.TimeoutError, LoadTestError):
+            stats.errors += 1
+            raise
+        stats.latencies.append((time.perf_counter() - start) * 1000)
+        if response.status >= 400:
+            stats.errors += 1
+        return response
+
+    async def _send(self, raw_request):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(raw_request)
+            await writer.drain()
+            raw = await reader.read()
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        return self._parse(raw)
+
+    def _parse(self, raw):
+        head, _, body = raw.partition(b'\r\n\r\n')
+        if not head:
+            raise LoadTestError('Пустой ответ сервера')
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        status = int(status_line.split(' ', 2)[1])
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            value = value.strip()
+            if name == 'set-cookie':
+                cookie = SimpleCookie()
+                cookie.load(value)
+                for key, morsel in cookie.items():
+                    self.cookies[key] = morsel.value
+            else:
+                headers[name] = value
+        if headers.get('transfer-encoding') == 'chunked':
+            body = self._dechunk(body)
+        return Response(status, headers, body)
+
+    @staticmethod
+    def _dechunk(body):
+        result = bytearray()
+        while body:
+            size_line, _, body = body.partition(b'\r\n')
+            size = int(size_line.split(b';')[0], 16)
+            if size == 0:
+                break
+            result += body[:size]
+            body = body[size + 2:]
+        return bytes(result)
+
+
+@dataclass
+class ScenarioConfig:
+    """Параметры сценария и справочные данные, по которым создаются детали"""
+    base_url: str
+    username: str
+    password: str
+    part_ids: list
+    stock_items: list  # [(id, material_id, section_type), ...]
+    items_per_order: int = 50
+    iterations: int = 1
+    seed: int = 0
+
+
+def _item_post_data(rng, sequence_number, part_ids, stock_items):
+    """Поля формы add_order_item для случайной детали из справочника"""
+    stock_id, material_id, section_type = rng.choice(stock_items)
+    data = {
+        'sequence_number': str(sequence_number),
+        'part_name': rng.choice(part_ids),
+        'material': material_id,
+        'stock_item': stock_id,
+        'quantity': rng.randint(1, 20),
+    }
+    length = rng.randint(10, 500)
+    if section_type == 'sheet':
+        data.update(sheet_length=length, width=rng.randint(20, 300), height=rng.randint(20, 300))
+    elif section_type == 'round':
+        data.update(round_length=length, diameter=rng.randint(10, 120))
+    elif section_type == 'hexagon':
+        data.update(hex_length=length, key_size=rng.randint(10, 60))
+    else:
+        data.update(length=length)
+    return data
+
+
+def _order_id_from_location(location):
+    match = re.search(r'/orders/(\d+)/', location)
+    if not match:
+        raise LoadTestError(f'Не удалось определить номер заказа из {location!r}')
+    return int(match.group(1))
+
+
+async def run_scenario(config, stats, terminal):
+    """Один «терминал»: полный рабочий цикл технолога"""
+    rng = random.Random(f'{config.seed}-{terminal}')
+    client = HttpClient(config.base_url, stats)
+
+    await client.request('login GET', 'GET', '/login/')
+    response = await client.request('login POST', 'POST', '/login/', {
+        'username': config.username,
+        'password': config.password,
+        'csrfmiddlewaretoken': client.csrf_token,
+    })
+    if response.status != 302:
+        raise LoadTestError(f'Вход пользователя {config.username} не выполнен ({response.status})')
+
+    for iteration in range(config.iterations):
+        await client.request('order_list', 'GET', '/orders/')
+
+        response = await client.request('order_create', 'POST', '/orders/create/', {
+            'order_number': f'LT-{terminal}-{iteration}-{rng.randint(0, 10**6)}',
+            'order_name': 'Нагрузочный тест',
+            'coefficient': '1.00',
+            'order_quantity': 1,
+            'csrfmiddlewaretoken': client.csrf_token,
+        })
+        order_id = _order_id_from_location(response.location)
+
+        for number in range(1, config.items_per_order + 1):
+            await client.request('add_order_item GET', 'GET', f'/orders/{order_id}/add-item/')
+            data = _item_post_data(rng, number, config.part_ids, config.stock_items)
+            data['csrfmiddlewaretoken'] = client.csrf_token
+            await client.request('add_order_item POST', 'POST', f'/orders/{order_id}/add-item/', data)
+
+        await client.request('order_detail', 'GET', f'/orders/{order_id}/')
+        await client.request(
+            'update_order_coefficient', 'POST', f'/orders/{order_id}/update-coefficient/',
+            {'coefficient': rng.choice(['1.05', '1.10', '1.20']), 'csrfmiddlewaretoken': client.csrf_token},
+            headers={'X-Requested-With': 'XMLHttpRequest'},
+        )
+
+        await client.request('print_order_report', 'GET', f'/orders/{order_id}/print/')
+        await client.request('print_grouped_report', 'GET', f'/orders/{order_id}/print-grouped/')
+        await client.request('print_cutting_task', 'GET', f'/orders/{order_id}/print-cutting/')
+
+
+async def run_load(configs, ramp_up=0.0):
+    """Запускает все терминалы одновременно; возвращает (stats, длительность, ошибки сценариев)"""
+    stats = {}
+    failures = []
+
+    async def terminal(index, config):
+        if ramp_up and len(configs) > 1:
+            await asyncio.sleep(ramp_up * index / (len(configs) - 1))
+        try:
+            await run_scenario(config, stats, index)
+        except (OSError, asyncio.TimeoutError, LoadTestError) as e:
+            failures.append(f'терминал {index}: {e}')
+
+    start = time.perf_counter()
+    await asyncio.gather(*(terminal(i, c) for i, c in enumerate(configs)))
+    return stats, time.perf_counter() - start, failures
+
+
+def format_report(stats, elapsed):
+    """Таблица: запросы, ошибки, RPS и перцентили времени ответа по маршрутам"""
+    header = f'{"Маршрут":<28}{"Запр.":>7}{"Ошиб.":>7}{"RPS":>8}{"p50, мс":>10}{"p95, мс":>10}{"p99, мс":>10}'
+    lines = [header, '-' * len(header)]
+    total = RouteStats()
+    for route in sorted(stats):
+        s = stats[route]
+        total.latencies.extend(s.latencies)
+        total.errors += s.errors
+        lines.append(
+            f'{route:<28}{len(s.latencies):>7}{s.errors:>7}{len(s.latencies) / elapsed:>8.1f}'
+            f'{s.percentile(50):>10.1f}{s.percentile(95):>10.1f}{s.percentile(99):>10.1f}'
+        )
+    lines.append('-' * len(header))
+    lines.append(
+        f'{"ИТОГО":<28}{len(total.latencies):>7}{total.errors:>7}{len(total.latencies) / elapsed:>8.1f}'
+        f'{total.percentile(50):>10.1f}{total.percentile(95):>10.1f}{total.percentile(99):>10.1f}'
+    )
+    lines.append(f'Длительность: {elapsed:.1f} с')
+    return '\n'.join(lines)
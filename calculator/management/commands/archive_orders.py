@@ -0,0 +1,40 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from calculator import archive
+
+
+class Command(BaseCommand):
+    help = ('Переносит старые заказы с деталями в архивную базу (ARCHIVE_DB_PATH) порциями; '
+            'с --restore возвращает указанные заказы из архива')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Архивировать заказы старше указанного числа дней')
+        parser.add_argument('--batch-size', type=int, default=200, help='Заказов в одной транзакции')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать число заказов')
+        parser.add_argument('--restore', type=int, nargs='+', metavar='ORDER_ID',
+                            help='Вернуть заказы из архива')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if options['restore']:
+            restored = archive.restore_orders(options['restore'])
+            self.stdout.write(self.style.SUCCESS(f'Восстановлено из архива заказов: {restored}'))
+            return
+
+        before = timezone.now() - timedelta(days=options['days'])
+        if options['dry_run']:
+            self.stdout.write(f'Будет перенесено в архив заказов: {archive.candidates(before).count()}')
+            return
+        total = archive.archive_before(
+            before, batch_size=options['batch_size'],
+            progress=lambda done: self.stdout.write(f'Перенесено заказов: {done}'),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'В архив перенесено заказов: {total} за {time.perf_counter() - start:.1f} с'
+        ))
@@ -0,0 +1,46 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator import backup
+
+
+class Command(BaseCommand):
+    help = ('Резервная копия базы SQLite и архива заказов без остановки сервиса (online backup API, '
+            'порциями страниц), с проверкой целостности, сжатием и удалением старых копий')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Каталог копий (по умолчанию BACKUP_DIR)')
+        parser.add_argument('--keep', type=int, default=settings.BACKUP_KEEP,
+                            help='Сколько последних копий хранить (0 — не удалять)')
+        parser.add_argument('--pages', type=int, default=256, help='Страниц базы за один шаг копирования')
+        parser.add_argument('--sleep', type=float, default=0.005, help='Пауза между шагами, с')
+        parser.add_argument('--no-compress', action='store_true', help='Не сжимать копию gzip')
+        parser.add_argument('--list', action='store_true', help='Показать имеющиеся копии')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for path in backup.list_backups(options['dir']):
+                line = f'{path.name}\t{path.stat().st_size / 1024 / 1024:.1f} МБ'
+                archive_path = backup.archive_copy(path)
+                if archive_path.is_file():
+                    line += f'\tархив {archive_path.stat().st_size / 1024 / 1024:.1f} МБ'
+                self.stdout.write(line)
+            return
+
+        start = time.perf_counter()
+        try:
+            path = backup.create_backup(
+                options['dir'], pages=options['pages'], sleep=options['sleep'],
+                compress=not options['no_compress'], keep=options['keep'] or None,
+            )
+        except backup.BackupError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'Копия сохранена: {path} ({path.stat().st_size / 1024 / 1024:.1f} МБ, '
+            f'{time.perf_counter() - start:.1f} с)'
+        ))
+        archive_path = backup.archive_copy(path)
+        if archive_path.is_file():
+            self.stdout.write(f'Копия архива заказов: {archive_path}')
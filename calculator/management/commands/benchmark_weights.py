@@ -0,0 +1,139 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from calculator import weights
+from calculator.models import Order, OrderItem
+
+PI = 3.14159
+SQRT3 = 1.73205
+
+
+def float_weight_g(item):
+    """Прежний расчет веса детали во float (для сравнения)"""
+    if item.is_special or not item.material or not item.stock_item:
+        return 0
+    stock_item = item.stock_item
+    length = float(item.length or 0)
+    if stock_item.section_type == 'sheet':
+        volume = length * float(item.width or 0) * float(stock_item.width or 0)
+    elif stock_item.section_type == 'round':
+        volume = PI * (float(stock_item.diameter or 0) / 2) ** 2 * length
+    elif stock_item.section_type == 'hexagon':
+        volume = (3 * SQRT3 / 2) * float(item.key_size or 0) ** 2 * length
+    else:
+        outer = float(stock_item.outer_diameter or 0)
+        wall = float(stock_item.wall_thickness or 0)
+        volume = PI * wall * (outer - wall) * length
+    return volume / 1000 * float(item.material.density)
+
+
+def float_total_weight_g(item, coefficient):
+    if item.is_special:
+        return 0
+    return float_weight_g(item) * item.quantity * float(coefficient)
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает целочисленный расчет весов (мкм/мг) с прежним float-расчетом: '
+            'время на заказах базы и расхождения итогов между страницами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000, help='Количество заказов для замера')
+        parser.add_argument('--repeat', type=int, default=3, help='Повторов каждого замера (берется лучший)')
+
+    def timed(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def handle(self, *args, **options):
+        orders = list(Order.objects.order_by('id')[:options['orders']])
+        if not orders:
+            raise CommandError('В базе нет заказов — заполните ее командой generate_dataset')
+        by_id = {order.id: order for order in orders}
+        items = list(
+            OrderItem.objects.filter(order__in=orders)
+            .select_related('material', 'stock_item').order_by('order_id', 'id')
+        )
+        for item in items:
+            item.order = by_id[item.order_id]
+        repeat = options['repeat']
+
+        def float_detail():
+            # Карточка заказа: сумма весов позиций в порядке вывода
+            totals = dict.fromkeys(by_id, 0.0)
+            for item in items:
+                totals[item.order_id] += float_total_weight_g(item, item.order.coefficient)
+            return {oid: total * by_id[oid].order_quantity for oid, total in totals.items()}
+
+        def float_grouped():
+            # Группированный отчет: сумма по группам материал/сортамент
+            groups = {}
+            for item in items:
+                key = (item.order_id, item.material_id, item.stock_item_id)
+                groups[key] = groups.get(key, 0.0) + (
+                    float_total_weight_g(item, item.order.coefficient) * item.order.order_quantity
+                )
+            totals = dict.fromkeys(by_id, 0.0)
+            for (oid, _, _), weight in groups.items():
+                totals[oid] += weight
+            return totals
+
+        def int_models():
+            totals = dict.fromkeys(by_id, 0)
+            for item in items:
+                totals[item.order_id] += weights.item_total_mg(item, item.order.coefficient)
+            return {oid: total * by_id[oid].order_quantity for oid, total in totals.items()}
+
+        def int_sql():
+            # Список заказов: сумма сохраненных весов в SQL
+            totals = weights.order_totals_mg(OrderItem.objects.filter(order__in=orders))
+            return {oid: totals.get(oid, 0) * by_id[oid].order_quantity for oid in by_id}
+
+        def float_load():
+            # Полный путь прежней карточки: загрузка моделей + float-расчет
+            loaded = OrderItem.objects.filter(order__in=orders).select_related('material', 'stock_item', 'order')
+            totals = dict.fromkeys(by_id, 0.0)
+            for item in loaded:
+                totals[item.order_id] += float_total_weight_g(item, item.order.coefficient)
+            return totals
+
+        def float_sql():
+            return dict(
+                OrderItem.objects.filter(order__in=orders).with_weights()
+                .values('order_id').order_by().annotate(weight=Sum('total_weight_g_db'))
+                .values_list('order_id', 'weight')
+            )
+
+        detail, float_time = self.timed(repeat, float_detail)
+        grouped, _ = self.timed(1, float_grouped)
+        exact, int_time = self.timed(repeat, int_models)
+        bulk, bulk_time = self.timed(repeat, int_sql)
+        _, float_load_time = self.timed(repeat, float_load)
+        _, float_sql_time = self.timed(repeat, float_sql)
+
+        drift = [oid for oid in by_id if f'{detail[oid] / 1000:.3f}' != f'{grouped[oid] / 1000:.3f}']
+        max_error = max(abs(detail[oid] - grouped[oid]) for oid in by_id)
+        mismatched = [oid for oid in by_id if exact[oid] != bulk[oid]]
+
+        self.stdout.write(f'Заказов: {len(orders)}, деталей: {len(items)}')
+        self.stdout.write('Расчет по загруженным моделям:')
+        self.stdout.write(f'  float                      {float_time * 1000:9.1f} мс')
+        self.stdout.write(f'  целые                      {int_time * 1000:9.1f} мс')
+        self.stdout.write('С чтением из базы:')
+        self.stdout.write(f'  float, модели              {float_load_time * 1000:9.1f} мс')
+        self.stdout.write(f'  float, агрегат в SQL       {float_sql_time * 1000:9.1f} мс')
+        self.stdout.write(f'  целые, сумма в SQL         {bulk_time * 1000:9.1f} мс')
+        self.stdout.write(
+            f'float: расхождение карточка/группы до {max_error:.3g} г, '
+            f'разный итог в кг (3 знака) у {len(drift)} заказов'
+        )
+        if mismatched:
+            raise CommandError(f'Целочисленные итоги не совпали у {len(mismatched)} заказов')
+        self.stdout.write(self.style.SUCCESS('Целочисленные итоги совпадают на всех путях расчета'))
@@ -0,0 +1,36 @@
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = ('Удаляет просроченные сессии порциями (не блокируя SQLite надолго); '
+            'предназначена для периодического запуска планировщиком')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сессий в одной транзакции удаления')
+        parser.add_argument('--vacuum', action='store_true', help='Выполнить VACUUM после очистки')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                keys = list(
+                    Session.objects.filter(expire_date__lt=now)
+                    .values_list('session_key', flat=True)[:options['batch_size']]
+                )
+                if not keys:
+                    break
+                Session.objects.filter(session_key__in=keys).delete()
+            deleted += len(keys)
+
+        if options['vacuum'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+
+        remaining = Session.objects.count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено просроченных сессий: {deleted}, осталось: {remaining}'
+        ))
@@ -0,0 +1,50 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+
+from calculator import webhooks
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Отправляет исходящие уведомления из очереди на WEBHOOK_URL: '
+            'постоянно (служба) или с --once — готовые на момент запуска')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Отправить готовые события и завершиться')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Пауза между проверками очереди, с')
+        parser.add_argument('--batch-size', type=int, default=settings.WEBHOOK_BATCH_SIZE,
+                            help='Событий в одном запросе')
+
+    def handle(self, *args, **options):
+        if not webhooks.enabled():
+            self.stdout.write(self.style.WARNING('WEBHOOK_URL не задан — события не ставятся в очередь'))
+        if options['once']:
+            delivered, failed = webhooks.deliver_pending(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Доставлено событий: {delivered}, ошибок отправки: {failed}'))
+            return
+
+        pruned_at = float('-inf')
+        try:
+            while True:
+                try:
+                    delivered, failed = webhooks.deliver_pending(options['batch_size'])
+                    if delivered or failed:
+                        self.stdout.write(f'Доставлено событий: {delivered}, ошибок отправки: {failed}')
+                    # Доставленные события старше WEBHOOK_KEEP_DAYS удаляются раз в час
+                    if time.monotonic() - pruned_at > 3600:
+                        webhooks.prune()
+                        pruned_at = time.monotonic()
+                except DatabaseError:
+                    # Например, база заблокирована долгой записью: служба не останавливается,
+                    # события остаются в очереди до следующей проверки
+                    logger.exception('Ошибка базы данных при доставке уведомлений')
+                    connection.close()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
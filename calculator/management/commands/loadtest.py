@@ -0,0 +1,48 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator.loadtest import ScenarioConfig, format_report, run_load
+from calculator.models import PartName, StockItem
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный тест запущенного сервера: N терминалов одновременно проходят '
+            'рабочий сценарий (вход, список заказов, добавление деталей, печать отчетов)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Адрес запущенного сервера')
+        parser.add_argument('--terminals', type=int, default=5, help='Количество одновременных терминалов')
+        parser.add_argument('--items', type=int, default=50, help='Деталей, добавляемых в каждый заказ')
+        parser.add_argument('--iterations', type=int, default=1, help='Повторов сценария на терминал')
+        parser.add_argument('--ramp-up', type=float, default=0.0, help='Время плавного старта терминалов, с')
+        parser.add_argument('--user-prefix', default='loadtest_', help='Префикс пользователей (см. seed_loadtest)')
+        parser.add_argument('--password', default='loadtest')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # Идентификаторы справочников берем из той же базы, с которой работает сервер
+        part_ids = list(PartName.objects.values_list('id', flat=True))
+        stock_items = list(StockItem.objects.values_list('id', 'material_id', 'section_type'))
+        if not part_ids or not stock_items:
+            raise CommandError('Справочники пусты: сначала выполните manage.py seed_loadtest')
+
+        configs = [
+            ScenarioConfig(
+                base_url=options['url'],
+                username=f'{options["user_prefix"]}{n:02d}',
+                password=options['password'],
+                part_ids=part_ids,
+                stock_items=stock_items,
+                items_per_order=options['items'],
+                iterations=options['iterations'],
+                seed=options['seed'],
+            )
+            for n in range(1, options['terminals'] + 1)
+        ]
+
+        stats, elapsed, failures = asyncio.run(run_load(configs, ramp_up=options['ramp_up']))
+
+        self.stdout.write(format_report(stats, elapsed))
+        for failure in failures:
+            self.stderr.write(self.style.ERROR(failure))
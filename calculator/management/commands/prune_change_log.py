@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from calculator import changefeed
+
+
+class Command(BaseCommand):
+    help = ('Сжимает журнал ленты изменений: удаляет старые записи, вытесненные более новыми, '
+            'и старые записи об удалении; предназначена для периодического запуска планировщиком')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHANGE_LOG_KEEP_DAYS,
+                            help='Срок хранения записей, дни')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Записей в одной транзакции удаления')
+
+    def handle(self, *args, **options):
+        deleted = changefeed.prune(options['days'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей журнала изменений: {deleted}'))
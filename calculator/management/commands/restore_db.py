@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from calculator import backup
+
+
+class Command(BaseCommand):
+    help = ('Восстанавливает базу (и архив заказов, если он есть в копии) из резервной копии '
+            '(сжатой или нет) поверх текущей; '
+            'копия проверяется до восстановления, текущая база предварительно сохраняется')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Файл копии (по умолчанию — последняя копия в BACKUP_DIR)')
+        parser.add_argument('--noinput', action='store_false', dest='interactive', help='Не запрашивать подтверждение')
+        parser.add_argument('--no-safety-backup', action='store_true',
+                            help='Не сохранять текущую базу перед восстановлением')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            backups = backup.list_backups()
+            if not backups:
+                raise CommandError('Резервные копии не найдены')
+            path = backups[0]
+
+        if options['interactive']:
+            answer = input(f'Текущая база будет заменена данными из {path}. Продолжить? [y/N] ')
+            if answer.strip().lower() not in ('y', 'yes', 'д', 'да'):
+                raise CommandError('Восстановление отменено')
+
+        start = time.perf_counter()
+        try:
+            if not options['no_safety_backup']:
+                safety = backup.create_backup()
+                self.stdout.write(f'Текущая база сохранена: {safety}')
+            backup.restore_backup(path)
+        except backup.BackupError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f'База восстановлена из {path} за {time.perf_counter() - start:.1f} с; '
+            f'если копия снята до последних обновлений, выполните migrate'
+        ))
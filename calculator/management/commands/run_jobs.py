@@ -0,0 +1,63 @@
+import logging
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from calculator import jobs
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди (копирование больших заказов, пересчет масс): '
+            'постоянно (служба) или с --once — до опустошения очереди')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help='Число задач, выполняемых одновременно')
+        parser.add_argument('--once', action='store_true', help='Выполнить задачи очереди и завершиться')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза между проверками очереди, с')
+
+    def handle(self, *args, **options):
+        # Обработчик один: задачи, оставшиеся в running, прерваны его прошлой остановкой
+        recovered = jobs.recover()
+        if recovered:
+            self.stdout.write(self.style.WARNING(f'Прерванных задач: {recovered}'))
+        jobs.prune()
+
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.work, args=(stop, options), name=f'job-worker-{number}', daemon=True)
+            for number in range(max(1, options['threads']))
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            stop.set()
+            self.stdout.write('Остановка: выполняемые задачи будут прерваны')
+
+    def work(self, stop, options):
+        try:
+            while not stop.is_set():
+                try:
+                    job = jobs.claim()
+                    if job is not None:
+                        status = jobs.run(job)
+                        self.stdout.write(f'{job.name} #{job.id}: {status}')
+                    elif options['once']:
+                        return
+                    else:
+                        stop.wait(options['interval'])
+                except Exception:
+                    # Ошибки самой очереди (например, база заблокирована) не останавливают поток;
+                    # задача, итог которой не записан, останется в running до перезапуска (recover)
+                    logger.exception('Ошибка обработчика фоновых задач')
+                    connection.close()
+                    stop.wait(options['interval'])
+        finally:
+            # У каждого потока собственное соединение с базой
+            connection.close()
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from calculator.datagen import DatasetGenerator
+from calculator.models import StockItem
+
+
+class Command(BaseCommand):
+    help = 'Создает пользователей и справочники для нагрузочного тестирования (loadtest)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Количество пользователей loadtest_NN')
+        parser.add_argument('--password', default='loadtest', help='Пароль пользователей')
+        parser.add_argument('--orders', type=int, default=200, help='Количество заказов')
+        parser.add_argument('--items', type=int, default=40, help='Среднее количество деталей в заказе')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generator = DatasetGenerator(seed=options['seed'])
+
+        users = generator.users(options['users'], password=options['password'], prefix='loadtest_')
+        materials = generator.materials(14)
+        part_names = generator.part_names(100)
+        if StockItem.objects.exists():
+            stock_items = list(StockItem.objects.select_related('material'))
+        else:
+            stock_items = generator.stock_items(materials, 20)
+        total_items = generator.orders(
+            options['orders'], users, stock_items, part_names, items_per_order=options['items'],
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {len(users)}, материалов: {len(materials)}, '
+            f'сортамента: {len(stock_items)}, заказов создано: {options["orders"]}, деталей: {total_items}'
+        ))
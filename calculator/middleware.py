@@ -0,0 +1,28 @@
+from django.conf import settings
+
+from . import history
+from .slow_queries import record_slow_queries
+
+
+class SlowQueryLogMiddleware:
+    """Записывает медленные SQL-запросы каждого запроса в журнал с планом выполнения"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.SLOW_QUERY_LOG_ENABLED:
+            return self.get_response(request)
+        with record_slow_queries(request=request):
+            return self.get_response(request)
+
+
+class RevisionUserMiddleware:
+    """Автор редакций заказов, записанных во время запроса (history.py)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with history.acting_user(request.user):
+            return self.get_response(request)
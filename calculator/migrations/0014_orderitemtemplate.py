@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-19 13:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0013_stockitem_outer_diameter_stockitem_wall_thickness_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItemTemplate',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='item_template', serialize=False, to='calculator.order', verbose_name='Заказ')),
+                ('items_count', models.PositiveIntegerField(default=0, verbose_name='Количество позиций')),
+                ('last_item_id', models.BigIntegerField(blank=True, null=True, verbose_name='ID последней детали')),
+                ('section_type', models.CharField(blank=True, max_length=20, null=True, verbose_name='Тип сортамента')),
+                ('quantity', models.IntegerField(blank=True, null=True, verbose_name='Количество деталей')),
+                ('is_special', models.BooleanField(default=False, verbose_name='Особая запись')),
+                ('length', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='Длина (мм)')),
+                ('width', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='Ширина (мм)')),
+                ('height', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='Высота (мм)')),
+                ('diameter', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='Диаметр (мм)')),
+                ('key_size', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='Размер под ключ (мм)')),
+                ('material', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='calculator.material')),
+                ('part_name', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='calculator.partname')),
+                ('stock_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='calculator.stockitem')),
+            ],
+            options={
+                'verbose_name': 'Шаблон следующей детали',
+                'verbose_name_plural': 'Шаблоны следующих деталей',
+            },
+        ),
+    ]
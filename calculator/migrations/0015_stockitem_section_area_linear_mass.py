@@ -0,0 +1,45 @@
+# Generated by Django 4.2 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+
+def fill_section_properties(apps, schema_editor):
+    StockItem = apps.get_model('calculator', 'StockItem')
+    stock_items = list(StockItem.objects.select_related('material'))
+    for stock_item in stock_items:
+        if stock_item.section_type == 'round':
+            d = float(stock_item.diameter or 0)
+            area = 3.14159 * (d/2)**2
+        elif stock_item.section_type == 'hexagon':
+            a = float(stock_item.key_size or 0)
+            area = (3 * 1.73205 / 2) * a**2
+        elif stock_item.section_type == 'tube':
+            D = float(stock_item.outer_diameter or 0)
+            s = float(stock_item.wall_thickness or 0)
+            area = 3.14159 * s * (D - s)
+        else:
+            continue
+        stock_item.section_area = area
+        stock_item.linear_mass = area * float(stock_item.material.density) / 1000
+    StockItem.objects.bulk_update(stock_items, ['section_area', 'linear_mass'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0014_orderitemtemplate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockitem',
+            name='linear_mass',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Погонная масса (г/мм)'),
+        ),
+        migrations.AddField(
+            model_name='stockitem',
+            name='section_area',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Площадь сечения (мм²)'),
+        ),
+        migrations.RunPython(fill_section_properties, migrations.RunPython.noop),
+    ]
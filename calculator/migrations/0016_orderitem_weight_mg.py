@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-19 13:46
+
+from django.db import migrations, models
+
+from decimal import Decimal
+
+
+def fill_weights(apps, schema_editor):
+    # Формула зафиксирована на момент миграции (целые мкм и мг, как в weights.py),
+    # чтобы последующие изменения кода расчета не меняли ее результат
+    OrderItem = apps.get_model('calculator', 'OrderItem')
+
+    def scaled(value):
+        return int(Decimal(str(value or 0)).scaleb(3).to_integral_value())
+
+    def area(section_type, width, key_size, stock_width, diameter, outer_diameter, wall_thickness):
+        if section_type == 'sheet':
+            return width * stock_width, 1
+        if section_type == 'hexagon':
+            return 3 * 173205 * key_size * key_size, 2 * 100000
+        if section_type == 'round':
+            return 314159 * diameter * diameter, 4 * 100000
+        if section_type == 'tube':
+            return 314159 * wall_thickness * (outer_diameter - wall_thickness), 100000
+        return 0, 1
+
+    rows = OrderItem.objects.values_list(
+        'id', 'is_special', 'length', 'width', 'key_size', 'material__density', 'stock_item__section_type',
+        'stock_item__width', 'stock_item__diameter', 'stock_item__outer_diameter', 'stock_item__wall_thickness',
+    )
+    items = []
+    for pk, is_special, length, width, key_size, density, section_type, *stock in rows.iterator(chunk_size=2000):
+        if is_special or density is None or section_type is None:
+            continue
+        numerator, denominator = area(section_type, scaled(width), scaled(key_size), *map(scaled, stock))
+        numerator *= scaled(length) * scaled(density)
+        denominator *= 10 ** 12
+        # Округление половины вверх
+        items.append(OrderItem(id=pk, weight_mg=(2 * numerator + denominator) // (2 * denominator)))
+    OrderItem.objects.bulk_update(items, ['weight_mg'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0015_stockitem_section_area_linear_mass'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='weight_mg',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Вес детали (мг)'),
+        ),
+        migrations.RunPython(fill_weights, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2 on 2026-10-19 13:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('calculator', '0016_orderitem_weight_mg'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockBalance',
+            fields=[
+                ('stock_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='calculator.stockitem', verbose_name='Сортамент')),
+                ('on_hand_length_um', models.BigIntegerField(default=0, verbose_name='Длина на складе (мкм)')),
+                ('on_hand_mg', models.BigIntegerField(default=0, verbose_name='Масса на складе (мг)')),
+                ('reserved_length_um', models.BigIntegerField(default=0, verbose_name='Зарезервировано (мкм)')),
+                ('reserved_mg', models.BigIntegerField(default=0, verbose_name='Зарезервировано (мг)')),
+                ('available_length_um', models.BigIntegerField(db_index=True, default=0, verbose_name='Свободно (мкм)')),
+                ('available_mg', models.BigIntegerField(db_index=True, default=0, verbose_name='Свободно (мг)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменено')),
+            ],
+            options={
+                'verbose_name': 'Остаток сортамента',
+                'verbose_name_plural': 'Остатки сортамента',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('length_um', models.BigIntegerField(default=0, verbose_name='Длина (мкм)')),
+                ('mass_mg', models.BigIntegerField(default=0, verbose_name='Масса (мг)')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to='calculator.order', verbose_name='Заказ')),
+                ('stock_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='calculator.stockitem', verbose_name='Сортамент')),
+            ],
+            options={
+                'verbose_name': 'Резерв сортамента',
+                'verbose_name_plural': 'Резервы сортамента',
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'Поступление'), ('reservation', 'Резервирование'), ('release', 'Снятие резерва'), ('consumption', 'Списание в производство')], max_length=20, verbose_name='Вид движения')),
+                ('length_um', models.BigIntegerField(default=0, verbose_name='Длина (мкм)')),
+                ('mass_mg', models.BigIntegerField(default=0, verbose_name='Масса (мг)')),
+                ('comment', models.CharField(blank=True, max_length=200, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='calculator.order', verbose_name='Заказ')),
+                ('stock_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='calculator.stockitem', verbose_name='Сортамент')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Движение сортамента',
+                'verbose_name_plural': 'Движение сортамента',
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stockreservation',
+            constraint=models.UniqueConstraint(fields=('order', 'stock_item'), name='unique_stock_reservation'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['stock_item', 'created_at'], name='calculator__stock_i_580aff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['order', 'kind'], name='calculator__order_i_af83a5_idx'),
+        ),
+    ]
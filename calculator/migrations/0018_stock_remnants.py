@@ -0,0 +1,39 @@
+# Generated by Django 4.2 on 2026-10-19 13:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0017_stock_inventory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockRemnant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('length_um', models.BigIntegerField(verbose_name='Длина (мкм)')),
+                ('width_um', models.BigIntegerField(default=0, verbose_name='Ширина (мкм)')),
+                ('status', models.CharField(choices=[('available', 'На складе'), ('used', 'Использован'), ('scrapped', 'Списан в лом')], default='available', max_length=10, verbose_name='Состояние')),
+                ('comment', models.CharField(blank=True, max_length=200, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменено')),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pieces', to='calculator.stockremnant', verbose_name='Исходный остаток')),
+                ('source_order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='produced_remnants', to='calculator.order', verbose_name='Получен из заказа')),
+                ('stock_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='remnants', to='calculator.stockitem', verbose_name='Сортамент')),
+                ('used_order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='used_remnants', to='calculator.order', verbose_name='Использован в заказе')),
+            ],
+            options={
+                'verbose_name': 'Деловой остаток',
+                'verbose_name_plural': 'Деловые остатки',
+                'ordering': ['stock_item', 'length_um', 'width_um'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockremnant',
+            index=models.Index(condition=models.Q(('status', 'available')), fields=['stock_item', 'length_um', 'width_um'], name='remnant_available_size_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2 on 2026-10-19 13:58
+
+from django.db import migrations, models
+
+# Правила, ранее зашитые в print_cutting_task
+DEFAULT_ROUTES = [
+    {'priority': 10, 'section_type': 'sheet', 'material_pattern': '1.2343', 'target_section': 'round'},
+    {'priority': 20, 'section_type': 'sheet', 'material_pattern': '4Х5МФС', 'target_section': 'round'},
+    {'priority': 30, 'section_type': 'sheet', 'target_section': 'sheet'},
+    {'priority': 40, 'section_type': 'round', 'min_diameter': 50, 'target_section': 'round'},
+    {'priority': 50, 'section_type': 'tube', 'target_section': 'tube'},
+]
+
+
+def create_default_routes(apps, schema_editor):
+    CuttingRoute = apps.get_model('calculator', 'CuttingRoute')
+    CuttingRoute.objects.bulk_create([CuttingRoute(**route) for route in DEFAULT_ROUTES])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0018_stock_remnants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CuttingRoute',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('priority', models.PositiveIntegerField(default=100, verbose_name='Приоритет')),
+                ('material_pattern', models.CharField(blank=True, help_text='Без учета регистра; пусто — любой материал', max_length=100, verbose_name='Материал содержит')),
+                ('section_type', models.CharField(blank=True, choices=[('sheet', 'Лист'), ('round', 'Кругляк'), ('hexagon', 'Шестигранник'), ('tube', 'Труба')], help_text='Пусто — любой', max_length=20, verbose_name='Тип сортамента')),
+                ('min_diameter', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='Диаметр детали больше (мм)')),
+                ('max_diameter', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True, verbose_name='Диаметр детали не больше (мм)')),
+                ('target_section', models.CharField(choices=[('sheet', 'Листовой материал'), ('round', 'Круг / лист (специальные материалы)'), ('tube', 'Труба'), ('skip', 'Не включать в задание')], max_length=10, verbose_name='Раздел задания')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Действует')),
+            ],
+            options={
+                'verbose_name': 'Правило задания на заготовку',
+                'verbose_name_plural': 'Правила задания на заготовку',
+                'ordering': ['priority', 'id'],
+            },
+        ),
+        migrations.RunPython(create_default_routes, migrations.RunPython.noop),
+    ]
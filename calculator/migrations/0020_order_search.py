@@ -0,0 +1,120 @@
+from django.db import migrations
+
+# Таблицы и триггеры поиска (search.py) зафиксированы на момент миграции;
+# последующие изменения триггеров — в своих миграциях
+ORDER_FTS = 'calculator_order_fts'
+ITEM_FTS = 'calculator_orderitem_fts'
+
+CREATE_TABLES = [
+    f"CREATE VIRTUAL TABLE {ORDER_FTS} USING fts5("
+    f"order_number, order_name, drawing_number, items, tokenize='unicode61', prefix='2 3')",
+    f"CREATE VIRTUAL TABLE {ITEM_FTS} USING fts5("
+    f"part_name, designation, material, order_id UNINDEXED, tokenize='unicode61', prefix='2 3')",
+]
+
+
+def _order_rows(where):
+    return f"""
+        INSERT INTO {ORDER_FTS} (rowid, order_number, order_name, drawing_number, items)
+        SELECT o.id, o.order_number, o.order_name, COALESCE(o.drawing_number, ''),
+               COALESCE((SELECT group_concat(COALESCE(p.name, '') || ' ' || COALESCE(i.designation, '')
+                                             || ' ' || COALESCE(m.name, ''), ' ')
+                         FROM calculator_orderitem i
+                         LEFT JOIN calculator_partname p ON p.id = i.part_name_id
+                         LEFT JOIN calculator_material m ON m.id = i.material_id
+                         WHERE i.order_id = o.id), '')
+        FROM calculator_order o WHERE {where};"""
+
+
+def _order_document(order_id):
+    return f"""
+        DELETE FROM {ORDER_FTS} WHERE rowid = {order_id};{_order_rows(f'o.id = {order_id}')}"""
+
+
+def _item_rows(where):
+    return f"""
+        INSERT INTO {ITEM_FTS} (rowid, part_name, designation, material, order_id)
+        SELECT i.id, COALESCE(p.name, ''), COALESCE(i.designation, ''), COALESCE(m.name, ''), i.order_id
+        FROM calculator_orderitem i
+        LEFT JOIN calculator_partname p ON p.id = i.part_name_id
+        LEFT JOIN calculator_material m ON m.id = i.material_id
+        WHERE {where};"""
+
+
+def _reference_trigger(name, table, column):
+    items = f"SELECT id FROM calculator_orderitem WHERE {column} = NEW.id"
+    orders = f"SELECT DISTINCT order_id FROM calculator_orderitem WHERE {column} = NEW.id"
+    return f"""
+    CREATE TRIGGER {name} AFTER UPDATE OF name ON {table} BEGIN
+        DELETE FROM {ITEM_FTS} WHERE rowid IN ({items});{_item_rows(f'i.{column} = NEW.id')}
+        DELETE FROM {ORDER_FTS} WHERE rowid IN ({orders});{_order_rows(f'o.id IN ({orders})')}
+    END"""
+
+
+CREATE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER calculator_orderitem_fts_ai AFTER INSERT ON calculator_orderitem BEGIN
+        {_item_rows('i.id = NEW.id')}
+        {_order_document('NEW.order_id')}
+    END""",
+    f"""
+    CREATE TRIGGER calculator_orderitem_fts_au
+    AFTER UPDATE OF order_id, part_name_id, material_id, designation ON calculator_orderitem BEGIN
+        DELETE FROM {ITEM_FTS} WHERE rowid = OLD.id;
+        {_item_rows('i.id = NEW.id')}
+        {_order_document('OLD.order_id')}
+        {_order_document('NEW.order_id')}
+    END""",
+    f"""
+    CREATE TRIGGER calculator_orderitem_fts_ad AFTER DELETE ON calculator_orderitem BEGIN
+        DELETE FROM {ITEM_FTS} WHERE rowid = OLD.id;
+        {_order_document('OLD.order_id')}
+    END""",
+    f"""
+    CREATE TRIGGER calculator_order_fts_ai AFTER INSERT ON calculator_order BEGIN
+        {_order_document('NEW.id')}
+    END""",
+    f"""
+    CREATE TRIGGER calculator_order_fts_au
+    AFTER UPDATE OF order_number, order_name, drawing_number ON calculator_order BEGIN
+        {_order_document('NEW.id')}
+    END""",
+    f"""
+    CREATE TRIGGER calculator_order_fts_ad AFTER DELETE ON calculator_order BEGIN
+        DELETE FROM {ORDER_FTS} WHERE rowid = OLD.id;
+    END""",
+    _reference_trigger('calculator_partname_fts_au', 'calculator_partname', 'part_name_id'),
+    _reference_trigger('calculator_material_fts_au', 'calculator_material', 'material_id'),
+]
+
+DROP = [
+    'DROP TRIGGER IF EXISTS calculator_orderitem_fts_ai',
+    'DROP TRIGGER IF EXISTS calculator_orderitem_fts_au',
+    'DROP TRIGGER IF EXISTS calculator_orderitem_fts_ad',
+    'DROP TRIGGER IF EXISTS calculator_order_fts_ai',
+    'DROP TRIGGER IF EXISTS calculator_order_fts_au',
+    'DROP TRIGGER IF EXISTS calculator_order_fts_ad',
+    'DROP TRIGGER IF EXISTS calculator_partname_fts_au',
+    'DROP TRIGGER IF EXISTS calculator_material_fts_au',
+    f'DROP TABLE IF EXISTS {ORDER_FTS}',
+    f'DROP TABLE IF EXISTS {ITEM_FTS}',
+]
+
+
+def build_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(_item_rows('1').strip().rstrip(';'))
+        cursor.execute(_order_rows('1').strip().rstrip(';'))
+        cursor.execute(f"INSERT INTO {ORDER_FTS}({ORDER_FTS}) VALUES ('optimize')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0019_cutting_routes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TABLES + CREATE_TRIGGERS, DROP),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2 on 2026-10-19 14:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_section_types(apps, schema_editor):
+    OrderItem = apps.get_model('calculator', 'OrderItem')
+    StockItem = apps.get_model('calculator', 'StockItem')
+    OrderItem.objects.filter(stock_item__isnull=False).update(section_type=Subquery(
+        StockItem.objects.filter(pk=OuterRef('stock_item_id')).values('section_type')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0020_order_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='section_type',
+            field=models.CharField(blank=True, editable=False, max_length=20, null=True, verbose_name='Тип сортамента'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['coefficient', 'created_at'], name='order_coefficient_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['material', 'order'], name='orderitem_material_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['section_type', 'order'], name='orderitem_section_order_idx'),
+        ),
+        migrations.RunPython(fill_section_types, migrations.RunPython.noop),
+    ]
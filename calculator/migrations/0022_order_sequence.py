@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-19 14:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_sequences(apps, schema_editor):
+    """Счетчик каждого заказа начинается с наибольшего номера его деталей"""
+    OrderItem = apps.get_model('calculator', 'OrderItem')
+    OrderSequence = apps.get_model('calculator', 'OrderSequence')
+    last_numbers = {}
+    for order_id, sequence_number in OrderItem.objects.values_list('order_id', 'sequence_number').iterator():
+        prefix = (sequence_number or '').split('-')[0].strip()
+        number = int(prefix) if prefix.isdigit() else 0
+        last_numbers[order_id] = max(last_numbers.get(order_id, 0), number)
+    OrderSequence.objects.bulk_create(
+        [OrderSequence(order_id=order_id, last_number=number) for order_id, number in last_numbers.items()],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0021_order_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSequence',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sequence', serialize=False, to='calculator.order', verbose_name='Заказ')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='Последний выданный номер')),
+            ],
+            options={
+                'verbose_name': 'Счетчик номеров деталей',
+                'verbose_name_plural': 'Счетчики номеров деталей',
+            },
+        ),
+        migrations.RunPython(create_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-19 14:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('calculator', '0022_order_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSnapshot',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='calculator.order', verbose_name='Заказ')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Выпущен в производство')),
+                ('items_count', models.PositiveIntegerField(default=0, verbose_name='Количество позиций')),
+                ('total_items_count', models.PositiveIntegerField(default=0, verbose_name='Количество деталей')),
+                ('total_weight_mg', models.BigIntegerField(default=0, verbose_name='Общий вес (мг)')),
+                ('items', models.JSONField(default=list, verbose_name='Детали')),
+                ('groups', models.JSONField(default=list, verbose_name='Группы')),
+                ('reports', models.JSONField(default=dict, verbose_name='Печатные формы')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Выпустил')),
+            ],
+            options={
+                'verbose_name': 'Снимок заказа',
+                'verbose_name_plural': 'Снимки заказов',
+            },
+        ),
+    ]
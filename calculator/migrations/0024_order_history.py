@@ -0,0 +1,86 @@
+# Generated by Django 4.2 on 2026-10-19 14:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from decimal import Decimal
+
+# Те же поля и представление значений, что в calculator/history.py на момент миграции
+ORDER_FIELDS = ('order_number', 'order_name', 'drawing_number', 'coefficient', 'order_quantity')
+ITEM_FIELDS = ('sequence_number', 'designation', 'part_name_id', 'material_id', 'stock_item_id', 'quantity',
+               'length', 'width', 'height', 'diameter', 'key_size', 'use_iz_prefix', 'is_special')
+
+
+def _value(value):
+    return str(value) if isinstance(value, Decimal) else value
+
+
+def create_history(apps, schema_editor):
+    """Первая редакция каждого существующего заказа — его текущее состояние (контрольная точка)"""
+    Order = apps.get_model('calculator', 'Order')
+    OrderItem = apps.get_model('calculator', 'OrderItem')
+    OrderHistory = apps.get_model('calculator', 'OrderHistory')
+    OrderRevision = apps.get_model('calculator', 'OrderRevision')
+    order_ids = list(Order.objects.order_by('id').values_list('id', flat=True))
+    for start in range(0, len(order_ids), 500):
+        chunk = order_ids[start:start + 500]
+        states = {
+            row['id']: {'order': {field: _value(row[field]) for field in ORDER_FIELDS}, 'items': {}}
+            for row in Order.objects.filter(id__in=chunk).values('id', *ORDER_FIELDS)
+        }
+        for row in OrderItem.objects.filter(order_id__in=chunk).values('id', 'order_id', *ITEM_FIELDS):
+            states[row['order_id']]['items'][str(row['id'])] = {field: _value(row[field]) for field in ITEM_FIELDS}
+        OrderHistory.objects.bulk_create(
+            [OrderHistory(order_id=order_id, last_number=1, state=state) for order_id, state in states.items()]
+        )
+        OrderRevision.objects.bulk_create([
+            OrderRevision(order_id=order_id, number=1, state=state,
+                          changes={key: value for key, value in (('order', state['order']), ('added', state['items']))
+                                   if value})
+            for order_id, state in states.items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('calculator', '0023_order_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderHistory',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='history', serialize=False, to='calculator.order', verbose_name='Заказ')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='Номер последней редакции')),
+                ('state', models.JSONField(default=dict, verbose_name='Состояние')),
+            ],
+            options={
+                'verbose_name': 'История заказа',
+                'verbose_name_plural': 'История заказов',
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='Номер редакции')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('changes', models.JSONField(default=dict, verbose_name='Изменения')),
+                ('state', models.JSONField(blank=True, null=True, verbose_name='Полное состояние')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='calculator.order', verbose_name='Заказ')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Редакция заказа',
+                'verbose_name_plural': 'Редакции заказов',
+                'ordering': ['order', 'number'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='orderrevision',
+            constraint=models.UniqueConstraint(fields=('order', 'number'), name='unique_order_revision'),
+        ),
+        migrations.RunPython(create_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2 on 2026-10-19 14:35
+
+from django.db import migrations, models
+
+# Триггеры журнала изменений (changefeed.py) зафиксированы на момент миграции
+FEED = (
+    ('order', 'calculator_order'),
+    ('item', 'calculator_orderitem'),
+    ('material', 'calculator_material'),
+    ('stock', 'calculator_stockitem'),
+    ('part', 'calculator_partname'),
+)
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+CREATE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER {table}_changelog_{event[0].lower()} AFTER {event} ON {table} BEGIN
+        INSERT INTO calculator_changelog (kind, object_id, deleted, created_at) VALUES ('{kind}', {row}.id, {deleted}, {NOW});
+    END"""
+    for kind, table in FEED
+    for event, row, deleted in (('INSERT', 'NEW', 0), ('UPDATE', 'NEW', 0), ('DELETE', 'OLD', 1))
+]
+
+DROP_TRIGGERS = [f'DROP TRIGGER IF EXISTS {table}_changelog_{event}' for _, table in FEED for event in 'iud']
+
+# Начальное заполнение: каждый существующий объект — как только что созданный
+BACKFILL = [
+    f"INSERT INTO calculator_changelog (kind, object_id, deleted, created_at) "
+    f"SELECT '{kind}', id, 0, {NOW} FROM {table} ORDER BY id"
+    for kind, table in FEED
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0024_order_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=10, verbose_name='Тип объекта')),
+                ('object_id', models.BigIntegerField(verbose_name='id объекта')),
+                ('deleted', models.BooleanField(default=False, verbose_name='Удален')),
+                ('created_at', models.DateTimeField(verbose_name='Дата')),
+            ],
+            options={
+                'verbose_name': 'Запись журнала изменений',
+                'verbose_name_plural': 'Журнал изменений',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS + BACKFILL, DROP_TRIGGERS),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-19 15:02
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    ReferenceVersion = apps.get_model('calculator', 'ReferenceVersion')
+    ReferenceVersion.objects.create(pk=1, version=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0027_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenceVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=1, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия справочников',
+                'verbose_name_plural': 'Версия справочников',
+            },
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,111 @@
+from django.db import migrations
+
+# Триггеры деталей больше не пересобирают документ заказа, а отмечают заказ
+# в calculator_order_fts_dirty (search.refresh_documents). SQL зафиксирован
+# на момент миграции.
+ORDER_FTS = 'calculator_order_fts'
+ITEM_FTS = 'calculator_orderitem_fts'
+DIRTY = 'calculator_order_fts_dirty'
+
+
+def _order_rows(where):
+    return f"""
+        INSERT INTO {ORDER_FTS} (rowid, order_number, order_name, drawing_number, items)
+        SELECT o.id, o.order_number, o.order_name, COALESCE(o.drawing_number, ''),
+               COALESCE((SELECT group_concat(COALESCE(p.name, '') || ' ' || COALESCE(i.designation, '')
+                                             || ' ' || COALESCE(m.name, ''), ' ')
+                         FROM calculator_orderitem i
+                         LEFT JOIN calculator_partname p ON p.id = i.part_name_id
+                         LEFT JOIN calculator_material m ON m.id = i.material_id
+                         WHERE i.order_id = o.id), '')
+        FROM calculator_order o WHERE {where};"""
+
+
+def _order_document(order_id):
+    return f"""
+        DELETE FROM {ORDER_FTS} WHERE rowid = {order_id};{_order_rows(f'o.id = {order_id}')}"""
+
+
+def _item_rows(where):
+    return f"""
+        INSERT INTO {ITEM_FTS} (rowid, part_name, designation, material, order_id)
+        SELECT i.id, COALESCE(p.name, ''), COALESCE(i.designation, ''), COALESCE(m.name, ''), i.order_id
+        FROM calculator_orderitem i
+        LEFT JOIN calculator_partname p ON p.id = i.part_name_id
+        LEFT JOIN calculator_material m ON m.id = i.material_id
+        WHERE {where};"""
+
+
+def _mark(order_id):
+    return f"INSERT OR IGNORE INTO {DIRTY} (order_id) VALUES ({order_id});"
+
+
+def _reference_trigger(name, table, column, rebuild_orders):
+    items = f"SELECT id FROM calculator_orderitem WHERE {column} = NEW.id"
+    orders = f"SELECT DISTINCT order_id FROM calculator_orderitem WHERE {column} = NEW.id"
+    if rebuild_orders:
+        order_sql = f"DELETE FROM {ORDER_FTS} WHERE rowid IN ({orders});{_order_rows(f'o.id IN ({orders})')}"
+    else:
+        order_sql = f"INSERT OR IGNORE INTO {DIRTY} (order_id) {orders};"
+    return f"""
+    CREATE TRIGGER {name} AFTER UPDATE OF name ON {table} BEGIN
+        DELETE FROM {ITEM_FTS} WHERE rowid IN ({items});{_item_rows(f'i.{column} = NEW.id')}
+        {order_sql}
+    END"""
+
+
+def _triggers(rebuild_orders):
+    """Триггеры деталей и справочников: rebuild_orders — прежние (с пересборкой документа заказа)"""
+    def order(order_id):
+        return _order_document(order_id) if rebuild_orders else _mark(order_id)
+    return [
+        f"""
+    CREATE TRIGGER calculator_orderitem_fts_ai AFTER INSERT ON calculator_orderitem BEGIN
+        {_item_rows('i.id = NEW.id')}
+        {order('NEW.order_id')}
+    END""",
+        f"""
+    CREATE TRIGGER calculator_orderitem_fts_au
+    AFTER UPDATE OF order_id, part_name_id, material_id, designation ON calculator_orderitem BEGIN
+        DELETE FROM {ITEM_FTS} WHERE rowid = OLD.id;
+        {_item_rows('i.id = NEW.id')}
+        {order('OLD.order_id')}
+        {order('NEW.order_id')}
+    END""",
+        f"""
+    CREATE TRIGGER calculator_orderitem_fts_ad AFTER DELETE ON calculator_orderitem BEGIN
+        DELETE FROM {ITEM_FTS} WHERE rowid = OLD.id;
+        {order('OLD.order_id')}
+    END""",
+        _reference_trigger('calculator_partname_fts_au', 'calculator_partname', 'part_name_id', rebuild_orders),
+        _reference_trigger('calculator_material_fts_au', 'calculator_material', 'material_id', rebuild_orders),
+    ]
+
+
+DROP_TRIGGERS = [
+    'DROP TRIGGER IF EXISTS calculator_orderitem_fts_ai',
+    'DROP TRIGGER IF EXISTS calculator_orderitem_fts_au',
+    'DROP TRIGGER IF EXISTS calculator_orderitem_fts_ad',
+    'DROP TRIGGER IF EXISTS calculator_partname_fts_au',
+    'DROP TRIGGER IF EXISTS calculator_material_fts_au',
+]
+
+FORWARD = DROP_TRIGGERS + [f'CREATE TABLE {DIRTY} (order_id INTEGER PRIMARY KEY)'] + _triggers(False)
+
+# Откат: отмеченные заказы пересобираются, затем возвращаются прежние триггеры
+BACKWARD = DROP_TRIGGERS + [
+    f'DELETE FROM {ORDER_FTS} WHERE rowid IN (SELECT order_id FROM {DIRTY})',
+    _order_rows(f'o.id IN (SELECT order_id FROM {DIRTY})').strip().rstrip(';'),
+    f'DROP TABLE {DIRTY}',
+] + _triggers(True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('calculator', '0028_reference_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(FORWARD, BACKWARD),
+    ]
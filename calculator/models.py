@@ -1,9 +1,19 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
+from django.db.models import Case, When, Value, F, Q, Sum, Count, FloatField
+from django.db.models.functions import Cast, Coalesce
+from .reference_cache import invalidate_reference_options
+from . import weights
+
+# Константы расчета сечений для SQL-аналитики и погонной массы сортамента;
+# точный расчет весов для страниц и отчетов — в weights.py
+PI = 3.14159
+HEX_AREA_FACTOR = 3 * 1.73205 / 2
 class Material(models.Model):
     """Справочник материалов"""
     name = models.CharField('Название материала', max_length=100)
@@ -52,6 +62,11 @@ class StockItem(models.Model):
     outer_diameter = models.DecimalField('Внешний диаметр (мм)', max_digits=8, decimal_places=2, null=True, blank=True)
     wall_thickness = models.DecimalField('Толщина стенки (мм)', max_digits=8, decimal_places=2, null=True, blank=True)
     
+    # Вычисляемые характеристики сечения (круг, шестигранник, труба);
+    # поддерживаются сигналами при изменении размеров и плотности материала
+    section_area = models.FloatField('Площадь сечения (мм²)', null=True, blank=True, editable=False)
+    linear_mass = models.FloatField('Погонная масса (г/мм)', null=True, blank=True, editable=False)
+    
     class Meta:
         verbose_name = 'Сортамент на складе'
         verbose_name_plural = 'Сортамент на складе'
@@ -65,6 +80,29 @@ class StockItem(models.Model):
             return f"{self.material} - Шестигранник S{self.key_size} мм"
         else:  # tube
             return f"{self.material} - Труба Ø{self.outer_diameter}x{self.wall_thickness} мм"
+    
+    def compute_section_area(self):
+        """Площадь сечения в мм² (для листа зависит от размеров детали — None)"""
+        if self.section_type == 'round':
+            d = float(self.diameter or 0)
+            return PI * (d/2)**2
+        elif self.section_type == 'hexagon':
+            a = float(self.key_size or 0)
+            return HEX_AREA_FACTOR * a**2
+        elif self.section_type == 'tube':
+            D = float(self.outer_diameter or 0)
+            s = float(self.wall_thickness or 0)
+            return PI * s * (D - s)
+        return None
+    
+    def update_section_properties(self):
+        """Пересчитывает площадь сечения и погонную массу"""
+        self.section_area = self.compute_section_area()
+        if self.section_area is None or not self.material_id:
+            self.linear_mass = None
+        else:
+            # мм² · г/см³ / 1000 = г/мм
+            self.linear_mass = self.section_area * float(self.material.density) / 1000
 
 class Order(models.Model):
     """Модель заказа"""
@@ -90,24 +128,52 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
+        indexes = [
+            # Фасеты списка заказов (facets.py)
+            models.Index(fields=['created_at'], name='order_created_idx'),
+            models.Index(fields=['coefficient', 'created_at'], name='order_coefficient_idx'),
+            models.Index(fields=['user', 'created_at'], name='order_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"Заказ №{self.order_number} - {self.order_name}"
     
+    @property
+    def total_weight_mg(self):
+        """Общий вес заказа в миллиграммах с учетом количества заказов"""
+        if 'items' in getattr(self, '_prefetched_objects_cache', {}):
+            total = sum(item.total_weight_mg for item in self.items.all())
+        else:
+            total = self.items.aggregate(total=Sum(weights.total_expression()))['total'] or 0
+        return total * self.order_quantity
+    
     @property
     def total_weight_g(self):
         """Общий вес заказа в граммах с учетом количества заказов"""
-        return sum(item.total_weight_g for item in self.items.all()) * self.order_quantity
+        return weights.mg_to_g(self.total_weight_mg)
     
     @property
     def total_weight(self):
         """Общий вес заказа в килограммах с учетом количества заказов"""
-        return self.total_weight_g / 1000
+        return weights.mg_to_kg(self.total_weight_mg)
     
     @property
     def total_items_count(self):
         """Общее количество деталей в заказе с учетом количества заказов"""
         return sum(item.quantity for item in self.items.all()) * self.order_quantity
+
+    def summary(self):
+        """Итоги заказа одним агрегирующим запросом: позиций, деталей, масса в мг"""
+        totals = self.items.aggregate(
+            items_count=Count('id'),
+            quantity=Sum('quantity'),
+            total_mg=Sum(weights.total_expression()),
+        )
+        return {
+            'items_count': totals['items_count'],
+            'total_items_count': (totals['quantity'] or 0) * self.order_quantity,
+            'total_weight_mg': (totals['total_mg'] or 0) * self.order_quantity,
+        }
     @property
     def materials_count(self):
         """Количество уникальных материалов в заказе"""
@@ -153,6 +219,33 @@ def save_user_profile(sender, instance, **kwargs):
         # Если профиля нет, создаем его
         Profile.objects.get_or_create(user=instance)
 
+def _as_float(name):
+    return Cast(name, FloatField())
+
+
+class OrderItemQuerySet(models.QuerySet):
+    def with_weights(self):
+        """Вес детали и общий вес в граммах, вычисленные в SQL (weight_g_db, total_weight_g_db)"""
+        length = _as_float('length')
+        volume = Case(
+            When(stock_item__section_type='sheet',
+                 then=length * _as_float('width') * _as_float('stock_item__width')),
+            When(stock_item__section_type='hexagon',
+                 then=Value(HEX_AREA_FACTOR) * _as_float('key_size') * _as_float('key_size') * length),
+            default=F('stock_item__section_area') * length,
+            output_field=FloatField(),
+        )
+        weight = Case(
+            When(Q(is_special=True) | Q(material__isnull=True) | Q(stock_item__isnull=True),
+                 then=Value(0.0)),
+            default=Coalesce(volume, Value(0.0)) * _as_float('material__density') / Value(1000.0),
+            output_field=FloatField(),
+        )
+        return self.annotate(weight_g_db=weight).annotate(
+            total_weight_g_db=F('weight_g_db') * F('quantity') * _as_float('order__coefficient'),
+        )
+
+
 class OrderItem(models.Model):
     """Детали заказа"""
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items', verbose_name='Заказ')
@@ -179,10 +272,23 @@ class OrderItem(models.Model):
     # Особая запись
     is_special = models.BooleanField('Особая запись', default=False)
     
+    # Вес одной детали в мг (weights.py); пересчитывается при сохранении детали
+    # и при изменении материала или сортамента
+    weight_mg = models.BigIntegerField('Вес детали (мг)', default=0, editable=False)
+    # Тип сортамента детали (копия stock_item.section_type) — для фасетов списка заказов
+    section_type = models.CharField('Тип сортамента', max_length=20, null=True, blank=True, editable=False)
+    
+    objects = OrderItemQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Деталь заказа'
         verbose_name_plural = 'Детали заказа'
         ordering = ['sequence_number']
+        indexes = [
+            # Счетчики заказов по материалу и типу сортамента только по индексу (facets.py)
+            models.Index(fields=['material', 'order'], name='orderitem_material_order_idx'),
+            models.Index(fields=['section_type', 'order'], name='orderitem_section_order_idx'),
+        ]
     
     def __str__(self):
         return f"{self.sequence_number}. {self.part_name} - {self.quantity} шт."
@@ -190,24 +296,8 @@ class OrderItem(models.Model):
     @property
     def volume(self):
         """Расчёт объёма детали в мм³"""
-        if self.is_special or not self.stock_item:
-            return 0
-        section_type = self.stock_item.section_type
-        
-        if section_type == 'sheet':
-            thickness = float(self.stock_item.width or 0)
-            return float(self.length or 0) * float(self.width or 0) * thickness
-        elif section_type == 'round':
-            d = float(self.stock_item.diameter or 0)
-            return 3.14159 * (d/2)**2 * float(self.length or 0)
-        elif section_type == 'hexagon':
-            a = float(self.key_size or 0)
-            return (3 * 1.73205 / 2) * a**2 * float(self.length or 0)
-        elif section_type == 'tube':
-            D = float(self.stock_item.outer_diameter or 0)
-            s = float(self.stock_item.wall_thickness or 0)
-            l = float(self.length or 0)
-            return 3.14159 * s * (D - s) * l
+        numerator, denominator = weights.item_volume(self)
+        return numerator / denominator / 10**9
     
     @property
     def volume_cm3(self):
@@ -217,26 +307,27 @@ class OrderItem(models.Model):
     @property
     def weight_g(self):
         """Вес одной детали в граммах"""
-        if self.is_special or not self.material:
-            return 0
-        return self.volume_cm3 * float(self.material.density)
+        return weights.mg_to_g(self.weight_mg)
     
     @property
     def weight(self):
         """Вес одной детали в килограммах"""
-        return self.weight_g / 1000
+        return weights.mg_to_kg(self.weight_mg)
+    
+    @property
+    def total_weight_mg(self):
+        """Общий вес с учётом количества и коэффициента в миллиграммах"""
+        return weights.total_mg(self.weight_mg, self.quantity, weights.coefficient_units(self.order.coefficient))
     
     @property
     def total_weight_g(self):
         """Общий вес с учётом количества и коэффициента в граммах"""
-        if self.is_special:
-            return 0
-        return self.weight_g * self.quantity * float(self.order.coefficient)
+        return weights.mg_to_g(self.total_weight_mg)
     
     @property
     def total_weight(self):
         """Общий вес с учётом количества и коэффициента в килограммах"""
-        return self.total_weight_g / 1000
+        return weights.mg_to_kg(self.total_weight_mg)
 
     @property
     def sort_key(self):
@@ -251,3 +342,749 @@ class OrderItem(models.Model):
         except (ValueError, TypeError):
             # Если не удалось преобразовать, возвращаем исходную строку
             return self.sequence_number
+
+
+class OrderItemTemplate(models.Model):
+    """Шаблон следующей детали заказа: значения по умолчанию для формы добавления.
+
+    Поддерживается сигналами при сохранении и удалении деталей, поэтому форма
+    открывается одним запросом без подсчета и поиска последней детали.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True,
+                                 related_name='item_template', verbose_name='Заказ')
+    items_count = models.PositiveIntegerField('Количество позиций', default=0)
+    last_item_id = models.BigIntegerField('ID последней детали', null=True, blank=True)
+    part_name = models.ForeignKey(PartName, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    material = models.ForeignKey(Material, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    stock_item = models.ForeignKey(StockItem, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    section_type = models.CharField('Тип сортамента', max_length=20, blank=True, null=True)
+    quantity = models.IntegerField('Количество деталей', null=True, blank=True)
+    is_special = models.BooleanField('Особая запись', default=False)
+    length = models.DecimalField('Длина (мм)', max_digits=8, decimal_places=2, null=True, blank=True)
+    width = models.DecimalField('Ширина (мм)', max_digits=8, decimal_places=2, null=True, blank=True)
+    height = models.DecimalField('Высота (мм)', max_digits=8, decimal_places=2, null=True, blank=True)
+    diameter = models.DecimalField('Диаметр (мм)', max_digits=8, decimal_places=2, null=True, blank=True)
+    key_size = models.DecimalField('Размер под ключ (мм)', max_digits=8, decimal_places=2, null=True, blank=True)
+
+    MEASUREMENT_FIELDS = ('length', 'width', 'height', 'diameter', 'key_size')
+    # Поля, заполняемые fill_from/clear (счетчик позиций меняется только через F())
+    FILLED_FIELDS = ('last_item_id', 'part_name', 'material', 'stock_item', 'section_type', 'quantity',
+                     'is_special') + MEASUREMENT_FIELDS
+
+    class Meta:
+        verbose_name = 'Шаблон следующей детали'
+        verbose_name_plural = 'Шаблоны следующих деталей'
+
+    def __str__(self):
+        return f"Шаблон детали №{self.next_sequence_number} для заказа {self.order_id}"
+
+    @property
+    def next_sequence_number(self):
+        """Номер, предлагаемый для следующей детали (по счетчику заказа)"""
+        return OrderSequence.peek(self.order)
+
+    def fill_from(self, item):
+        """Копирует параметры детали в шаблон"""
+        self.last_item_id = item.pk
+        self.part_name_id = item.part_name_id
+        self.material_id = item.material_id
+        self.stock_item_id = item.stock_item_id
+        self.section_type = item.stock_item.section_type if item.stock_item_id else None
+        self.quantity = item.quantity
+        self.is_special = item.is_special
+        for field in self.MEASUREMENT_FIELDS:
+            setattr(self, field, getattr(item, field))
+
+    def clear(self):
+        """Сбрасывает параметры (в заказе не осталось деталей)"""
+        self.last_item_id = None
+        self.part_name_id = self.material_id = self.stock_item_id = None
+        self.section_type = None
+        self.quantity = None
+        self.is_special = False
+        for field in self.MEASUREMENT_FIELDS:
+            setattr(self, field, None)
+
+    def initial_data(self):
+        """Начальные значения формы добавления детали"""
+        initial = {'sequence_number': str(self.next_sequence_number)}
+        if self.last_item_id is None:
+            return initial
+        if self.part_name_id:
+            initial['part_name'] = self.part_name_id
+        if self.material_id:
+            initial['material'] = self.material_id
+        if self.quantity:
+            initial['quantity'] = self.quantity
+        if self.stock_item_id:
+            initial['stock_item'] = self.stock_item_id
+        initial['is_special'] = self.is_special
+        for field in self.MEASUREMENT_FIELDS:
+            value = getattr(self, field)
+            if value:
+                initial[field] = float(value)
+        return initial
+
+    def last_measurements(self):
+        """Замеры последней детали для подстановки в поля формы"""
+        return {
+            field: str(getattr(self, field))
+            for field in self.MEASUREMENT_FIELDS
+            if getattr(self, field)
+        }
+
+    def refill_from_last_item(self):
+        last_item = (OrderItem.objects.filter(order_id=self.order_id)
+                     .select_related('stock_item').order_by('-id').first())
+        if last_item:
+            self.fill_from(last_item)
+        else:
+            self.clear()
+
+    @classmethod
+    def rebuild(cls, order):
+        """Пересчитывает шаблон заказа по его деталям"""
+        template = cls(order=order, items_count=OrderItem.objects.filter(order=order).count())
+        template.refill_from_last_item()
+        try:
+            with transaction.atomic():
+                template.save()
+        except IntegrityError:
+            # Шаблон уже создан параллельным запросом
+            template = cls.objects.get(order=order)
+        return template
+
+    @classmethod
+    def refresh(cls, order_id):
+        """Пересчитывает существующий шаблон после вставки деталей без сигналов (bulk_create)"""
+        template = cls.objects.filter(order_id=order_id).first()
+        if template is None:
+            return
+        template.items_count = OrderItem.objects.filter(order_id=order_id).count()
+        template.refill_from_last_item()
+        template.save()
+
+    @classmethod
+    def for_order(cls, order):
+        """Шаблон заказа (загруженный через select_related или построенный заново)"""
+        try:
+            return order.item_template
+        except cls.DoesNotExist:
+            return cls.rebuild(order)
+
+
+def sequence_prefix(sequence_number):
+    """Числовая часть номера детали («15-02» → 15) или None"""
+    prefix = (sequence_number or '').split('-')[0].strip()
+    return int(prefix) if prefix.isdigit() else None
+
+
+class OrderSequence(models.Model):
+    """Счетчик порядковых номеров деталей заказа
+
+    Номера выдаются одним UPDATE last_number = last_number + n внутри
+    транзакции: строка счетчика остается заблокированной до фиксации, поэтому
+    параллельные запросы получают разные номера, а номера удаленных деталей
+    повторно не выдаются. Номер, введенный вручную, сдвигает счетчик вперед.
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True,
+                                 related_name='sequence', verbose_name='Заказ')
+    last_number = models.PositiveIntegerField('Последний выданный номер', default=0)
+
+    class Meta:
+        verbose_name = 'Счетчик номеров деталей'
+        verbose_name_plural = 'Счетчики номеров деталей'
+
+    def __str__(self):
+        return f"Заказ {self.order_id}: выдан №{self.last_number}"
+
+    @staticmethod
+    def max_number(order_id):
+        numbers = OrderItem.objects.filter(order_id=order_id).values_list('sequence_number', flat=True)
+        return max((sequence_prefix(number) or 0 for number in numbers), default=0)
+
+    @classmethod
+    def for_order(cls, order):
+        """Счетчик заказа; для заказа без счетчика начальное значение — наибольший номер детали"""
+        try:
+            return order.sequence
+        except cls.DoesNotExist:
+            sequence, _ = cls.objects.get_or_create(
+                order_id=order.pk, defaults={'last_number': lambda: cls.max_number(order.pk)},
+            )
+            return sequence
+
+    @classmethod
+    def peek(cls, order, fresh=False):
+        """Номер, предлагаемый для следующей детали (без резервирования)"""
+        if fresh:
+            last_number = cls.objects.filter(order_id=order.pk).values_list('last_number', flat=True).first()
+            if last_number is not None:
+                return last_number + 1
+        return cls.for_order(order).last_number + 1
+
+    @classmethod
+    def allocate(cls, order, count=1):
+        """Резервирует count номеров подряд одним UPDATE; возвращает range номеров"""
+        with transaction.atomic():
+            if not cls.objects.filter(order_id=order.pk).update(last_number=F('last_number') + count):
+                cls.for_order(order)
+                cls.objects.filter(order_id=order.pk).update(last_number=F('last_number') + count)
+            last_number = cls.objects.filter(order_id=order.pk).values_list('last_number', flat=True).get()
+        return range(last_number - count + 1, last_number + 1)
+
+    @classmethod
+    def advance_to(cls, order_id, number):
+        """Сдвигает счетчик до номера, занятого вручную (уменьшения не бывает)"""
+        cls.objects.filter(order_id=order_id, last_number__lt=number).update(last_number=number)
+
+
+class OrderSnapshot(models.Model):
+    """Снимок заказа, выпущенного в производство
+
+    Хранит рассчитанные при выпуске объемы и массы деталей, итоги по группам
+    материал/сортамент и готовый HTML строк таблицы и печатных форм. Карточка и
+    отчеты выпущенного заказа отдаются из снимка без пересчета, поэтому
+    последующие изменения плотностей, сортамента и справочников на них не влияют.
+    Пока снимок существует, заказ и его детали не изменяются (views.editable_order).
+    """
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True,
+                                 related_name='snapshot', verbose_name='Заказ')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                             verbose_name='Выпустил')
+    created_at = models.DateTimeField('Выпущен в производство', auto_now_add=True)
+    items_count = models.PositiveIntegerField('Количество позиций', default=0)
+    total_items_count = models.PositiveIntegerField('Количество деталей', default=0)
+    total_weight_mg = models.BigIntegerField('Общий вес (мг)', default=0)
+    # [{id, sequence_number, sort_key, part_name, material, quantity, volume_mm3, weight_mg, total_weight_mg, html}]
+    items = models.JSONField('Детали', default=list)
+    # [{material, stock_item, quantity, total_weight_mg}] — итоги группированного отчета
+    groups = models.JSONField('Группы', default=list)
+    # {'report': ..., 'grouped': ..., 'cutting': ...} — HTML печатных форм
+    reports = models.JSONField('Печатные формы', default=dict)
+
+    class Meta:
+        verbose_name = 'Снимок заказа'
+        verbose_name_plural = 'Снимки заказов'
+
+    def __str__(self):
+        return f"Заказ {self.order_id}: выпущен {self.created_at:%d.%m.%Y}"
+
+    @property
+    def total_weight(self):
+        return weights.mg_to_kg(self.total_weight_mg)
+
+    @classmethod
+    def freeze(cls, order, items, rows, groups, reports, user=None):
+        """Сохраняет снимок заказа; items — детали, rows — HTML строк по id детали"""
+        entries = [{
+            'id': item.id,
+            'sequence_number': item.sequence_number,
+            'sort_key': item.sort_key,
+            'part_name': item.part_name.name,
+            'material': item.material.name if item.material else '',
+            'quantity': item.quantity,
+            'volume_mm3': item.volume,
+            'weight_mg': item.weight_mg,
+            'total_weight_mg': item.total_weight_mg,
+            'html': rows[item.id],
+        } for item in items]
+        return cls.objects.create(
+            order=order,
+            user=user,
+            items_count=len(entries),
+            total_items_count=sum(item.quantity for item in items) * order.order_quantity,
+            total_weight_mg=sum(entry['total_weight_mg'] for entry in entries) * order.order_quantity,
+            items=entries,
+            groups=groups,
+            reports=reports,
+        )
+
+
+class OrderHistory(models.Model):
+    """Последнее записанное в журнал состояние заказа (history.py)"""
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, primary_key=True,
+                                 related_name='history', verbose_name='Заказ')
+    last_number = models.PositiveIntegerField('Номер последней редакции', default=0)
+    state = models.JSONField('Состояние', default=dict)
+
+    class Meta:
+        verbose_name = 'История заказа'
+        verbose_name_plural = 'История заказов'
+
+
+class OrderRevision(models.Model):
+    """Редакция заказа: изменения отслеживаемых полей заказа и деталей (только добавление)
+
+    changes — {'order': {поле: значение}, 'added': {id: {поле: значение}},
+    'changed': {id: {поле: значение}}, 'removed': [id]} (пустые ключи опускаются):
+    у новой детали — все поля, у измененной — только изменившиеся.
+    state — полное состояние на этой редакции, хранится у каждой
+    history.CHECKPOINT_EVERY-й редакции для быстрого восстановления.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='revisions', verbose_name='Заказ')
+    number = models.PositiveIntegerField('Номер редакции')
+    created_at = models.DateTimeField('Дата', auto_now_add=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                             verbose_name='Пользователь')
+    changes = models.JSONField('Изменения', default=dict)
+    state = models.JSONField('Полное состояние', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Редакция заказа'
+        verbose_name_plural = 'Редакции заказов'
+        ordering = ['order', 'number']
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'number'], name='unique_order_revision'),
+        ]
+
+    def __str__(self):
+        return f"Заказ {self.order_id}: редакция {self.number}"
+
+
+class ChangeLog(models.Model):
+    """Журнал изменений для внешних систем (changefeed.py): что изменилось, без значений
+
+    Записи добавляются триггерами базы; id монотонно растет и служит курсором.
+    """
+    kind = models.CharField('Тип объекта', max_length=10)
+    object_id = models.BigIntegerField('id объекта')
+    deleted = models.BooleanField('Удален', default=False)
+    created_at = models.DateTimeField('Дата')
+
+    class Meta:
+        verbose_name = 'Запись журнала изменений'
+        verbose_name_plural = 'Журнал изменений'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.id}: {self.kind} {self.object_id}{' (удален)' if self.deleted else ''}"
+
+
+class WebhookEvent(models.Model):
+    """Исходящее уведомление внешней системе (MES): очередь доставки webhooks.py
+
+    order_id хранится без внешнего ключа — событие переживает удаление и
+    архивирование заказа.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Ожидает отправки'),
+        ('delivered', 'Доставлено'),
+        ('failed', 'Не доставлено'),
+    ]
+
+    event = models.CharField('Событие', max_length=50)
+    order_id = models.BigIntegerField('id заказа', null=True, blank=True)
+    payload = models.JSONField('Данные', default=dict)
+    status = models.CharField('Состояние', max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField('Попыток отправки', default=0)
+    next_attempt_at = models.DateTimeField('Следующая попытка', null=True, blank=True)
+    last_error = models.TextField('Последняя ошибка', blank=True)
+    created_at = models.DateTimeField('Дата', auto_now_add=True)
+    delivered_at = models.DateTimeField('Доставлено', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Исходящее уведомление'
+        verbose_name_plural = 'Исходящие уведомления'
+        ordering = ['id']
+        indexes = [
+            # Выборка готовых к отправке событий читает только ожидающие
+            models.Index(fields=['next_attempt_at'], condition=Q(status='pending'), name='webhookevent_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event} #{self.id} ({self.get_status_display()})"
+
+    def as_message(self):
+        """Событие в теле запроса к внешней системе"""
+        return {'id': self.id, 'event': self.event, 'order_id': self.order_id,
+                'created_at': self.created_at, 'data': self.payload}
+
+
+class Job(models.Model):
+    """Фоновая задача: очередь в базе, выполняет команда run_jobs (jobs.py)"""
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнена'),
+        ('failed', 'Ошибка'),
+        ('cancelled', 'Отменена'),
+    ]
+    FINISHED = ('done', 'failed', 'cancelled')
+
+    name = models.CharField('Задача', max_length=50)
+    params = models.JSONField('Параметры', default=dict)
+    status = models.CharField('Состояние', max_length=10, choices=STATUS_CHOICES, default='queued')
+    cancel_requested = models.BooleanField('Запрошена отмена', default=False)
+    progress = models.PositiveIntegerField('Выполнено', default=0)
+    total = models.PositiveIntegerField('Всего', default=0)
+    message = models.CharField('Сообщение', max_length=200, blank=True)
+    result = models.JSONField('Результат', null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                             verbose_name='Пользователь')
+    created_at = models.DateTimeField('Создана', auto_now_add=True)
+    started_at = models.DateTimeField('Начата', null=True, blank=True)
+    finished_at = models.DateTimeField('Завершена', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['id'], condition=Q(status='queued'), name='job_queued_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.get_status_display()})"
+
+    @property
+    def finished(self):
+        return self.status in self.FINISHED
+
+    @property
+    def percent(self):
+        if self.status == 'done':
+            return 100
+        return min(100, self.progress * 100 // self.total) if self.total else 0
+
+
+
+class StockBalance(models.Model):
+    """Остаток сортамента на складе: длина в мкм и масса в мг.
+
+    Поддерживается движениями склада (inventory.py) в той же транзакции,
+    поэтому проверка наличия не требует суммирования журнала.
+    """
+    stock_item = models.OneToOneField(StockItem, on_delete=models.CASCADE, primary_key=True,
+                                      related_name='balance', verbose_name='Сортамент')
+    on_hand_length_um = models.BigIntegerField('Длина на складе (мкм)', default=0)
+    on_hand_mg = models.BigIntegerField('Масса на складе (мг)', default=0)
+    reserved_length_um = models.BigIntegerField('Зарезервировано (мкм)', default=0)
+    reserved_mg = models.BigIntegerField('Зарезервировано (мг)', default=0)
+    available_length_um = models.BigIntegerField('Свободно (мкм)', default=0, db_index=True)
+    available_mg = models.BigIntegerField('Свободно (мг)', default=0, db_index=True)
+    updated_at = models.DateTimeField('Изменено', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Остаток сортамента'
+        verbose_name_plural = 'Остатки сортамента'
+
+    def __str__(self):
+        return f"{self.stock_item}: свободно {self.available_length_m} м"
+
+    @property
+    def on_hand_length_m(self):
+        return weights.um_to_mm(self.on_hand_length_um) / 1000
+
+    @property
+    def available_length_m(self):
+        return weights.um_to_mm(self.available_length_um) / 1000
+
+    @property
+    def reserved_length_m(self):
+        return weights.um_to_mm(self.reserved_length_um) / 1000
+
+    @property
+    def on_hand_kg(self):
+        return weights.mg_to_kg(self.on_hand_mg)
+
+    @property
+    def available_kg(self):
+        return weights.mg_to_kg(self.available_mg)
+
+    @property
+    def reserved_kg(self):
+        return weights.mg_to_kg(self.reserved_mg)
+
+
+class StockMovement(models.Model):
+    """Журнал движения сортамента (только добавление записей)"""
+    KIND_CHOICES = [
+        ('receipt', 'Поступление'),
+        ('reservation', 'Резервирование'),
+        ('release', 'Снятие резерва'),
+        ('consumption', 'Списание в производство'),
+    ]
+
+    stock_item = models.ForeignKey(StockItem, on_delete=models.CASCADE, related_name='movements',
+                                   verbose_name='Сортамент')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='stock_movements', verbose_name='Заказ')
+    kind = models.CharField('Вид движения', max_length=20, choices=KIND_CHOICES)
+    length_um = models.BigIntegerField('Длина (мкм)', default=0)
+    mass_mg = models.BigIntegerField('Масса (мг)', default=0)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Пользователь')
+    comment = models.CharField('Комментарий', max_length=200, blank=True)
+    created_at = models.DateTimeField('Дата', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Движение сортамента'
+        verbose_name_plural = 'Движение сортамента'
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['stock_item', 'created_at']),
+            models.Index(fields=['order', 'kind']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.stock_item} ({self.length_mm} мм)"
+
+    @property
+    def length_mm(self):
+        return weights.um_to_mm(self.length_um)
+
+    @property
+    def mass_kg(self):
+        return weights.mg_to_kg(self.mass_mg)
+
+
+class StockReservation(models.Model):
+    """Текущий резерв сортамента под заказ (история — в StockMovement)"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='stock_reservations',
+                              verbose_name='Заказ')
+    stock_item = models.ForeignKey(StockItem, on_delete=models.CASCADE, related_name='reservations',
+                                   verbose_name='Сортамент')
+    length_um = models.BigIntegerField('Длина (мкм)', default=0)
+    mass_mg = models.BigIntegerField('Масса (мг)', default=0)
+
+    class Meta:
+        verbose_name = 'Резерв сортамента'
+        verbose_name_plural = 'Резервы сортамента'
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'stock_item'], name='unique_stock_reservation'),
+        ]
+
+    def __str__(self):
+        return f"Резерв {self.stock_item} под заказ {self.order_id}"
+
+
+class StockRemnant(models.Model):
+    """Деловой остаток: обрезок прутка или трубы, кусок листа.
+
+    Для листа length_um — большая сторона, width_um — меньшая; для прутка
+    и трубы width_um = 0. Свободные остатки ищутся по частичному индексу
+    (сортамент, длина, ширина) — см. remnants.py.
+    """
+    STATUS_CHOICES = [
+        ('available', 'На складе'),
+        ('used', 'Использован'),
+        ('scrapped', 'Списан в лом'),
+    ]
+
+    stock_item = models.ForeignKey(StockItem, on_delete=models.CASCADE, related_name='remnants',
+                                   verbose_name='Сортамент')
+    length_um = models.BigIntegerField('Длина (мкм)')
+    width_um = models.BigIntegerField('Ширина (мкм)', default=0)
+    status = models.CharField('Состояние', max_length=10, choices=STATUS_CHOICES, default='available')
+    parent = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True,
+                               related_name='pieces', verbose_name='Исходный остаток')
+    source_order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True,
+                                     related_name='produced_remnants', verbose_name='Получен из заказа')
+    used_order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True,
+                                   related_name='used_remnants', verbose_name='Использован в заказе')
+    comment = models.CharField('Комментарий', max_length=200, blank=True)
+    created_at = models.DateTimeField('Дата', auto_now_add=True)
+    updated_at = models.DateTimeField('Изменено', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Деловой остаток'
+        verbose_name_plural = 'Деловые остатки'
+        ordering = ['stock_item', 'length_um', 'width_um']
+        indexes = [
+            models.Index(fields=['stock_item', 'length_um', 'width_um'],
+                         condition=Q(status='available'), name='remnant_available_size_idx'),
+        ]
+
+    def __str__(self):
+        return f"Остаток №{self.pk}: {self.stock_item}, {self.size_label}"
+
+    def save(self, *args, **kwargs):
+        if self.width_um > self.length_um:
+            self.length_um, self.width_um = self.width_um, self.length_um
+        super().save(*args, **kwargs)
+
+    @property
+    def length_mm(self):
+        return weights.um_to_mm(self.length_um)
+
+    @property
+    def width_mm(self):
+        return weights.um_to_mm(self.width_um)
+
+    @property
+    def size_label(self):
+        if self.width_um:
+            return f"{self.length_mm.normalize():f}x{self.width_mm.normalize():f} мм"
+        return f"L={self.length_mm.normalize():f} мм"
+
+
+class CuttingRoute(models.Model):
+    """Правило распределения деталей по разделам задания на заготовку.
+
+    Правила проверяются по возрастанию приоритета, применяется первое
+    подходящее; деталь без подходящего правила в задание не входит.
+    Скомпилированная таблица правил — в cutting.py.
+    """
+    TARGET_CHOICES = [
+        ('sheet', 'Листовой материал'),
+        ('round', 'Круг / лист (специальные материалы)'),
+        ('tube', 'Труба'),
+        ('skip', 'Не включать в задание'),
+    ]
+
+    priority = models.PositiveIntegerField('Приоритет', default=100)
+    material_pattern = models.CharField(
+        'Материал содержит', max_length=100, blank=True,
+        help_text='Без учета регистра; пусто — любой материал',
+    )
+    section_type = models.CharField('Тип сортамента', max_length=20, choices=StockItem.SECTION_TYPE_CHOICES,
+                                    blank=True, help_text='Пусто — любой')
+    min_diameter = models.DecimalField('Диаметр детали больше (мм)', max_digits=8, decimal_places=2,
+                                       null=True, blank=True)
+    max_diameter = models.DecimalField('Диаметр детали не больше (мм)', max_digits=8, decimal_places=2,
+                                       null=True, blank=True)
+    target_section = models.CharField('Раздел задания', max_length=10, choices=TARGET_CHOICES)
+    is_active = models.BooleanField('Действует', default=True)
+
+    class Meta:
+        verbose_name = 'Правило задания на заготовку'
+        verbose_name_plural = 'Правила задания на заготовку'
+        ordering = ['priority', 'id']
+
+    def __str__(self):
+        conditions = [self.get_section_type_display() if self.section_type else 'любой сортамент']
+        if self.material_pattern:
+            conditions.append(f"материал «{self.material_pattern}»")
+        if self.min_diameter is not None:
+            conditions.append(f"Ø > {self.min_diameter}")
+        if self.max_diameter is not None:
+            conditions.append(f"Ø ≤ {self.max_diameter}")
+        return f"{', '.join(conditions)} → {self.get_target_section_display()}"
+
+
+class ReferenceVersion(models.Model):
+    """Версия справочников (одна строка): общая для всех процессов, в отличие от кэша в памяти
+
+    Меняется на новое значение при каждом изменении справочников в той же
+    транзакции; кэши справочников процесса (reference_cache.py) сверяются с ней.
+    """
+    version = models.PositiveBigIntegerField('Версия', default=1)
+
+    class Meta:
+        verbose_name = 'Версия справочников'
+        verbose_name_plural = 'Версия справочников'
+
+    def __str__(self):
+        return f"Справочники: версия {self.version}"
+
+
+@receiver(post_save, sender=OrderItem)
+def advance_order_sequence(sender, instance, created, raw=False, **kwargs):
+    """Номер новой детали, введенный вручную, больше не выдается счетчиком"""
+    if raw or not created:
+        return
+    number = sequence_prefix(instance.sequence_number)
+    if number:
+        OrderSequence.advance_to(instance.order_id, number)
+
+
+@receiver(post_save, sender=OrderItem)
+def update_order_item_template(sender, instance, created, raw=False, **kwargs):
+    """Обновляет шаблон следующей детали при сохранении детали заказа"""
+    if raw:
+        return
+    templates = OrderItemTemplate.objects.filter(order_id=instance.order_id)
+    template = templates.first()
+    if template is None:
+        # Шаблон будет построен при первом открытии формы
+        return
+    if created:
+        # Счетчик меняется в базе: параллельные добавления не теряют друг друга
+        templates.update(items_count=F('items_count') + 1)
+    if template.last_item_id is None or instance.pk >= template.last_item_id:
+        template.fill_from(instance)
+        template.save(update_fields=OrderItemTemplate.FILLED_FIELDS)
+
+
+@receiver(post_delete, sender=OrderItem)
+def update_order_item_template_on_delete(sender, instance, origin=None, **kwargs):
+    """Обновляет шаблон следующей детали при удалении детали заказа"""
+    if isinstance(origin, Order):
+        # Удаляется весь заказ вместе с шаблоном
+        return
+    templates = OrderItemTemplate.objects.filter(order_id=instance.order_id)
+    template = templates.first()
+    if template is None:
+        return
+    templates.filter(items_count__gt=0).update(items_count=F('items_count') - 1)
+    if instance.pk == template.last_item_id:
+        template.refill_from_last_item()
+        template.save(update_fields=OrderItemTemplate.FILLED_FIELDS)
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+@receiver(post_save, sender=StockItem)
+@receiver(post_delete, sender=StockItem)
+@receiver(post_save, sender=CuttingRoute)
+@receiver(post_delete, sender=CuttingRoute)
+def invalidate_reference_cache(sender, **kwargs):
+    """Сбрасывает кэш справочников (форма детали, подбор сортамента, правила заготовки)"""
+    invalidate_reference_options()
+
+
+@receiver(pre_save, sender=StockItem)
+def update_stock_item_section(sender, instance, raw=False, **kwargs):
+    """Пересчитывает площадь сечения и погонную массу перед сохранением сортамента"""
+    if not raw:
+        instance.update_section_properties()
+
+
+@receiver(post_save, sender=Material)
+def update_stock_linear_mass(sender, instance, raw=False, **kwargs):
+    """Пересчитывает погонную массу сортамента при изменении плотности материала"""
+    if raw:
+        return
+    StockItem.objects.filter(material=instance, section_area__isnull=False).update(
+        linear_mass=F('section_area') * float(instance.density) / 1000
+    )
+
+
+@receiver(pre_save, sender=OrderItem)
+def update_order_item_weight(sender, instance, raw=False, **kwargs):
+    """Пересчитывает сохраненный вес и тип сортамента детали перед сохранением"""
+    if not raw:
+        instance.weight_mg = weights.item_weight_mg(instance)
+        instance.section_type = instance.stock_item.section_type if instance.stock_item_id else None
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_save, sender=StockItem)
+def refresh_order_item_weights(sender, instance, created, raw=False, **kwargs):
+    """Пересчитывает вес (и тип сортамента) деталей при изменении материала или сортамента"""
+    if raw or created:
+        return
+    if sender is Material:
+        items = OrderItem.objects.filter(material=instance)
+        params = {'material_id': instance.pk}
+    else:
+        items = OrderItem.objects.filter(stock_item=instance)
+        items.exclude(section_type=instance.section_type).update(section_type=instance.section_type)
+        params = {'stock_item_id': instance.pk}
+    if items.count() > settings.JOB_INLINE_ITEMS:
+        # Много деталей — пересчет в фоновой задаче, форма сохраняется сразу (instance.job — для ссылки)
+        from . import jobs
+        instance.job = jobs.submit('refresh_weights', **params)
+        return
+    weights.refresh_weights(items)
+
+
+@receiver(post_delete, sender=StockReservation)
+def release_deleted_reservation(sender, instance, **kwargs):
+    """Возвращает в свободный остаток резерв удаленного заказа"""
+    StockBalance.objects.filter(stock_item_id=instance.stock_item_id).update(
+        reserved_length_um=F('reserved_length_um') - instance.length_um,
+        reserved_mg=F('reserved_mg') - instance.mass_mg,
+        available_length_um=F('available_length_um') + instance.length_um,
+        available_mg=F('available_mg') + instance.mass_mg,
+    )
@@ -0,0 +1,95 @@
+"""Кэш справочников для форм деталей заказа
+
+Списки материалов и сортамента строятся одним запросом на каждый справочник и
+хранятся в кэше до изменения справочника. Формы больше не выполняют запрос на
+каждую позицию сортамента.
+
+Кэш (LocMemCache) и таблицы, построенные из справочников (stock_index.py,
+cutting.py), у каждого процесса свои, поэтому версия справочников хранится в
+базе (ReferenceVersion): сигналы в models.py меняют ее в транзакции
+изменения, а процесс перечитывает ее в начале каждого запроса, вне запросов
+(команды, фоновые обработчики) — если с прошлой проверки прошло CHECK_INTERVAL
+секунд.
+Изменение справочника в одном процессе видно остальным со следующего запроса.
+"""
+import secrets
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.dispatch import receiver
+
+CHECK_INTERVAL = 1.0
+
+# Прочитанная версия — своя у каждого потока (запроса)
+_state = threading.local()
+
+
+@receiver(request_started)
+def _recheck_on_request(**kwargs):
+    _state.version = None
+
+
+def _version():
+    from .models import ReferenceVersion
+
+    now = time.monotonic()
+    version = getattr(_state, 'version', None)
+    if version is None or now - _state.checked_at >= CHECK_INTERVAL:
+        version = ReferenceVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+        _state.version, _state.checked_at = version, now
+    return version
+
+
+def get_reference_version():
+    """Текущая версия справочников (меняется при каждом их изменении)"""
+    return _version()
+
+
+def invalidate_reference_options():
+    """Сбрасывает кэш справочников во всех процессах (вызывается при изменении справочников)"""
+    from .models import ReferenceVersion
+
+    # Не счетчик, а новое случайное значение: версия из отмененной транзакции (по ней процесс
+    # мог уже построить таблицы) не совпадет с версией следующего изменения
+    version = secrets.randbits(62) + 1
+    if not ReferenceVersion.objects.filter(pk=1).update(version=version):
+        ReferenceVersion.objects.get_or_create(pk=1, defaults={'version': version})
+    _state.version = None
+
+
+def get_reference_options():
+    """Материалы и сортамент в виде словарей, пригодных для шаблонов"""
+    from .models import Material, StockItem
+
+    key = f'calculator:reference:options:{_version()}'
+    options = cache.get(key)
+    if options is not None:
+        return options
+
+    materials = [
+        {'id': m['id'], 'name': m['name'], 'density': m['density']}
+        for m in Material.objects.order_by('name').values('id', 'name', 'density')
+    ]
+    stock_items = [
+        {
+            'id': s['id'],
+            'section_type': s['section_type'],
+            'material': {'id': s['material_id'], 'name': s['material__name']},
+            'width': s['width'],
+            'diameter': s['diameter'],
+            'key_size': s['key_size'],
+            'outer_diameter': s['outer_diameter'],
+            'wall_thickness': s['wall_thickness'],
+        }
+        for s in StockItem.objects.order_by(
+            'material__name', 'section_type', 'width', 'diameter', 'key_size'
+        ).values(
+            'id', 'section_type', 'material_id', 'material__name',
+            'width', 'diameter', 'key_size', 'outer_diameter', 'wall_thickness',
+        )
+    ]
+    options = {'materials': materials, 'stock_items': stock_items}
+    cache.set(key, options, None)
+    return options
@@ -0,0 +1,186 @@
+"""Деловые остатки: подбор остатка под заготовку до расхода нового сортамента
+
+Свободные остатки одного сортамента держатся в списке, отсортированном по
+длине (для листа — по большей стороне). Под заготовку берется наименьший
+подходящий остаток: для прутка и трубы — двоичный поиск по длине, для листа —
+поиск по большей стороне и проверка меньшей с выбором наименьшей площади.
+От использованного остатка отрезается заготовка; оставшийся кусок не меньше
+REMNANT_MIN_SIZE_MM снова попадает в список (лист режется гильотинно на две
+полосы). Размеры — в мкм, как в weights.py.
+"""
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, ExpressionWrapper, F
+
+from . import weights
+from .models import OrderItem, StockRemnant
+
+
+def normalize(length_um, width_um=0):
+    """Стороны прямоугольника: (большая, меньшая)"""
+    return (length_um, width_um) if length_um >= width_um else (width_um, length_um)
+
+
+def cut_allowance_um():
+    return weights.to_um(settings.REMNANT_CUT_ALLOWANCE_MM)
+
+
+def min_size_um():
+    return weights.to_um(settings.REMNANT_MIN_SIZE_MM)
+
+
+def find_remnants(stock_item, length, width=None, limit=5):
+    """Наименьшие свободные остатки, из которых выходит заготовка (размеры в мм)
+
+    Запрос идет по частичному индексу (сортамент, длина, ширина) свободных остатков.
+    """
+    length_um, width_um = normalize(weights.to_um(length), weights.to_um(width or 0))
+    remnants = StockRemnant.objects.filter(
+        stock_item=stock_item, status='available', length_um__gte=length_um, width_um__gte=width_um,
+    )
+    if stock_item.section_type == 'sheet':
+        area = ExpressionWrapper(F('length_um') * F('width_um'), output_field=BigIntegerField())
+        remnants = remnants.annotate(area_um2=area).order_by('area_um2', 'id')
+    else:
+        remnants = remnants.order_by('length_um', 'id')
+    return list(remnants[:limit])
+
+
+class RemnantPool:
+    """Свободные куски одного сортамента, отсортированные по (длина, ширина)
+
+    Кусок — кортеж (длина, ширина, порядковый номер, id исходного остатка).
+    """
+
+    def __init__(self, cut_allowance, min_size):
+        self.pieces = []
+        self.cut_allowance = cut_allowance
+        self.min_size = min_size
+        self._counter = 0
+
+    def add(self, remnant_id, length_um, width_um=0):
+        length_um, width_um = normalize(length_um, width_um)
+        if length_um < self.min_size or (width_um and width_um < self.min_size):
+            return
+        self._counter += 1
+        insort(self.pieces, (length_um, width_um, self._counter, remnant_id))
+
+    def take(self, length_um, width_um=0):
+        """Вырезает заготовку из наименьшего подходящего куска; id исходного остатка или None"""
+        length_um, width_um = normalize(length_um, width_um)
+        position = bisect_left(self.pieces, (length_um,))
+        if position == len(self.pieces):
+            return None
+        if not width_um:
+            best = position
+        else:
+            best = None
+            for index in range(position, len(self.pieces)):
+                piece = self.pieces[index]
+                if piece[1] >= width_um and (
+                    best is None or piece[0] * piece[1] < self.pieces[best][0] * self.pieces[best][1]
+                ):
+                    best = index
+            if best is None:
+                return None
+        piece_length, piece_width, _, remnant_id = self.pieces.pop(best)
+        if not width_um:
+            self.add(remnant_id, piece_length - length_um - self.cut_allowance)
+        else:
+            # Гильотинный рез: полоса по длине на всю ширину и остаток полосы заготовки
+            self.add(remnant_id, piece_length - length_um - self.cut_allowance, piece_width)
+            self.add(remnant_id, length_um, piece_width - width_um - self.cut_allowance)
+        return remnant_id
+
+    def leftovers(self, used):
+        """Куски, отрезанные от использованных остатков (станут новыми остатками)"""
+        return [(length, width, remnant_id) for length, width, _, remnant_id in self.pieces
+                if remnant_id in used]
+
+
+def blank_size(item):
+    """Размер заготовки детали в мкм: лист — длина × ширина, пруток и труба — длина"""
+    if item['stock_item__section_type'] == 'sheet':
+        return weights.to_um(item['length']), weights.to_um(item['width'])
+    return weights.to_um(item['length']), 0
+
+
+def plan_order(order):
+    """Раскладка заготовок заказа по свободным остаткам (без записи в базу)
+
+    Возвращает словарь:
+      assignments — {id детали: {id остатка: штук}},
+      covered — {id сортамента: (мкм, мг)} заготовок, закрытых остатками,
+      used — id использованных остатков,
+      leftovers — [(id сортамента, id исходного остатка, длина, ширина)] новых кусков.
+    """
+    items = list(
+        OrderItem.objects.filter(order=order, is_special=False, stock_item__isnull=False)
+        .values('id', 'stock_item_id', 'stock_item__section_type', 'length', 'width', 'quantity', 'weight_mg')
+    )
+    plan = {'assignments': {}, 'covered': {}, 'used': set(), 'leftovers': []}
+    stock_ids = {item['stock_item_id'] for item in items}
+    if not stock_ids:
+        return plan
+
+    pools = {}
+    cut_allowance, min_size = cut_allowance_um(), min_size_um()
+    for remnant_id, stock_item_id, length_um, width_um in (
+        StockRemnant.objects.filter(status='available', stock_item_id__in=stock_ids)
+        .values_list('id', 'stock_item_id', 'length_um', 'width_um')
+    ):
+        pool = pools.setdefault(stock_item_id, RemnantPool(cut_allowance, min_size))
+        pool.add(remnant_id, length_um, width_um)
+    if not pools:
+        return plan
+
+    coefficient = weights.coefficient_units(order.coefficient)
+    # Крупные заготовки раскладываются первыми — мелкие потом добирают обрезки
+    items.sort(key=lambda item: normalize(*blank_size(item)), reverse=True)
+    for item in items:
+        pool = pools.get(item['stock_item_id'])
+        if pool is None:
+            continue
+        length_um, width_um = blank_size(item)
+        taken = {}
+        for _ in range(item['quantity'] * order.order_quantity):
+            remnant_id = pool.take(length_um, width_um)
+            if remnant_id is None:
+                break
+            taken[remnant_id] = taken.get(remnant_id, 0) + 1
+        if not taken:
+            continue
+        pieces = sum(taken.values())
+        plan['assignments'][item['id']] = taken
+        plan['used'].update(taken)
+        covered_um, covered_mg = plan['covered'].get(item['stock_item_id'], (0, 0))
+        plan['covered'][item['stock_item_id']] = (
+            covered_um + length_um * pieces,
+            covered_mg + weights.total_mg(item['weight_mg'], pieces, coefficient),
+        )
+
+    for stock_item_id, pool in pools.items():
+        for length_um, width_um, remnant_id in pool.leftovers(plan['used']):
+            plan['leftovers'].append((stock_item_id, remnant_id, length_um, width_um))
+    return plan
+
+
+@transaction.atomic
+def apply_plan(order, plan):
+    """Списывает использованные остатки и регистрирует отрезанные от них куски
+
+    Возвращает False, если часть остатков уже списана параллельно (план устарел).
+    """
+    updated = StockRemnant.objects.filter(id__in=plan['used'], status='available').update(
+        status='used', used_order=order,
+    )
+    if updated != len(plan['used']):
+        return False
+    StockRemnant.objects.bulk_create([
+        StockRemnant(stock_item_id=stock_item_id, parent_id=remnant_id, source_order=order,
+                     length_um=length_um, width_um=width_um)
+        for stock_item_id, remnant_id, length_um, width_um in plan['leftovers']
+    ])
+    return True
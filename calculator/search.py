@@ -0,0 +1,124 @@
+"""Полнотекстовый поиск заказов и деталей (SQLite FTS5)
+
+calculator_order_fts — документ заказа: номер, наименование, чертеж и
+наименования, обозначения и материалы всех его деталей. calculator_orderitem_fts —
+строка на каждую деталь. Индексы поддерживаются триггерами базы, поэтому
+учитывают и массовые операции (bulk_create, update), которые не вызывают
+сигналы. Токенизатор unicode61 приводит к одному регистру и кириллицу.
+
+Триггеры деталей обновляют только строку детали, а заказ отмечают в
+calculator_order_fts_dirty: документ заказа собирается из всех его деталей, и
+пересборка на каждую деталь делала бы массовую вставку квадратичной. Документы
+отмеченных заказов пересобираются по одному разу перед поиском заказов
+(refresh_documents). Триггеры созданы миграциями 0020 и 0029.
+"""
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+ORDER_FTS = 'calculator_order_fts'
+ITEM_FTS = 'calculator_orderitem_fts'
+DIRTY = 'calculator_order_fts_dirty'
+
+# Веса столбцов ORDER_FTS для bm25: номер, наименование, чертеж, детали
+ORDER_WEIGHTS = (10.0, 5.0, 5.0, 1.0)
+
+ORDER_FTS_COLUMNS = "order_number, order_name, drawing_number, items, tokenize='unicode61', prefix='2 3'"
+
+
+def _order_rows(where, table=ORDER_FTS):
+    return f"""
+        INSERT INTO {table} (rowid, order_number, order_name, drawing_number, items)
+        SELECT o.id, o.order_number, o.order_name, COALESCE(o.drawing_number, ''),
+               COALESCE((SELECT group_concat(COALESCE(p.name, '') || ' ' || COALESCE(i.designation, '')
+                                             || ' ' || COALESCE(m.name, ''), ' ')
+                         FROM calculator_orderitem i
+                         LEFT JOIN calculator_partname p ON p.id = i.part_name_id
+                         LEFT JOIN calculator_material m ON m.id = i.material_id
+                         WHERE i.order_id = o.id), '')
+        FROM calculator_order o WHERE {where};"""
+
+
+def _item_rows(where):
+    return f"""
+        INSERT INTO {ITEM_FTS} (rowid, part_name, designation, material, order_id)
+        SELECT i.id, COALESCE(p.name, ''), COALESCE(i.designation, ''), COALESCE(m.name, ''), i.order_id
+        FROM calculator_orderitem i
+        LEFT JOIN calculator_partname p ON p.id = i.part_name_id
+        LEFT JOIN calculator_material m ON m.id = i.material_id
+        WHERE {where};"""
+
+
+def _execute(cursor, sql):
+    cursor.execute(sql.strip().rstrip(';'))
+
+
+def refresh_documents():
+    """Пересобирает документы заказов, детали которых менялись; возвращает число заказов"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT 1 FROM {DIRTY} LIMIT 1')
+        if cursor.fetchone() is None:
+            return 0
+    # Первая команда транзакции — запись: блокировка на запись берется сразу,
+    # и отметки, добавленные параллельно, не теряются между чтением и удалением
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {ORDER_FTS} WHERE rowid IN (SELECT order_id FROM {DIRTY})')
+        _execute(cursor, _order_rows(f'o.id IN (SELECT order_id FROM {DIRTY})'))
+        cursor.execute(f'DELETE FROM {DIRTY}')
+        return cursor.rowcount
+
+
+def rebuild_index(cursor=None):
+    """Полностью перестраивает оба индекса по текущим данным"""
+    if cursor is None:
+        with connection.cursor() as cursor:
+            return rebuild_index(cursor)
+    cursor.execute(f'DELETE FROM {ITEM_FTS}')
+    cursor.execute(f'DELETE FROM {ORDER_FTS}')
+    cursor.execute(f'DELETE FROM {DIRTY}')
+    _execute(cursor, _item_rows('1'))
+    _execute(cursor, _order_rows('1'))
+    cursor.execute(f"INSERT INTO {ORDER_FTS}({ORDER_FTS}) VALUES ('optimize')")
+
+
+def insert_order_documents(cursor, where, table):
+    """Добавляет документы заказов, отобранных условием where (алиас o), в таблицу FTS table"""
+    _execute(cursor, _order_rows(where, table))
+
+
+def match_query(text):
+    """Строка поиска → запрос FTS5: каждое слово — фраза с поиском по префиксу, слова через И
+
+    Кавычки убираются, поэтому пользовательский ввод не может нарушить синтаксис запроса.
+    """
+    terms = [term.replace('"', '') for term in (text or '').split()]
+    terms = [term for term in terms if any(char.isalnum() for char in term)]
+    if not terms:
+        return None
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def ranked_order_ids(text):
+    """id заказов, подходящих под запрос, от наиболее релевантного"""
+    query = match_query(text)
+    if query is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {ORDER_FTS} WHERE {ORDER_FTS} MATCH %s '
+            f'ORDER BY bm25({ORDER_FTS}, {", ".join(map(str, ORDER_WEIGHTS))})',
+            [query],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def order_ids_sql(text):
+    """Подзапрос id заказов для фильтра id__in (без передачи списка id в запрос)"""
+    return RawSQL(f'SELECT rowid FROM {ORDER_FTS} WHERE {ORDER_FTS} MATCH %s', [match_query(text)])
+
+
+def item_ids_sql(text, order_id):
+    """Подзапрос id деталей заказа, подходящих под запрос"""
+    return RawSQL(
+        f'SELECT rowid FROM {ITEM_FTS} WHERE {ITEM_FTS} MATCH %s AND order_id = %s',
+        [match_query(text), order_id],
+    )
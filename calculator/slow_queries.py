@@ -0,0 +1,140 @@
+"""Журнал медленных SQL-запросов с автоматическим EXPLAIN QUERY PLAN"""
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+from contextlib import ExitStack, contextmanager
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger('calculator.slow_queries')
+logger.propagate = False
+
+_handler_lock = threading.Lock()
+_handler_path = None
+
+# Кадры стека из этих файлов не интересны: это сам регистратор и middleware
+_SKIP_FILES = ('slow_queries.py', 'middleware.py')
+
+
+def _ensure_handler():
+    """Подключает ротируемый файловый журнал (один раз на процесс и путь)"""
+    global _handler_path
+    path = settings.SLOW_QUERY_LOG_PATH
+    if _handler_path == path:
+        return
+    with _handler_lock:
+        if _handler_path == path:
+            return
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        handler = RotatingFileHandler(
+            path,
+            maxBytes=settings.SLOW_QUERY_LOG_MAX_BYTES,
+            backupCount=settings.SLOW_QUERY_LOG_BACKUP_COUNT,
+            encoding='utf-8',
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.WARNING)
+        _handler_path = path
+
+
+def _origin_frame():
+    """Ближайший к запросу кадр стека из кода проекта (не из Django)"""
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        filename = frame.filename
+        if not filename.startswith(base_dir) or 'site-packages' in filename:
+            continue
+        if filename.endswith(_SKIP_FILES):
+            continue
+        return f'{os.path.relpath(filename, base_dir)}:{frame.lineno} in {frame.name}'
+    return None
+
+
+def explain_query_plan(connection, sql, params):
+    """Возвращает план выполнения запроса в виде дерева строк (только SQLite)"""
+    if connection.vendor != 'sqlite':
+        return []
+    # Отдельный «сырой» курсор: не проходит через execute_wrapper и не
+    # сбрасывает результат исходного запроса
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+
+    depth = {0: -1}
+    plan = []
+    for node_id, parent_id, _notused, detail in rows:
+        level = depth.get(parent_id, -1) + 1
+        depth[node_id] = level
+        plan.append('  ' * level + detail)
+    return plan
+
+
+class SlowQueryRecorder:
+    """Обёртка для connection.execute_wrapper, записывающая медленные запросы"""
+
+    def __init__(self, label=None, request=None, threshold_ms=None):
+        self.label = label
+        self.request = request
+        self.threshold_ms = (
+            settings.SLOW_QUERY_THRESHOLD_MS if threshold_ms is None else threshold_ms
+        )
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if duration_ms >= self.threshold_ms:
+                self.record(sql, params, many, context['connection'], duration_ms)
+
+    def view_name(self):
+        if self.request is not None:
+            match = getattr(self.request, 'resolver_match', None)
+            if match is not None:
+                return match.view_name
+        return self.label
+
+    def record(self, sql, params, many, connection, duration_ms):
+        plan = []
+        if not many:
+            try:
+                plan = explain_query_plan(connection, sql, params)
+            except Exception as e:
+                plan = [f'EXPLAIN не выполнен: {e}']
+
+        entry = {
+            'time': timezone.now().isoformat(),
+            'duration_ms': round(duration_ms, 3),
+            'view': self.view_name(),
+            'path': self.request.path if self.request is not None else None,
+            'frame': _origin_frame(),
+            'sql': sql,
+            'params': [repr(p) for p in params] if params and not many else None,
+            'plan': plan,
+        }
+        _ensure_handler()
+        logger.warning(json.dumps(entry, ensure_ascii=False))
+
+
+@contextmanager
+def record_slow_queries(label=None, request=None, threshold_ms=None):
+    """Записывает медленные запросы всех подключений внутри блока with"""
+    recorder = SlowQueryRecorder(label=label, request=request, threshold_ms=threshold_ms)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
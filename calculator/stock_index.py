@@ -0,0 +1,102 @@
+"""Индекс подбора сортамента по размерам детали
+
+Для каждой пары (материал, тип сортамента) хранится отсортированный список
+размеров заготовки в мкм; подходящий сортамент ищется двоичным поиском
+(bisect) по размеру детали с припуском. Индекс строится из кэша справочников
+и перестраивается, когда сигналы сбрасывают версию справочников.
+"""
+import threading
+from bisect import bisect_left
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+
+from .reference_cache import get_reference_options, get_reference_version
+from .weights import to_um
+
+# Размер сортамента, с которым сравнивается размер детали
+STOCK_SIZE_FIELDS = {
+    'round': 'diameter',
+    'hexagon': 'key_size',
+    'tube': 'outer_diameter',
+    'sheet': 'width',  # толщина листа
+}
+
+# Замер детали, определяющий размер заготовки
+PART_SIZE_FIELDS = {
+    'round': 'diameter',
+    'hexagon': 'key_size',
+    'tube': 'diameter',
+    'sheet': 'height',
+}
+
+_lock = threading.Lock()
+_index = None  # (версия справочников, {(material_id, section_type): (размеры, позиции)})
+
+
+def stock_label(stock):
+    """Подпись сортамента как в StockItem.__str__"""
+    section_type = stock['section_type']
+    if section_type == 'sheet':
+        size = f"Лист {stock['width']} мм"
+    elif section_type == 'round':
+        size = f"Круг Ø{stock['diameter']} мм"
+    elif section_type == 'hexagon':
+        size = f"Шестигранник S{stock['key_size']} мм"
+    else:
+        size = f"Труба Ø{stock['outer_diameter']}x{stock['wall_thickness']} мм"
+    return f"{stock['material']['name']} - {size}"
+
+
+def build_index(stock_items):
+    groups = {}
+    for stock in stock_items:
+        size = stock.get(STOCK_SIZE_FIELDS.get(stock['section_type'], ''))
+        if size is None:
+            continue
+        groups.setdefault((stock['material']['id'], stock['section_type']), []).append((to_um(size), stock['id'], stock))
+    index = {}
+    for key, entries in groups.items():
+        entries.sort(key=lambda entry: entry[:2])
+        index[key] = ([size for size, _, _ in entries], [stock for _, _, stock in entries])
+    return index
+
+
+def get_index():
+    """Текущий индекс; перестраивается при изменении справочников"""
+    global _index
+    version = get_reference_version()
+    current = _index
+    if current is not None and current[0] == version:
+        return current[1]
+    with _lock:
+        if _index is None or _index[0] != version:
+            _index = (version, build_index(get_reference_options()['stock_items']))
+        return _index[1]
+
+
+def default_allowance(section_type):
+    return Decimal(str(settings.STOCK_FIT_ALLOWANCE_MM.get(section_type, 0)))
+
+
+def best_fit(material_id, section_type, size, allowance=None, limit=3):
+    """Наименьший сортамент не меньше размера детали с припуском (до limit позиций)"""
+    if allowance is None:
+        allowance = default_allowance(section_type)
+    entry = get_index().get((int(material_id), section_type))
+    if entry is None:
+        return []
+    sizes, stocks = entry
+    position = bisect_left(sizes, to_um(size) + to_um(allowance))
+    return stocks[position:position + limit]
+
+
+def parse_size(value):
+    """Размер из запроса (допускается запятая); None, если не число"""
+    if value in (None, ''):
+        return None
+    try:
+        size = Decimal(str(value).replace(',', '.'))
+    except InvalidOperation:
+        return None
+    return size if size.is_finite() and size >= 0 else None
@@ -1,6 +1,28 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth.models import User
-from .models import Material, PartName, StockItem, Order, OrderItem
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+from .models import (Material, PartName, StockItem, StockBalance, StockRemnant, CuttingRoute, Order, OrderItem,
+                     ChangeLog, Job, OrderItemTemplate, OrderRevision, OrderSequence, OrderSnapshot, StockMovement,
+                     ReferenceVersion, StockReservation, WebhookEvent)
+from . import slow_queries
+from .loadtest import HttpClient, RouteStats
+from .datagen import DatasetGenerator
+from . import (archive, backup, changefeed, comparison, cutting, duplicates, facets, history, inventory, jobs, remnants,
+               search, webhooks, weights)
 
 
 class PrintCuttingTaskTests(TestCase):
@@ -220,3 +242,1191 @@ class PrintCuttingTaskTests(TestCase):
         
         self.assertEqual(len(grouped_by_section['tube']), 1)
         self.assertIn(item, grouped_by_section['tube'])
+
+
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+
+    def test_slow_query_is_logged_with_plan_and_view(self):
+        """Запросы выше порога попадают в журнал вместе с EXPLAIN QUERY PLAN и именем view"""
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, 'slow.log')
+            with override_settings(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG_PATH=log_path):
+                self.client.get('/orders/', {'search': 'abc'})
+            with open(log_path, encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f]
+            for handler in list(slow_queries.logger.handlers):
+                slow_queries.logger.removeHandler(handler)
+                handler.close()
+            slow_queries._handler_path = None
+
+        search = [e for e in entries if 'MATCH' in e['sql'] and '"calculator_order"."order_number"' in e['sql']]
+        self.assertTrue(search)
+        self.assertEqual(search[0]['view'], 'order_list')
+        self.assertTrue(search[0]['plan'])
+        self.assertIn('calculator/views.py', search[0]['frame'])
+
+
+class LoadTestHarnessTests(TestCase):
+    def test_percentiles_nearest_rank(self):
+        stats = RouteStats(latencies=[float(x) for x in range(1, 101)])
+        self.assertEqual(stats.percentile(50), 50.0)
+        self.assertEqual(stats.percentile(95), 95.0)
+        self.assertEqual(stats.percentile(99), 99.0)
+
+    def test_response_parsing_keeps_cookies(self):
+        client = HttpClient('http://127.0.0.1:8000', {})
+        raw = (b'HTTP/1.1 302 Found\r\nLocation: /orders/15/\r\n'
+               b'Set-Cookie: csrftoken=abc; Path=/\r\nSet-Cookie: sessionid=xyz; HttpOnly\r\n\r\n')
+        response = client._parse(raw)
+        self.assertEqual(response.status, 302)
+        self.assertEqual(response.location, '/orders/15/')
+        self.assertEqual(client.cookies, {'csrftoken': 'abc', 'sessionid': 'xyz'})
+
+
+class DatasetGeneratorTests(TestCase):
+    def generate(self, seed):
+        generator = DatasetGenerator(seed=seed, chunk_size=100)
+        users = generator.users(2)
+        materials = generator.materials(5)
+        part_names = generator.part_names(30)
+        stock_items = generator.stock_items(materials, 8)
+        generator.orders(6, users, stock_items, part_names, items_per_order=20)
+        return list(OrderItem.objects.order_by('id').values_list(
+            'sequence_number', 'part_name__name', 'quantity', 'is_special',
+            'stock_item__section_type', 'material__name', 'length', 'designation',
+        ))
+
+    def test_same_seed_gives_same_dataset(self):
+        first = self.generate(seed=7)
+        Order.objects.all().delete()
+        StockItem.objects.all().delete()
+        second = self.generate(seed=7)
+        self.assertEqual(first, second)
+        self.assertEqual(Order.objects.count(), 6)
+        self.assertTrue(any(row[4] == 'sheet' for row in first))
+        for order in Order.objects.all():
+            self.assertEqual(order.sequence.last_number, OrderSequence.max_number(order.id))
+
+
+class LastItemParamsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.material = Material.objects.create(name='Сталь 45', density=7.85)
+        self.part = PartName.objects.create(name='Вал')
+        self.stock = StockItem.objects.create(material=self.material, section_type='round', diameter=40)
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+
+    def add_item(self):
+        return self.client.post(f'/orders/{self.order.id}/add-item/', {
+            'sequence_number': '1', 'part_name': self.part.id, 'material': self.material.id,
+            'stock_item': self.stock.id, 'quantity': 3, 'diameter': 38, 'round_length': 120,
+        })
+
+    def test_params_go_to_signed_cookie_not_session(self):
+        session_data = Session.objects.get().session_data
+        response = self.add_item()
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('last_item_params', response.cookies)
+        self.assertEqual(Session.objects.get().session_data, session_data)
+
+        # Новый заказ без деталей предзаполняется из cookie
+        order = Order.objects.create(order_number='2', order_name='Заказ 2', user=self.user)
+        response = self.client.get(f'/orders/{order.id}/add-item/')
+        self.assertEqual(response.context['form'].initial['stock_item'], self.stock.id)
+        self.assertEqual(response.context['last_section_type'], 'round')
+
+    def test_params_of_other_user_are_ignored(self):
+        self.add_item()
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_login(other)
+        order = Order.objects.create(order_number='2', order_name='Заказ 2', user=other)
+        response = self.client.get(f'/orders/{order.id}/add-item/')
+        self.assertNotIn('stock_item', response.context['form'].initial)
+
+    def test_cleanup_sessions_removes_only_expired(self):
+        Session.objects.create(session_key='expired', session_data='', expire_date=timezone.now() - timedelta(days=1))
+        call_command('cleanup_sessions', batch_size=1, stdout=open(os.devnull, 'w'))
+        self.assertFalse(Session.objects.filter(session_key='expired').exists())
+        self.assertEqual(Session.objects.count(), 1)
+
+
+class OrderItemTemplateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.material = Material.objects.create(name='Сталь 45', density=7.85)
+        self.part = PartName.objects.create(name='Вал')
+        self.sheet = StockItem.objects.create(material=self.material, section_type='sheet', width=10)
+        self.round = StockItem.objects.create(material=self.material, section_type='round', diameter=40)
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+
+    def create_item(self, number, stock_item, **kwargs):
+        return OrderItem.objects.create(
+            order=self.order, sequence_number=str(number), part_name=self.part,
+            material=self.material, stock_item=stock_item, quantity=2, length=100, **kwargs
+        )
+
+    def test_template_follows_item_saves_and_deletes(self):
+        self.create_item(1, self.sheet, width=50, height=60)
+        template = OrderItemTemplate.for_order(self.order)
+        self.assertEqual(template.next_sequence_number, 2)
+
+        last = self.create_item(2, self.round, diameter=38)
+        template.refresh_from_db()
+        self.assertEqual(template.next_sequence_number, 3)
+        self.assertEqual(template.section_type, 'round')
+        self.assertEqual(template.initial_data()['diameter'], 38.0)
+
+        last.delete()
+        template.refresh_from_db()
+        self.assertEqual(template.next_sequence_number, 3)  # номера удаленных деталей не выдаются
+        self.assertEqual(template.section_type, 'sheet')
+        self.assertEqual(template.last_measurements(), {'length': '100.00', 'width': '50.00', 'height': '60.00'})
+        self.assertEqual(template.items_count, 1)
+
+    def test_template_refreshed_after_bulk_copy(self):
+        self.create_item(1, self.sheet, width=50, height=60)
+        self.create_item(2, self.round, diameter=38)
+
+        class FormOpenedDuringCopy:
+            """Форма добавления открыта в копии до вставки деталей — шаблон построен пустым"""
+            def start(self, total, message=''):
+                OrderItemTemplate.for_order(Order.objects.latest('id'))
+
+            def step(self, count=1, message=None):
+                pass
+
+        copy = jobs.copy_order(self.order, '2', None, self.user, FormOpenedDuringCopy())
+        template = OrderItemTemplate.objects.get(order=copy)
+        self.assertEqual((template.items_count, template.section_type), (2, 'round'))
+
+    def test_form_query_count_does_not_depend_on_order_size(self):
+        for number in range(1, 4):
+            self.create_item(number, self.round, diameter=38)
+        url = f'/orders/{self.order.id}/add-item/'
+        self.client.get(url)  # построение шаблона и кэша справочников
+        with self.assertNumQueries(6):  # пользователь, снимок, заказ с шаблоном, версия справочников, SAVEPOINT/RELEASE
+            response = self.client.get(url)
+        self.assertEqual(response.context['next_sequence_number'], 4)
+        self.assertContains(response, 'Ø40,00 мм')
+
+
+class StockSectionPropertiesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.material = Material.objects.create(name='Сталь 45', density=7.85)
+        self.part = PartName.objects.create(name='Вал')
+        self.round = StockItem.objects.create(material=self.material, section_type='round', diameter=40)
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user, order_quantity=2)
+
+    def test_linear_mass_follows_density(self):
+        self.assertAlmostEqual(self.round.section_area, 3.14159 * 20 ** 2)
+        self.assertAlmostEqual(self.round.linear_mass, 3.14159 * 20 ** 2 * 7.85 / 1000)
+
+        self.material.density = 2.7
+        self.material.save()
+        self.round.refresh_from_db()
+        self.assertAlmostEqual(self.round.linear_mass, 3.14159 * 20 ** 2 * 2.7 / 1000)
+
+    def test_sql_weights_match_python(self):
+        items = [
+            OrderItem.objects.create(order=self.order, sequence_number=str(n), part_name=self.part,
+                                     material=self.material, stock_item=self.round, quantity=n, length=100 * n)
+            for n in range(1, 4)
+        ]
+        annotated = {i.id: i for i in OrderItem.objects.with_weights()}
+        for item in items:
+            self.assertAlmostEqual(annotated[item.id].total_weight_g_db, float(item.total_weight_g), delta=0.001)
+
+        response = self.client.get('/orders/')
+        order = response.context['orders'][0]
+        self.assertEqual(order.positions_count, 3)
+        self.assertEqual(order.weight_kg, self.order.total_weight)
+
+
+class WeightEngineTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.steel = Material.objects.create(name='Сталь 45', density='7.85')
+        self.part = PartName.objects.create(name='Вал')
+        self.sheet = StockItem.objects.create(material=self.steel, section_type='sheet', width=10)
+        self.round = StockItem.objects.create(material=self.steel, section_type='round', diameter=40)
+        self.hexagon = StockItem.objects.create(material=self.steel, section_type='hexagon', key_size=24)
+        self.tube = StockItem.objects.create(material=self.steel, section_type='tube',
+                                             outer_diameter=57, wall_thickness='3.5')
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user,
+                                          coefficient='1.15', order_quantity=3)
+
+    def create_item(self, number, stock_item, **kwargs):
+        return OrderItem.objects.create(
+            order=self.order, sequence_number=str(number), part_name=self.part,
+            material=self.steel, stock_item=stock_item, quantity=7, length='123.45', **kwargs
+        )
+
+    def test_item_weights_are_exact(self):
+        sheet = self.create_item(1, self.sheet, width='50.5', height=60)
+        round_item = self.create_item(2, self.round, diameter=38)
+        # 123,45 × 50,5 × 10 мм³ × 7,85 г/см³ = 489,3866625 г
+        self.assertEqual(sheet.weight_mg, 489387)
+        # π·20² × 123,45 мм³ × 7,85 г/см³ (π = 3.14159)
+        self.assertEqual(round_item.weight_mg, weights.round_div(314159 * 400 * 12345 * 785, 10**5 * 100 * 100))
+        self.assertEqual(sheet.total_weight_mg, weights.round_div(489387 * 7 * 115, 100))
+
+    def test_totals_identical_everywhere(self):
+        for number, stock_item in enumerate([self.sheet, self.round, self.hexagon, self.tube] * 5, 1):
+            self.create_item(number, stock_item, width='33.33', key_size='23.7')
+        expected = self.order.total_weight
+
+        response = self.client.get(f'/orders/{self.order.id}/print-grouped/')
+        self.assertEqual(response.context['total_weight_kg'], expected)
+        self.assertEqual(sum(g['total_weight'] for g in response.context['grouped_items']), expected)
+
+        response = self.client.get(f'/orders/{self.order.id}/print/')
+        self.assertEqual(response.context['total_weight_kg'], expected)
+
+        response = self.client.get('/orders/')
+        self.assertEqual(response.context['orders'][0].weight_kg, expected)
+
+        response = self.client.post(f'/orders/{self.order.id}/update-coefficient/', {'coefficient': '1.15'},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.json()['total_weight'], weights.format_kg(self.order.total_weight_mg))
+
+    def test_stored_weight_follows_density(self):
+        item = self.create_item(1, self.round)
+        self.steel.density = '2.70'
+        self.steel.save()
+        item.refresh_from_db()
+        self.assertEqual(item.weight_mg, weights.item_weight_mg(item))
+        self.assertLess(item.weight_mg, 500000)
+
+
+class StockBestFitTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.steel = Material.objects.create(name='Сталь 45', density=7.85)
+        self.brass = Material.objects.create(name='ЛС59-1', density=8.45)
+        for diameter in (40, 45, 50, 56, 63):
+            StockItem.objects.create(material=self.steel, section_type='round', diameter=diameter)
+        self.brass_bar = StockItem.objects.create(material=self.brass, section_type='round', diameter=50)
+
+    def best_fit(self, **params):
+        params = {'material_id': self.steel.id, 'section_type': 'round', **params}
+        return self.client.get('/api/stock-items/best-fit/', params).json()
+
+    def test_smallest_bar_with_allowance(self):
+        data = self.best_fit(size='47', limit=2)
+        self.assertEqual([r['size'] for r in data['results']], ['50.00', '56.00'])
+        self.assertEqual(data['results'][0]['text'], 'Сталь 45 - Круг Ø50.00 мм')
+        # Припуск по умолчанию 2 мм: для Ø48,5 круг 50 уже мал
+        self.assertEqual(self.best_fit(size='48,5', limit=1)['results'][0]['size'], '56.00')
+        self.assertEqual(self.best_fit(size='48,5', allowance='0', limit=1)['results'][0]['size'], '50.00')
+        self.assertEqual(self.best_fit(size='70')['results'], [])
+
+    def test_index_follows_reference_changes(self):
+        self.assertEqual(self.best_fit(size='60', limit=1)['results'][0]['size'], '63.00')
+        StockItem.objects.create(material=self.steel, section_type='round', diameter=63)
+        new_bar = StockItem.objects.create(material=self.steel, section_type='round', diameter=62)
+        self.assertEqual(self.best_fit(size='60', limit=1)['results'][0]['id'], new_bar.id)
+        self.assertEqual(self.best_fit(size='30', material_id=self.brass.id)['results'][0]['id'], self.brass_bar.id)
+        self.assertEqual(self.client.get('/api/stock-items/best-fit/', {'size': '1'}).status_code, 400)
+
+    def test_version_changed_by_another_process(self):
+        self.assertEqual(self.best_fit(size='60', limit=1)['results'][0]['size'], '63.00')
+        # Другой процесс: строка добавлена без сигналов этого процесса, версия изменена в базе
+        [bar] = StockItem.objects.bulk_create([StockItem(material=self.steel, section_type='round', diameter=62)])
+        self.assertEqual(self.best_fit(size='60', limit=1)['results'][0]['size'], '63.00')
+        ReferenceVersion.objects.update(version=12345)
+        self.assertEqual(self.best_fit(size='60', limit=1)['results'][0]['id'], bar.id)
+
+    def test_item_form_gets_part_size_fields(self):
+        order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+        response = self.client.get(f'/orders/{order.id}/add-item/')
+        self.assertContains(response, '<script id="part-size-fields" type="application/json">')
+        self.assertEqual(response.context['part_size_fields']['tube'], 'diameter')
+
+
+class StockLedgerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.steel = Material.objects.create(name='Сталь 45', density='7.85')
+        self.part = PartName.objects.create(name='Вал')
+        self.bar = StockItem.objects.create(material=self.steel, section_type='round', diameter=40)
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user,
+                                          coefficient='1.00', order_quantity=2)
+        OrderItem.objects.create(order=self.order, sequence_number='1', part_name=self.part,
+                                 material=self.steel, stock_item=self.bar, quantity=3, length=500, diameter=38)
+
+    def balance(self):
+        return StockBalance.objects.get(stock_item=self.bar)
+
+    def test_receipt_mass_from_section(self):
+        inventory.receive(self.bar, 6000)
+        balance = self.balance()
+        self.assertEqual(balance.on_hand_length_um, 6000000)
+        self.assertEqual(balance.on_hand_mg, weights.stock_weight_mg(self.bar, 6000))
+        self.assertEqual(balance.available_mg, balance.on_hand_mg)
+        sheet = StockItem.objects.create(material=self.steel, section_type='sheet', width=10)
+        with self.assertRaises(inventory.InventoryError):
+            inventory.receive(sheet, 1000)
+
+    def test_reserve_release_issue(self):
+        inventory.receive(self.bar, 2000)
+        with self.assertRaises(inventory.InventoryError):
+            inventory.reserve_order(self.order)  # нужно 3 × 500 × 2 = 3000 мм
+        inventory.receive(self.bar, 2000)
+        inventory.reserve_order(self.order)
+        balance = self.balance()
+        self.assertEqual((balance.reserved_length_um, balance.available_length_um), (3000000, 1000000))
+        inventory.reserve_order(self.order)  # повторный резерв не удваивается
+        self.assertEqual(self.balance().reserved_length_um, 3000000)
+
+        inventory.consume_order(self.order)
+        balance = self.balance()
+        self.assertEqual((balance.on_hand_length_um, balance.reserved_length_um), (1000000, 0))
+        self.assertEqual(balance.available_length_um, 1000000)
+        with self.assertRaises(inventory.InventoryError):
+            inventory.consume_order(self.order)
+        self.assertEqual(list(self.bar.movements.values_list('kind', flat=True)),
+                         ['consumption', 'reservation', 'receipt', 'receipt'])
+
+    def test_order_delete_releases_reservation(self):
+        inventory.receive(self.bar, 4000)
+        self.client.post(f'/orders/{self.order.id}/stock/reserve/')
+        self.assertEqual(self.balance().available_length_um, 1000000)
+        data = self.client.get('/api/stock-items/', {'material_id': self.steel.id}).json()
+        self.assertEqual(data['results'][0]['available_length_mm'], '1000.000')
+        self.assertContains(self.client.get(f'/orders/{self.order.id}/stock/'), 'Снять резерв')
+        self.assertContains(self.client.get(f'/stock/{self.bar.id}/movements/'), 'Резерв')
+        self.assertContains(self.client.get('/stock/'), 'Поступление')
+        self.assertEqual(self.client.post(f'/orders/{self.order.id}/stock/unknown/').status_code, 404)
+        self.client.post(f'/orders/{self.order.id}/delete/')
+        self.assertFalse(Order.objects.filter(id=self.order.id).exists())
+        balance = self.balance()
+        self.assertEqual((balance.reserved_length_um, balance.available_length_um), (0, 4000000))
+        release = self.bar.movements.get(kind='release')
+        self.assertEqual((release.length_um, release.comment), (3000000, 'Удаление заказа №1'))
+
+
+class StockRemnantTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.steel = Material.objects.create(name='Сталь 45', density='7.85')
+        self.part = PartName.objects.create(name='Вал')
+        self.bar = StockItem.objects.create(material=self.steel, section_type='round', diameter=60)
+        self.sheet = StockItem.objects.create(material=self.steel, section_type='sheet', width=10)
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user,
+                                          coefficient='1.00', order_quantity=1)
+
+    def remnant(self, stock_item, length, width=0):
+        return StockRemnant.objects.create(stock_item=stock_item, length_um=length * 1000, width_um=width * 1000)
+
+    def test_best_fit_queries(self):
+        self.remnant(self.bar, 900)
+        short = self.remnant(self.bar, 300)
+        self.remnant(self.bar, 200)
+        self.assertEqual(remnants.find_remnants(self.bar, 250)[0], short)
+        response = self.client.get(f'/stock/{self.bar.id}/remnants/', {'length': '250'})
+        self.assertEqual([r.id for r in response.context['remnants']][:1], [short.id])
+        self.remnant(self.sheet, 400, 400)
+        narrow = self.remnant(self.sheet, 150, 600)  # хранится как 600 × 150
+        self.assertEqual((narrow.length_um, narrow.width_um), (600000, 150000))
+        self.assertEqual(remnants.find_remnants(self.sheet, 120, 500), [narrow])
+        self.assertEqual(len(remnants.find_remnants(self.sheet, 120, 350)), 2)
+        self.assertEqual(remnants.find_remnants(self.sheet, 120, 350)[0], narrow)
+
+    def test_issue_uses_remnants_before_stock(self):
+        OrderItem.objects.create(order=self.order, sequence_number='1', part_name=self.part, material=self.steel,
+                                 stock_item=self.bar, quantity=3, length=250, diameter=58)
+        long_end = self.remnant(self.bar, 600)
+        self.remnant(self.bar, 100)
+        inventory.receive(self.bar, 1000)
+
+        plan = remnants.plan_order(self.order)
+        # 600 - 250 - 3 = 347, 347 - 250 - 3 = 94; третья заготовка — со склада
+        self.assertEqual(plan['assignments'], {self.order.items.get().id: {long_end.id: 2}})
+        response = self.client.get(f'/orders/{self.order.id}/print-cutting/')
+        self.assertContains(response, f'ост. №{long_end.id} — 2 шт')
+
+        inventory.consume_order(self.order)
+        balance = StockBalance.objects.get(stock_item=self.bar)
+        self.assertEqual(balance.on_hand_length_um, 750000)
+        long_end.refresh_from_db()
+        self.assertEqual((long_end.status, long_end.used_order), ('used', self.order))
+        piece = StockRemnant.objects.get(parent=long_end)
+        self.assertEqual((piece.length_um, piece.status, piece.source_order), (94000, 'available', self.order))
+
+    def test_scrap_only_available_remnant(self):
+        used = self.remnant(self.bar, 500)
+        StockRemnant.objects.filter(pk=used.pk).update(status='used')
+        response = self.client.post(f'/stock/remnants/{used.id}/scrap/', follow=True)
+        used.refresh_from_db()
+        self.assertEqual(used.status, 'used')
+        [message] = response.context['messages']
+        self.assertEqual((message.level_tag, message.message),
+                         ('warning', f'Остаток №{used.id} уже недоступен: использован'))
+
+
+class CuttingPlanTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        steel = Material.objects.create(name='Сталь 45', density='7.85')
+        tool_steel = Material.objects.create(name='4Х5МФС', density='7.80')
+        part = PartName.objects.create(name='Вал')
+        self.bar = StockItem.objects.create(material=steel, section_type='round', diameter=60)
+        small_bar = StockItem.objects.create(material=steel, section_type='round', diameter=30)
+        tool_sheet = StockItem.objects.create(material=tool_steel, section_type='sheet', width=20)
+        self.orders = []
+        for number, order_quantity in (('101', 1), ('102', 2)):
+            order = Order.objects.create(order_number=number, order_name='Заказ', user=self.user,
+                                         order_quantity=order_quantity)
+            for sequence, stock_item, material, diameter in (
+                (1, self.bar, steel, 58), (2, small_bar, steel, 28), (3, tool_sheet, tool_steel, None),
+            ):
+                OrderItem.objects.create(order=order, sequence_number=str(sequence), part_name=part,
+                                         material=material, stock_item=stock_item, quantity=2,
+                                         length=100, width=40, height=20, diameter=diameter)
+            self.orders.append(order)
+
+    def test_blanks_pooled_across_orders(self):
+        cutting.consolidated_plan(self.orders)  # таблица правил строится при первом обращении
+        with self.assertNumQueries(2):
+            plan = cutting.consolidated_plan(self.orders)
+        # Круг Ø30 (деталь ≤ 50 мм) в задание не входит; лист 4Х5МФС — в разделе круга
+        self.assertEqual([(group['section'], group['stock_item'].section_type) for group in plan],
+                         [('round', 'sheet'), ('round', 'round')])
+        self.assertEqual(plan[0]['blanks'][0]['label'], '20x40x100')
+        bar_group = plan[1]
+        self.assertEqual(bar_group['pieces'], 6)
+        self.assertEqual(bar_group['length_mm'], 600)
+        self.assertEqual(bar_group['blanks'], [{'label': 'Ø58x100', 'pieces': 6, 'orders': [('101', 2), ('102', 4)]}])
+
+        response = self.client.get('/orders/cutting-plan/', {'order': [o.id for o in self.orders]})
+        self.assertContains(response, '№102 — 4')
+
+    def test_selected_orders_outside_period_and_invalid_dates(self):
+        Order.objects.filter(id=self.orders[0].id).update(created_at=timezone.now() - timedelta(days=60))
+        response = self.client.get('/orders/cutting-plan/', {'order': [o.id for o in self.orders],
+                                                              'date_from': '2024-02-30', 'date_to': '2024-02-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['date_to'], timezone.localdate())
+        self.assertEqual([o.order_number for o in response.context['selected']], ['102', '101'])
+        self.assertContains(response, '№101 — 2')
+        response = self.client.get('/orders/cutting-plan/')
+        self.assertEqual([o.order_number for o in response.context['orders']], ['102'])
+
+
+class CuttingRouteTests(TestCase):
+    def setUp(self):
+        self.steel = Material.objects.create(name='Сталь 45', density='7.85')
+        self.tool_steel = Material.objects.create(name=' 4х5мфс ', density='7.80')
+        self.sheet = StockItem.objects.create(material=self.steel, section_type='sheet', width=20)
+        self.round = StockItem.objects.create(material=self.steel, section_type='round', diameter=60)
+        self.hexagon = StockItem.objects.create(material=self.steel, section_type='hexagon', key_size=24)
+
+    def section(self, material, stock_item, diameter=None):
+        return cutting.cutting_section(material.id, material.name, stock_item.id, stock_item.section_type, diameter)
+
+    def test_default_rules_match_previous_routing(self):
+        self.assertEqual(self.section(self.steel, self.sheet), 'sheet')
+        self.assertEqual(self.section(self.tool_steel, self.sheet), 'round')
+        self.assertEqual(self.section(self.steel, self.round, 58), 'round')
+        self.assertIsNone(self.section(self.steel, self.round, 50))
+        self.assertIsNone(self.section(self.steel, self.round))
+        self.assertIsNone(self.section(self.steel, self.hexagon))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.section(self.steel, self.round, 70), 'round')
+
+    def test_table_follows_rule_changes(self):
+        self.assertIsNone(self.section(self.steel, self.round, 40))
+        CuttingRoute.objects.filter(section_type='round').update(min_diameter=30)
+        self.assertIsNone(self.section(self.steel, self.round, 40))  # update() без сигналов
+        rule = CuttingRoute.objects.create(priority=5, section_type='hexagon', target_section='round')
+        self.assertEqual(self.section(self.steel, self.round, 40), 'round')
+        self.assertEqual(self.section(self.steel, self.hexagon), 'round')
+        rule.target_section = 'skip'
+        rule.save()
+        self.assertIsNone(self.section(self.steel, self.hexagon))
+
+
+class OrderSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.steel = Material.objects.create(name='Сталь 45', density='7.85')
+        self.tool_steel = Material.objects.create(name='4Х5МФС', density='7.80')
+        self.shaft = PartName.objects.create(name='Вал ведущий')
+        self.bushing = PartName.objects.create(name='Втулка')
+        self.pump = Order.objects.create(order_number='2024-15', order_name='Насос', user=self.user)
+        self.press = Order.objects.create(order_number='2024-16', order_name='Пресс вал', user=self.user)
+        self.shaft_item = OrderItem.objects.create(order=self.pump, sequence_number='1', part_name=self.shaft,
+                                                   material=self.steel, quantity=1, designation='НС.01.002')
+        OrderItem.objects.create(order=self.press, sequence_number='1', part_name=self.bushing,
+                                 material=self.tool_steel, quantity=1)
+
+    def found(self, text):
+        return self.client.get('/orders/', {'search': text}).context['orders']
+
+    def test_orders_found_by_items_and_ranked(self):
+        self.assertEqual(self.found('насос'), [self.pump])
+        self.assertEqual(self.found('нс.01'), [self.pump])
+        self.assertEqual(self.found('4х5мфс'), [self.press])
+        # Совпадение в наименовании заказа весит больше, чем в деталях
+        self.assertEqual(self.found('вал'), [self.press, self.pump])
+        self.assertEqual(self.found('"'), [])
+
+    def test_index_follows_changes(self):
+        self.shaft.name = 'Шестерня'
+        self.shaft.save()
+        self.assertEqual(self.found('шестерн'), [self.pump])
+        self.assertEqual(self.found('ведущий'), [])
+        OrderItem.objects.filter(pk=self.shaft_item.pk).update(material=self.tool_steel)
+        self.assertEqual(set(self.found('4Х5МФС')), {self.pump, self.press})
+        self.shaft_item.delete()
+        self.assertEqual(self.found('шестерня'), [])
+
+        response = self.client.get(f'/orders/{self.press.id}/', {'search': 'втул'})
+        self.assertEqual(len(response.context['items']), 1)
+        search.rebuild_index()
+        self.assertEqual(self.found('пресс'), [self.press])
+
+    def test_bulk_insert_rebuilds_order_document_once(self):
+        search.refresh_documents()
+        OrderItem.objects.bulk_create([
+            OrderItem(order=self.press, sequence_number=str(number), part_name=self.shaft, quantity=1,
+                      designation=f'ПР.{number}')
+            for number in range(2, 12)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT order_id FROM {search.DIRTY}')
+            self.assertEqual(cursor.fetchall(), [(self.press.id,)])
+        self.assertEqual(self.found('пр.11'), [self.press])
+        self.assertEqual(search.refresh_documents(), 0)
+
+
+class OrderFacetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123', last_name='Иванов')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_login(self.user)
+        steel = Material.objects.create(name='Сталь 45', density='7.85')
+        brass = Material.objects.create(name='ЛС59-1', density='8.45')
+        part = PartName.objects.create(name='Вал')
+        bar = StockItem.objects.create(material=steel, section_type='round', diameter=60)
+        sheet = StockItem.objects.create(material=brass, section_type='sheet', width=10)
+        self.orders = []
+        for number, user, coefficient, stock_items in (
+            ('1', self.user, '1.00', [bar]), ('2', self.user, '1.15', [bar, sheet]), ('3', self.other, '1.15', [sheet]),
+        ):
+            order = Order.objects.create(order_number=number, order_name='Заказ', user=user, coefficient=coefficient)
+            for sequence, stock_item in enumerate(stock_items, 1):
+                OrderItem.objects.create(order=order, sequence_number=str(sequence), part_name=part,
+                                         material=stock_item.material, stock_item=stock_item, quantity=1)
+            self.orders.append(order)
+        Order.objects.filter(pk=self.orders[0].pk).update(created_at=timezone.now() - timedelta(days=400))
+
+    def facet(self, response, name):
+        facet = next(f for f in response.context['facets'] if f['name'] == name)
+        return {value['label']: (value['count'], value['selected']) for value in facet['values']}
+
+    def test_counts_ignore_own_filter(self):
+        response = self.client.get('/orders/', {'section': 'sheet'})
+        self.assertEqual({o.order_number for o in response.context['orders']}, {'2', '3'})
+        self.assertEqual(self.facet(response, 'section'), {'Кругляк': (2, False), 'Лист': (2, True)})
+        self.assertEqual(self.facet(response, 'material'), {'ЛС59-1': (2, False), 'Сталь 45': (1, False)})
+        self.assertEqual(self.facet(response, 'user'), {'Иванов': (1, False), 'other': (1, False)})
+        self.assertEqual(self.facet(response, 'coefficient'), {Decimal('1.15'): (2, False)})
+
+        response = self.client.get('/orders/', {'section': 'sheet', 'coefficient': '1.15', 'user': self.user.id})
+        self.assertEqual([o.order_number for o in response.context['orders']], ['2'])
+
+    def test_date_range(self):
+        today = timezone.localdate()
+        response = self.client.get('/orders/', {'date_from': (today - timedelta(days=30)).isoformat(),
+                                                'date_to': today.isoformat()})
+        self.assertEqual({o.order_number for o in response.context['orders']}, {'2', '3'})
+        self.assertEqual(sum(count for count, _ in self.facet(response, 'date').values()), 3)
+
+    def test_invalid_values_are_ignored(self):
+        for params in ({'date_from': '2024-02-30'}, {'date_to': '2024-13-01'},
+                       {'coefficient': 'NaN'}, {'coefficient': 'Infinity'}, {'coefficient': '1e400'},
+                       {'user': str(2 ** 64)}, {'material': '9' * 40}, {'user': '²'}):
+            response = self.client.get('/orders/', params)
+            self.assertEqual(response.status_code, 200, params)
+            self.assertEqual(len(response.context['orders']), 3, params)
+        filters = facets.parse_filters({'coefficient': '1.15', 'user': str(2 ** 63 - 1)})
+        self.assertEqual((filters['coefficient'], filters['user']), (Decimal('1.15'), 2 ** 63 - 1))
+
+
+class OrderItemFragmentTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.material = Material.objects.create(name='Сталь 45', density=7.85)
+        self.part = PartName.objects.create(name='Вал')
+        self.round = StockItem.objects.create(material=self.material, section_type='round', diameter=40)
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user, order_quantity=2)
+        self.items = [
+            OrderItem.objects.create(order=self.order, sequence_number=str(number), part_name=self.part,
+                                     material=self.material, stock_item=self.round, quantity=3,
+                                     length=100, diameter=38)
+            for number in range(1, 6)
+        ]
+        self.ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+    def test_copy_returns_row_and_totals(self):
+        response = self.client.post(f'/orders/{self.order.id}/item/{self.items[0].id}/copy/', **self.ajax)
+        data = response.json()
+        new_item = self.order.items.get(id=data['item_id'])
+        self.assertIn(f'id="item-row-{new_item.id}"', data['html'])
+        self.assertNotIn('<table', data['html'])
+        self.assertEqual(data['source_id'], self.items[0].id)
+        self.assertEqual(data['totals']['items_count'], 6)
+        self.assertEqual(data['totals']['total_items_count'], '36')
+        self.assertEqual(data['totals']['total_weight'], weights.format_kg(self.order.total_weight_mg))
+
+    def test_delete_and_edit_query_count_does_not_depend_on_order_size(self):
+        url = f'/orders/{self.order.id}/item/{self.items[-1].id}/delete/'
+        with self.assertNumQueries(7):  # пользователь, снимок, заказ, деталь, DELETE, шаблон, итоги
+            data = self.client.post(url, **self.ajax).json()
+        self.assertEqual(data['totals']['items_count'], 4)
+        self.assertEqual(data['totals']['total_items_count'], '24')
+
+        item = self.items[0]
+        response = self.client.post(f'/orders/{self.order.id}/item/{item.id}/edit/', {
+            'sequence_number': '1', 'part_name': self.part.id, 'material': self.material.id,
+            'stock_item': self.round.id, 'quantity': 4, 'length': 100, 'diameter': 38,
+        }, **self.ajax)
+        data = response.json()
+        self.assertTrue(data['success'], data)
+        self.assertIn('<td class="text-center">4</td>', data['html'])
+        self.assertEqual(data['totals']['total_items_count'], '26')
+
+
+class OrderSequenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.part = PartName.objects.create(name='Вал')
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+
+    def create_item(self, number):
+        return OrderItem.objects.create(order=self.order, sequence_number=number, part_name=self.part,
+                                        quantity=1, is_special=True)
+
+    def test_counter_starts_after_existing_numbers_and_reserves_ranges(self):
+        self.create_item('1')
+        self.create_item('7-02')
+        self.assertEqual(OrderSequence.peek(self.order), 8)
+        self.assertEqual(list(OrderSequence.allocate(self.order, 3)), [8, 9, 10])
+        self.create_item('15')  # номер, введенный вручную, сдвигает счетчик
+        self.assertEqual(list(OrderSequence.allocate(self.order)), [16])
+
+    def test_copy_after_delete_does_not_duplicate_numbers(self):
+        first = self.create_item('1')
+        second = self.create_item('2')
+        OrderSequence.for_order(self.order)
+        second.delete()
+        self.client.get(f'/orders/{self.order.id}/item/{first.id}/copy/')
+        self.client.get(f'/orders/{self.order.id}/item/{first.id}/copy/')
+        self.assertEqual(sorted(self.order.items.values_list('sequence_number', flat=True)), ['1', '3', '4'])
+
+    def test_stale_suggestion_gets_next_free_number(self):
+        OrderSequence.for_order(self.order)
+        data = {'sequence_number': '1', 'suggested_sequence_number': '1', 'part_name': self.part.id,
+                'quantity': 1, 'is_special': 'on'}
+        self.client.post(f'/orders/{self.order.id}/add-item/', data)
+        self.client.post(f'/orders/{self.order.id}/add-item/', data)  # та же форма открыта у второго пользователя
+        self.assertEqual(sorted(self.order.items.values_list('sequence_number', flat=True)), ['1', '2'])
+
+
+class DatabaseBackupTests(TransactionTestCase):
+    # Копия снимается online backup API — вне транзакции теста
+    serialized_rollback = True
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_backup_is_checked_compressed_and_rotated(self):
+        paths = [backup.create_backup(self.directory, pages=2, sleep=0, keep=2)]
+        os.rename(paths[0], os.path.join(self.directory, 'db_2000-01-01_00-00-00.sqlite3.gz'))
+        backup.create_backup(self.directory, pages=2, sleep=0, keep=2, compress=False)
+        os.rename(backup.list_backups(self.directory)[0], os.path.join(self.directory, 'db_2000-01-02_00-00-00.sqlite3'))
+        latest = backup.create_backup(self.directory, pages=2, sleep=0, keep=2)
+        self.assertEqual([path.name for path in backup.list_backups(self.directory)],
+                         [latest.name, 'db_2000-01-02_00-00-00.sqlite3'])
+
+        with gzip.open(latest) as packed, open(os.path.join(self.directory, 'plain.sqlite3'), 'wb') as raw:
+            shutil.copyfileobj(packed, raw)
+        self.assertEqual(backup.check_integrity(raw.name), [])
+        connection = sqlite3.connect(raw.name)
+        self.assertEqual(connection.execute('SELECT order_number FROM calculator_order').fetchall(), [('1',)])
+        connection.close()
+
+    def test_restore(self):
+        path = backup.create_backup(self.directory, pages=2, sleep=0)
+        Order.objects.all().delete()
+        Order.objects.create(order_number='2', order_name='Заказ', user=self.user)
+        backup.restore_backup(path)
+        self.assertEqual(list(Order.objects.values_list('order_number', flat=True)), ['1'])
+        self.assertEqual(search.ranked_order_ids('1'), list(Order.objects.values_list('id', flat=True)))
+
+    def test_archive_is_copied_with_database(self):
+        order = Order.objects.get()
+        archive.archive_orders([order.id])
+        path = backup.create_backup(self.directory, pages=2, sleep=0)
+        self.assertTrue(backup.archive_copy(path).is_file())
+        archive.restore_orders([order.id])
+        backup.restore_backup(path)
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(archive.is_archived(order.id))
+        archive.restore_orders([order.id])  # архив тестовой базы в памяти общий для всех тестов
+
+    def test_damaged_backup_is_not_restored(self):
+        path = os.path.join(self.directory, 'db_broken.sqlite3')
+        with open(path, 'wb') as broken:
+            broken.write(b'SQLite format 3\x00' + b'\x00' * 200)
+        with self.assertRaises(backup.BackupError):
+            backup.restore_backup(path)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        material = Material.objects.create(name='Сталь 45', density='7.85')
+        part = PartName.objects.create(name='Вал')
+        self.stock_item = StockItem.objects.create(material=material, section_type='round', diameter=40)
+        self.old = Order.objects.create(order_number='2019-01', order_name='Насос', user=self.user)
+        self.reserved = Order.objects.create(order_number='2019-02', order_name='Пресс', user=self.user)
+        self.fresh = Order.objects.create(order_number='2024-01', order_name='Насос', user=self.user)
+        for order in (self.old, self.reserved, self.fresh):
+            OrderItem.objects.create(order=order, sequence_number='1', part_name=part, material=material,
+                                     stock_item=self.stock_item, quantity=2, length=100, diameter=38)
+        Order.objects.filter(pk__in=[self.old.pk, self.reserved.pk]).update(
+            created_at=timezone.now() - timedelta(days=1000))
+        StockReservation.objects.create(order=self.reserved, stock_item=self.stock_item, length_um=100000)
+        self.movement = StockMovement.objects.create(stock_item=self.stock_item, order=self.old, kind='consumption')
+        self.report = self.client.get(f'/orders/{self.old.id}/print/').content.decode()
+
+    def test_archive_search_print_and_restore(self):
+        moved = archive.archive_before(timezone.now() - timedelta(days=730))
+        self.assertEqual(moved, 1)  # заказ с резервом остается в работе
+        self.assertFalse(Order.objects.filter(pk=self.old.pk).exists())
+        self.assertFalse(OrderItem.objects.filter(order_id=self.old.pk).exists())
+        self.movement.refresh_from_db()
+        self.assertIsNone(self.movement.order_id)
+
+        self.assertEqual(self.client.get('/orders/', {'search': 'насос'}).context['archive_matches'], 1)
+        response = self.client.get('/orders/archive/', {'search': 'насос'})
+        self.assertEqual([order.id for order in response.context['orders']], [self.old.id])
+        self.assertRedirects(self.client.get(f'/orders/{self.old.id}/'), f'/orders/archive/{self.old.id}/')
+        response = self.client.get(f'/orders/archive/{self.old.id}/')
+        self.assertEqual(len(response.context['items']), 1)
+        self.assertEqual(self.client.get(f'/orders/archive/{self.old.id}/print/').content.decode(), self.report)
+
+        self.client.post(f'/orders/archive/{self.old.id}/restore/')
+        restored = Order.objects.get(pk=self.old.pk)
+        self.assertEqual(restored.items.count(), 1)
+        self.movement.refresh_from_db()
+        self.assertEqual(self.movement.order_id, self.old.id)
+        self.assertFalse(archive.is_archived(self.old.id))
+        response = self.client.get('/orders/', {'search': 'насос'})
+        self.assertEqual(set(response.context['orders']), {restored, self.fresh})
+        self.assertEqual(response.context['archive_matches'], 0)
+
+
+class OrderSnapshotTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.material = Material.objects.create(name='Сталь 45', density='7.85')
+        self.part = PartName.objects.create(name='Вал')
+        self.round = StockItem.objects.create(material=self.material, section_type='round', diameter=40)
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user, order_quantity=2)
+        self.item = OrderItem.objects.create(order=self.order, sequence_number='1', part_name=self.part,
+                                             material=self.material, stock_item=self.round, quantity=3,
+                                             length=100, diameter=38)
+        self.url = f'/orders/{self.order.id}/'
+
+    def test_finalized_order_served_from_snapshot(self):
+        reports = {name: self.client.get(f'{self.url}{name}/').content
+                   for name in ('print', 'print-grouped', 'print-cutting')}
+        total_weight = self.client.get(self.url).context['totals']['total_weight']
+        self.client.post(f'{self.url}finalize/')
+        snapshot = OrderSnapshot.objects.get(order=self.order)
+        self.assertEqual(snapshot.total_items_count, 6)
+        self.assertEqual(snapshot.items[0]['weight_mg'], self.item.weight_mg)
+
+        # Справочники изменились после выпуска — выпущенный заказ этого не видит
+        self.material.density = '8.50'
+        self.material.save()
+        self.part.name = 'Ось'
+        self.part.save()
+        with self.assertNumQueries(2):  # пользователь, заказ со снимком
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['totals']['total_weight'], total_weight)
+        self.assertContains(response, 'Вал')
+        for name, content in reports.items():
+            with self.assertNumQueries(2):
+                self.assertEqual(self.client.get(f'{self.url}{name}/').content.replace(b'\n', b''),
+                                 content.replace(b'\n', b''))
+
+    def test_finalized_order_is_read_only_until_reopened(self):
+        self.client.post(f'{self.url}finalize/')
+        response = self.client.post(f'{self.url}item/{self.item.id}/delete/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertEqual(response.status_code, 409)
+        self.client.post(f'{self.url}update-coefficient/', {'coefficient': '1.50'})
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.coefficient, Decimal('1.00'))
+        self.assertTrue(OrderItem.objects.filter(pk=self.item.pk).exists())
+
+        self.client.post(f'{self.url}reopen/')
+        self.assertFalse(OrderSnapshot.objects.filter(order=self.order).exists())
+        self.client.post(f'{self.url}item/{self.item.id}/delete/')
+        self.assertFalse(OrderItem.objects.filter(pk=self.item.pk).exists())
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.part = PartName.objects.create(name='Вал')
+        self.other_part = PartName.objects.create(name='Втулка')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+            self.items = [
+                OrderItem.objects.create(order=self.order, sequence_number=str(number), part_name=self.part,
+                                         quantity=1, is_special=True)
+                for number in (1, 2)
+            ]
+
+    def change(self, item, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            for name, value in fields.items():
+                setattr(item, name, value)
+            item.save()
+
+    def test_revisions_store_only_changed_fields(self):
+        self.change(self.items[0], quantity=5)
+        removed_id = self.items[1].id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.items[1].delete()
+        self.change(self.items[0], quantity=5)  # без изменений — редакции нет
+
+        revisions = list(OrderRevision.objects.filter(order=self.order).order_by('number'))
+        self.assertEqual([revision.number for revision in revisions], [1, 2, 3])
+        self.assertEqual(len(revisions[0].changes['added']), 2)
+        self.assertEqual(revisions[1].changes, {'changed': {str(self.items[0].id): {'quantity': 5}}})
+        self.assertEqual(revisions[2].changes, {'removed': [str(removed_id)]})
+        self.assertIsNotNone(revisions[0].state)
+        self.assertIsNone(revisions[1].state)
+
+        self.assertEqual(len(history.state_at(self.order.id, 1)['items']), 2)
+        self.assertEqual(history.state_at(self.order.id, 3), history.order_states([self.order.id])[self.order.id])
+
+        response = self.client.get(f'/orders/{self.order.id}/history/diff/', {'a': 1, 'b': 3})
+        diff = response.context['diff']
+        self.assertEqual(diff['removed'], ['№2 Вал'])
+        self.assertEqual(diff['changed'][0]['fields'], [{'label': 'Количество деталей', 'old': 1, 'new': 5}])
+        response = self.client.get(f'/orders/{self.order.id}/history/diff/', {'a': '9' * 30, 'b': '9' * 30})
+        self.assertEqual((response.context['old_number'], response.context['new_number']), (2, 3))
+
+    def test_reconstruction_reads_from_nearest_checkpoint(self):
+        item = self.items[0]
+        for quantity in range(2, 2 + history.CHECKPOINT_EVERY + 10):
+            self.change(item, quantity=quantity)
+        number = history.CHECKPOINT_EVERY + 5
+        with self.assertNumQueries(2):  # контрольная точка и изменения после нее
+            state = history.state_at(self.order.id, number)
+        self.assertEqual(state['items'][str(item.id)]['quantity'], number)
+
+class OrderCompareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.steel = Material.objects.create(name='Сталь 45', density=7.85)
+        self.shaft = PartName.objects.create(name='Вал')
+        self.bush = PartName.objects.create(name='Втулка')
+        self.plate = PartName.objects.create(name='Плита')
+        self.old = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+        self.new = Order.objects.create(order_number='2', order_name='Заказ', user=self.user)
+
+    def add(self, order, number, part, quantity=1, **fields):
+        return OrderItem.objects.create(order=order, sequence_number=number, part_name=part, material=self.steel,
+                                        quantity=quantity, length=100, width=50, height=10, **fields)
+
+    def test_lines_matched_across_renumbering(self):
+        self.add(self.old, '1', self.shaft)
+        self.add(self.old, '2', self.bush, quantity=2)
+        self.add(self.old, '3', self.plate)
+        self.add(self.new, '1', self.shaft)
+        self.add(self.new, '5', self.bush, quantity=3)  # перенумерована и изменено количество
+        added = self.add(self.new, '6', self.plate, designation='П-2')
+
+        response = self.client.get('/orders/compare/', {'a': self.old.id, 'b': self.new.id})
+        diff = response.context['diff']
+        self.assertEqual(diff['counts'], {'added': 1, 'removed': 1, 'changed': 1, 'unchanged': 1})
+        self.assertEqual(diff['added'][0]['id'], added.id)
+        self.assertEqual(diff['removed'][0]['sequence_number'], '3')
+        self.assertEqual([row['label'] for row in diff['changed'][0]['fields']],
+                         ['Порядковый номер', 'Количество деталей'])
+        self.assertEqual([row['label'] for row in diff['order']], ['Номер заказа'])
+
+        item_mg = OrderItem.objects.get(order=self.old, sequence_number='1').weight_mg
+        self.assertEqual(diff['changed'][0]['delta_mg'], item_mg)
+        material = diff['materials'][0]
+        self.assertEqual(material['name'], 'Сталь 45')
+        self.assertEqual(material['delta_mg'], item_mg)  # +1 втулка, плита заменена такой же
+        self.assertContains(response, 'Втулка')
+        huge = str(2 ** 64)
+        self.assertEqual(self.client.get('/orders/compare/', {'a': huge, 'b': self.new.id}).status_code, 404)
+        self.assertEqual(self.client.get('/orders/compare/', {'a': self.old.id, 'b': huge}).status_code, 404)
+
+    def test_order_compared_with_itself(self):
+        bar = StockItem.objects.create(material=self.steel, section_type='round', diameter=40)
+        self.add(self.old, '1', self.shaft, stock_item=bar)
+        self.add(self.old, '2', self.bush, quantity=2, stock_item=bar)
+        diff = comparison.compare_orders(self.old, self.old)
+        self.assertEqual(diff['counts'], {'added': 0, 'removed': 0, 'changed': 0, 'unchanged': 2})
+        self.assertEqual(diff['total']['delta_mg'], 0)
+        self.assertEqual([material['delta_mg'] for material in diff['materials']], [0])
+
+
+class OrderDuplicatesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.steel = Material.objects.create(name='Сталь 45', density=7.85)
+        self.shaft = PartName.objects.create(name='Вал')
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+        self.url = f'/orders/{self.order.id}/duplicates/'
+
+    def add(self, number, quantity, length='100', **fields):
+        return OrderItem.objects.create(order=self.order, sequence_number=number, part_name=self.shaft,
+                                        material=self.steel, quantity=quantity, diameter='20', length=length,
+                                        **fields)
+
+    def test_identical_lines_merged_into_first(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.add('1', 2)
+            self.add('3', 1, length='100.00')
+            self.add('10', 4, designation='')
+            other = self.add('2', 1, length='120')
+            special = self.add('4', 1, is_special=True)
+
+        response = self.client.get(self.url)
+        groups = response.context['groups']
+        self.assertEqual(len(groups), 1)
+        self.assertEqual(groups[0]['keeper']['id'], first.id)
+        self.assertEqual([row['sequence_number'] for row in groups[0]['duplicates']], ['3', '10'])
+        self.assertEqual(groups[0]['quantity'], 7)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'keep': [first.id]})
+        self.assertEqual(
+            sorted(self.order.items.values_list('id', 'quantity')),
+            sorted([(first.id, 7), (other.id, 1), (special.id, 1)]),
+        )
+        self.assertEqual(duplicates.find_duplicates(self.order.id), [])
+        changes = OrderRevision.objects.filter(order=self.order).latest('number').changes
+        self.assertEqual(len(changes['removed']), 2)
+        self.assertEqual(changes['changed'], {str(first.id): {'quantity': 7}})
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.steel = Material.objects.create(name='Сталь 45', density=7.85)
+        self.shaft = PartName.objects.create(name='Вал')
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+
+    def feed(self, since, **params):
+        return self.client.get('/api/changes/', {'since': since, **params}).json()
+
+    def test_cursor_returns_compact_batches(self):
+        start = self.feed(0)['next']
+        item = OrderItem.objects.create(order=self.order, sequence_number='1', part_name=self.shaft,
+                                        material=self.steel, quantity=1, diameter='20', length='100')
+        OrderItem.objects.filter(id=item.id).update(quantity=5)  # без сигналов — попадает через триггер
+        Material.objects.filter(id=self.steel.id).update(density='8.00')
+
+        batch = self.feed(start)
+        self.assertFalse(batch['more'])
+        self.assertEqual([(change['type'], change['id']) for change in batch['changes']],
+                         [('item', item.id), ('material', self.steel.id)])
+        self.assertEqual(batch['changes'][0]['data']['quantity'], 5)
+        self.assertEqual(batch['changes'][1]['data']['density'], '8.00')
+
+        item_id = item.id
+        item.delete()
+        batch = self.feed(batch['next'])
+        self.assertEqual(batch['changes'], [
+            {'seq': batch['next'], 'type': 'item', 'id': item_id, 'deleted': True, 'data': None},
+        ])
+        self.assertEqual(self.feed(batch['next'])['changes'], [])
+
+        first = self.feed(start, limit=1)
+        self.assertTrue(first['more'])
+        self.assertEqual(len(first['changes']), 1)
+        self.assertEqual(self.client.get('/api/changes/', {'since': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/changes/', {'since': str(2 ** 63)}).status_code, 400)
+
+    def test_prune_keeps_latest_entry_of_each_object(self):
+        item = OrderItem.objects.create(order=self.order, sequence_number='1', part_name=self.shaft,
+                                        material=self.steel, quantity=1, diameter='20', length='100')
+        OrderItem.objects.filter(id=item.id).update(quantity=5)
+        removed = OrderItem.objects.create(order=self.order, sequence_number='2', part_name=self.shaft,
+                                           material=self.steel, quantity=1, diameter='20', length='100')
+        removed_id = removed.id
+        removed.delete()
+        ChangeLog.objects.update(created_at=timezone.now() - timedelta(days=400))
+        self.steel.save()  # свежая запись остается при любом сроке
+
+        expected = {(change['type'], change['id']) for change in self.feed(0)['changes'] if not change['deleted']}
+        self.assertEqual(changefeed.prune(days=30), 4)  # первая запись item и steel, вставка и удаление removed
+        entries = list(ChangeLog.objects.values_list('kind', 'object_id'))
+        self.assertEqual(len(entries), len(set(entries)))
+        self.assertNotIn(('item', removed_id), entries)
+        self.assertEqual({(change['type'], change['id']) for change in self.feed(0)['changes']}, expected)
+
+
+class WebhookStub(BaseHTTPRequestHandler):
+    """Приемник уведомлений для тестов: запоминает тела запросов, отвечает кодом server.status"""
+
+    def do_POST(self):
+        self.server.received.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class WebhookTests(TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), WebhookStub)
+        self.server.received, self.server.status = [], 200
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        settings = override_settings(WEBHOOK_URL=f'http://127.0.0.1:{self.server.server_port}/events')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.order_name = 'Заказ 2'
+            self.order.save()
+        self.client.get(f'/orders/{self.order.id}/print-cutting/')  # открытие формы — еще не печать
+        self.client.post(f'/orders/{self.order.id}/print-cutting/printed/')
+
+    def test_events_delivered_in_one_batch(self):
+        self.assertEqual(webhooks.deliver_pending(), (3, 0))
+        [body] = self.server.received
+        self.assertEqual([event['event'] for event in body['events']],
+                         [webhooks.ORDER_CREATED, webhooks.ORDER_UPDATED, webhooks.CUTTING_TASK_PRINTED])
+        self.assertEqual(body['events'][1]['data']['changes']['order'], 1)
+        self.assertEqual(set(WebhookEvent.objects.values_list('status', flat=True)), {'delivered'})
+        self.assertEqual(webhooks.deliver_pending(), (0, 0))
+
+        self.assertEqual(self.client.post(f'/orders/{self.order.id + 1}/print-cutting/printed/').status_code, 404)
+        self.assertEqual(WebhookEvent.objects.count(), 3)
+
+    def test_failed_batch_retried_with_backoff(self):
+        self.server.status = 503
+        with self.assertLogs('calculator.webhooks', 'WARNING'):
+            self.assertEqual(webhooks.deliver_batch(), (0, 3))
+        event = WebhookEvent.objects.first()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        self.assertEqual(webhooks.deliver_batch(), (0, 0))  # повтор еще не наступил
+
+        self.server.status = 200
+        WebhookEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(webhooks.deliver_batch(), (3, 0))
+        self.assertEqual(WebhookEvent.objects.filter(status='delivered', attempts=2).count(), 3)
+
+        with override_settings(WEBHOOK_MAX_ATTEMPTS=1):
+            self.server.status = 500
+            self.client.post(f'/orders/{self.order.id}/print-cutting/printed/')
+            with self.assertLogs('calculator.webhooks', 'WARNING'):
+                webhooks.deliver_batch()
+        self.assertEqual(WebhookEvent.objects.filter(status='failed').count(), 1)
+
+
+@override_settings(JOB_INLINE_ITEMS=2)
+class BackgroundJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_login(self.user)
+        self.steel = Material.objects.create(name='Сталь 45', density=7.85)
+        part = PartName.objects.create(name='Вал')
+        rod = StockItem.objects.create(material=self.steel, section_type='round', diameter=40)
+        self.order = Order.objects.create(order_number='1', order_name='Заказ', user=self.user)
+        for number in range(1, 4):
+            OrderItem.objects.create(order=self.order, sequence_number=str(number), part_name=part,
+                                     material=self.steel, stock_item=rod, quantity=1, length='100')
+
+    def test_large_order_copied_by_job(self):
+        response = self.client.post(f'/orders/{self.order.id}/copy/', {'new_order_number': '2'})
+        job = Job.objects.get()
+        self.assertRedirects(response, f'/jobs/{job.id}/')
+        self.assertEqual(job.status, 'queued')
+        self.assertEqual(jobs.run_pending(), 1)
+
+        copy = Order.objects.get(order_number='2')
+        self.assertEqual(copy.user, self.user)
+        self.assertEqual(copy.items.count(), 3)
+        state = self.client.get(f'/jobs/{job.id}/status/').json()
+        self.assertEqual((state['status'], state['percent'], state['progress']), ('done', 100, 3))
+        self.assertEqual(state['url'], f'/orders/{copy.id}/')
+
+    def test_cancel_queued_and_running_jobs(self):
+        queued = jobs.submit('copy_order', self.user, order_id=self.order.id, order_number='2')
+        self.client.post(f'/jobs/{queued.id}/cancel/')
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(Job.objects.get(id=queued.id).status, 'cancelled')
+
+        running = jobs.submit('copy_order', self.user, order_id=self.order.id, order_number='3')
+        job = jobs.claim()
+        self.assertTrue(jobs.cancel(running.id))
+        self.assertEqual(jobs.run(job), 'cancelled')
+        self.assertFalse(Order.objects.filter(order_number='3').exists())  # неполная копия удалена
+
+    def test_density_change_refreshes_weights_in_background(self):
+        weight = OrderItem.objects.first().weight_mg
+        self.client.post(f'/materials/{self.steel.id}/edit/', {'name': 'Сталь 45', 'density': '15.70'})
+        job = Job.objects.get(name='refresh_weights')
+        self.assertEqual(OrderItem.objects.first().weight_mg, weight)
+        jobs.run_pending()
+        item = OrderItem.objects.first()
+        self.assertGreater(item.weight_mg, weight)
+        self.assertEqual(item.weight_mg, weights.item_weight_mg(item))
+        self.assertEqual(Job.objects.get(id=job.id).result['message'], 'Изменена масса деталей: 3')
+
+        # Ход выполнения сообщается после записи порции: учтенные детали уже пересчитаны
+        Material.objects.filter(id=self.steel.id).update(density='7.85')
+        written = []
+        weights.refresh_weights(OrderItem.objects.all(), batch_size=2, progress=lambda count: written.append(
+            (count, OrderItem.objects.filter(weight_mg=weight).count())))
+        self.assertEqual(written, [(2, 2), (1, 3)])
@@ -23,6 +23,10 @@ urlpatterns = [
     path('stock/create/', views.stock_create, name='stock_create'),
     path('stock/<int:pk>/edit/', views.stock_edit, name='stock_edit'),
     path('stock/<int:pk>/delete/', views.stock_delete, name='stock_delete'),
+    path('stock/<int:pk>/receipt/', views.stock_receipt, name='stock_receipt'),
+    path('stock/<int:pk>/movements/', views.stock_movements, name='stock_movements'),
+    path('stock/<int:pk>/remnants/', views.stock_remnants, name='stock_remnants'),
+    path('stock/remnants/<int:pk>/scrap/', views.remnant_scrap, name='remnant_scrap'),
     
     # Заказы
     path('orders/', views.order_list, name='order_list'),
@@ -38,18 +42,42 @@ urlpatterns = [
     path('clear-last-params/', views.clear_last_item_params, name='clear_last_params'),
     # Печатные формы - детальный отчет
     path('orders/<int:order_id>/print/', views.print_order_report, name='print_order_report'),
+    path('orders/<int:order_id>/finalize/', views.finalize_order, name='finalize_order'),
+    path('orders/<int:order_id>/reopen/', views.reopen_order, name='reopen_order'),
+    # История редакций и сравнение заказов
+    path('orders/<int:order_id>/history/', views.order_history, name='order_history'),
+    path('orders/<int:order_id>/history/diff/', views.order_revision_diff, name='order_revision_diff'),
+    path('orders/<int:order_id>/duplicates/', views.order_duplicates, name='order_duplicates'),
+    path('orders/compare/', views.order_compare, name='order_compare'),
     
     # Печатные формы - группированный отчет
     path('orders/<int:order_id>/print-grouped/', views.print_grouped_report, name='print_grouped_report'),
     #Печатные форма - задание на заготовку
     path('orders/<int:order_id>/print-cutting/', views.print_cutting_task, name='print_cutting_task'),
+    path('orders/<int:order_id>/print-cutting/printed/', views.cutting_task_printed, name='cutting_task_printed'),
+    path('orders/cutting-plan/', views.cutting_plan, name='cutting_plan'),
+
+    # Архив заказов
+    path('orders/archive/', views.archive_list, name='archive_list'),
+    path('orders/archive/<int:order_id>/', views.archived_order_detail, name='archived_order_detail'),
+    path('orders/archive/<int:order_id>/print/', views.archived_order_print, name='archived_order_print'),
+    path('orders/archive/<int:order_id>/restore/', views.archived_order_restore, name='archived_order_restore'),
+
+    # Складской учет по заказу
+    path('orders/<int:order_id>/stock/', views.order_stock, name='order_stock'),
+    path('orders/<int:order_id>/stock/<str:action>/', views.order_stock_action, name='order_stock_action'),
 
     path('orders/<int:order_id>/copy/', views.copy_order, name='copy_order'),
     path('orders/<int:order_id>/item/<int:item_id>/edit/', views.edit_order_item, name='edit_order_item'),
     path('api/stock-items-by-material/', views.get_stock_items_by_material_and_type, name='api_stock_items_by_material'),
     # API
     path('api/stock-items/', views.get_stock_items_by_material, name='api_stock_items'),
+    path('api/stock-items/best-fit/', views.best_fit_stock_items, name='api_best_fit_stock_items'),
     path('api/stock-items-by-material/', views.get_stock_items_by_material_and_type, name='api_stock_items_by_material'),
+    path('api/changes/', views.change_feed, name='change_feed'),
+    path('jobs/<int:job_id>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:job_id>/status/', views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/cancel/', views.job_cancel, name='job_cancel'),
     path('api/search-part-names/', views.search_part_names, name='search_part_names'),
     path('api/search-materials/', views.search_materials, name='search_materials'),
     path('api/create-part-name/', views.create_part_name, name='create_part_name'),
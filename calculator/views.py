@@ -1,17 +1,31 @@
+import json
+from datetime import timedelta
+from functools import wraps
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
+from django.conf import settings
 from django.contrib import messages
 from django.db import transaction, IntegrityError
 from django.utils import timezone 
-from django.db.models import Count, Sum
-from django.http import JsonResponse, HttpResponseForbidden
-from .models import Material, PartName, StockItem, Order, OrderItem
+from django.db.models import Count, Q, Sum
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseForbidden
+from .models import (Material, PartName, StockItem, StockBalance, StockRemnant, Order, OrderItem,
+                     Job, OrderItemTemplate, OrderSequence, OrderSnapshot)
+from . import archive, changefeed, comparison, cutting, duplicates, facets, history, inventory, jobs, remnants, search, stock_index, webhooks, weights
 from .forms import (LoginForm, MaterialForm, PartNameForm, StockItemForm, 
-                   OrderForm, OrderItemForm, OrderCoefficientForm, OrderQuantityForm)
+                   StockReceiptForm, RemnantForm, OrderForm, OrderItemForm, OrderCoefficientForm, OrderQuantityForm)
 from django.db import models
 from django.db.models.functions import Lower
 
+# Параметры последней добавленной детали хранятся в подписанной cookie,
+# а не в сессии: иначе каждая новая строка заказа — лишний UPDATE django_session
+LAST_ITEM_PARAMS_COOKIE = 'last_item_params'
+LAST_ITEM_PARAMS_SALT = 'calculator.last_item_params'
+LAST_ITEM_PARAMS_MAX_AGE = 30 * 24 * 60 * 60
+
 def login_view(request):
     if request.method == 'POST':
         form = LoginForm(data=request.POST)
@@ -66,8 +80,10 @@ def material_edit(request, pk):
     if request.method == 'POST':
         form = MaterialForm(request.POST, instance=material)
         if form.is_valid():
-            form.save()
+            material = form.save()
             messages.success(request, 'Материал успешно обновлен')
+            if getattr(material, 'job', None):
+                return redirect('job_detail', job_id=material.job.id)
             return redirect('material_list')
     else:
         form = MaterialForm(instance=material)
@@ -148,9 +164,86 @@ def part_delete(request, pk):
 # Справочник сортамента на складе
 @login_required
 def stock_list(request):
-    stock_items = StockItem.objects.all().order_by('material__name', 'section_type')
+    stock_items = (StockItem.objects.select_related('material', 'balance')
+                   .order_by('material__name', 'section_type'))
     return render(request, 'calculator/stock_list.html', {'stock_items': stock_items})
 
+@login_required
+def stock_receipt(request, pk):
+    """Поступление сортамента на склад"""
+    stock_item = get_object_or_404(StockItem.objects.select_related('material'), pk=pk)
+    if request.method == 'POST':
+        form = StockReceiptForm(request.POST, stock_item=stock_item)
+        if form.is_valid():
+            try:
+                inventory.receive(
+                    stock_item, form.cleaned_data['length_mm'], form.cleaned_data['mass_kg'],
+                    user=request.user, comment=form.cleaned_data['comment'],
+                )
+            except inventory.InventoryError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, f'Поступление сортамента {stock_item} учтено')
+                return redirect('stock_movements', pk=stock_item.pk)
+    else:
+        form = StockReceiptForm(stock_item=stock_item)
+    return render(request, 'calculator/stock_receipt_form.html', {'form': form, 'stock_item': stock_item})
+
+@login_required
+def stock_movements(request, pk):
+    """Остаток и журнал движения сортамента"""
+    stock_item = get_object_or_404(StockItem.objects.select_related('material'), pk=pk)
+    balance = StockBalance.objects.filter(stock_item=stock_item).first()
+    movements = stock_item.movements.select_related('order', 'user')[:200]
+    return render(request, 'calculator/stock_movements.html', {
+        'stock_item': stock_item,
+        'balance': balance,
+        'movements': movements,
+    })
+
+@login_required
+def stock_remnants(request, pk):
+    """Деловые остатки сортамента: регистрация и подбор под размер заготовки"""
+    stock_item = get_object_or_404(StockItem.objects.select_related('material'), pk=pk)
+    if request.method == 'POST':
+        form = RemnantForm(request.POST, stock_item=stock_item)
+        if form.is_valid():
+            remnant = StockRemnant.objects.create(
+                stock_item=stock_item,
+                length_um=weights.to_um(form.cleaned_data['length_mm']),
+                width_um=weights.to_um(form.cleaned_data.get('width_mm') or 0),
+                comment=form.cleaned_data['comment'],
+            )
+            messages.success(request, f'Остаток №{remnant.pk} зарегистрирован')
+            return redirect('stock_remnants', pk=stock_item.pk)
+    else:
+        form = RemnantForm(stock_item=stock_item)
+
+    search_length = stock_index.parse_size(request.GET.get('length'))
+    search_width = stock_index.parse_size(request.GET.get('width'))
+    if search_length:
+        remnant_list = remnants.find_remnants(stock_item, search_length, search_width, limit=20)
+    else:
+        remnant_list = stock_item.remnants.filter(status='available').select_related('source_order')
+    return render(request, 'calculator/stock_remnants.html', {
+        'stock_item': stock_item,
+        'form': form,
+        'remnants': remnant_list,
+        'search_length': search_length,
+        'search_width': search_width,
+    })
+
+@login_required
+def remnant_scrap(request, pk):
+    """Списание делового остатка в лом"""
+    remnant = get_object_or_404(StockRemnant, pk=pk)
+    if request.method == 'POST':
+        if StockRemnant.objects.filter(pk=pk, status='available').update(status='scrapped'):
+            messages.success(request, f'Остаток №{remnant.pk} списан в лом')
+        else:
+            messages.warning(request, f'Остаток №{remnant.pk} уже недоступен: {remnant.get_status_display().lower()}')
+    return redirect('stock_remnants', pk=remnant.stock_item_id)
+
 @login_required
 def stock_create(request):
     if request.method == 'POST':
@@ -169,8 +262,10 @@ def stock_edit(request, pk):
     if request.method == 'POST':
         form = StockItemForm(request.POST, instance=stock_item)
         if form.is_valid():
-            form.save()
+            stock_item = form.save()
             messages.success(request, 'Сортамент успешно обновлен')
+            if getattr(stock_item, 'job', None):
+                return redirect('job_detail', job_id=stock_item.job.id)
             return redirect('stock_list')
     else:
         form = StockItemForm(instance=stock_item)
@@ -191,32 +286,117 @@ def order_list(request):
     # Все пользователи видят все заказы
     orders = Order.objects.all()
     
-    # Поиск
+    # Полнотекстовый поиск (search.py): номер, наименование, чертеж, детали, обозначения, материалы
     search_query = request.GET.get('search', '')
+    ranking = None
     if search_query:
-        orders = orders.filter(
-            models.Q(order_number__icontains=search_query) |
-            models.Q(order_name__icontains=search_query) |
-            models.Q(drawing_number__icontains=search_query)
-        )
+        if search.match_query(search_query) is None:
+            orders = orders.none()
+        else:
+            search.refresh_documents()
+            orders = orders.filter(id__in=search.order_ids_sql(search_query))
+            ranking = {order_id: position for position, order_id in enumerate(search.ranked_order_ids(search_query))}
     
-    # Сортировка по дате создания (сначала новые)
+    # Фасетные фильтры; счетчики — по найденным заказам с учетом остальных фильтров
+    filters = facets.parse_filters(request.GET)
+    facet_list = facets.build_facets(orders, filters, request.GET)
+    orders = facets.apply_filters(orders, filters)
+    
+    # Сортировка по дате создания (сначала новые), при поиске — по релевантности
     orders = orders.order_by('-created_at')
     
+    # Статистика по деталям всех заказов одним сгруппированным запросом
+    items = OrderItem.objects.filter(order__in=orders)
+    item_stats = {
+        row['order_id']: row
+        for row in items.values('order_id').order_by().annotate(
+            positions=Count('id'),
+            materials=Count('material', distinct=True),
+            quantity=Sum('quantity'),
+        )
+    }
+    orders = list(orders.select_related('user', 'user__profile'))
+    if ranking is not None:
+        orders.sort(key=lambda order: ranking.get(order.id, len(ranking)))
+    # Веса — тем же целочисленным расчетом, что и на странице заказа
+    weights_mg = weights.order_totals_mg(items)
+    total_weight_mg = 0
+    for order in orders:
+        stats = item_stats.get(order.id, {})
+        order.positions_count = stats.get('positions', 0)
+        order.materials_total = stats.get('materials', 0)
+        order.items_total = (stats.get('quantity') or 0) * order.order_quantity
+        order_weight_mg = weights_mg.get(order.id, 0) * order.order_quantity
+        order.weight_kg = weights.mg_to_kg(order_weight_mg)
+        total_weight_mg += order_weight_mg
+    
     # Подсчет статистики
-    total_orders = orders.count()
-    total_weight = sum(order.total_weight for order in orders)
-    total_items = sum(order.total_items_count for order in orders)
+    total_orders = len(orders)
+    total_weight = weights.mg_to_kg(total_weight_mg)
+    total_items = sum(order.items_total for order in orders)
     
     context = {
         'orders': orders,
         'search_query': search_query,
+        'archive_matches': archive.count_matches(search_query) if search_query else 0,
+        'facets': facet_list,
+        'filters': filters,
+        'has_filters': any(value is not None for value in filters.values()),
+        'reset_filters_url': facets.reset_url(request.GET),
         'total_orders': total_orders,
         'total_weight': total_weight,
         'total_items': total_items,
     }
     return render(request, 'calculator/order_list.html', context)
 
+# Архив заказов (только чтение)
+@login_required
+def archive_list(request):
+    """Заказы, перенесенные в архив, с полнотекстовым поиском"""
+    search_query = request.GET.get('search', '')
+    return render(request, 'calculator/archive_list.html', {
+        'orders': archive.find_orders(search_query),
+        'search_query': search_query,
+    })
+
+def load_archived_order(order_id):
+    order, items = archive.load_order(order_id)
+    if order is None:
+        raise Http404('Заказ не найден в архиве')
+    return order, items
+
+@login_required
+def archived_order_detail(request, order_id):
+    """Архивный заказ: детали без возможности изменения"""
+    if Order.objects.filter(id=order_id).exists():
+        return redirect('order_detail', order_id=order_id)
+    order, items = load_archived_order(order_id)
+    total_weight_mg = sum(item.total_weight_mg for item in items) * order.order_quantity
+    return render(request, 'calculator/archived_order.html', {
+        'order': order,
+        'items': items,
+        'total_weight': weights.mg_to_kg(total_weight_mg),
+        'total_items_count': sum(item.quantity for item in items) * order.order_quantity,
+    })
+
+@login_required
+def archived_order_print(request, order_id):
+    """Детальный отчет по архивному заказу"""
+    frozen = archive.load_report(order_id, 'report')
+    if frozen is not None:
+        return HttpResponse(frozen)
+    order, items = load_archived_order(order_id)
+    return render_order_report(request, order, items)
+
+@login_required
+def archived_order_restore(request, order_id):
+    """Возвращает заказ из архива в работу"""
+    if request.method == 'POST':
+        if archive.restore_orders([order_id]):
+            messages.success(request, 'Заказ возвращен из архива')
+        return redirect('order_detail', order_id=order_id)
+    return redirect('archived_order_detail', order_id=order_id)
+
 @login_required
 @transaction.atomic
 def order_create(request):
@@ -235,19 +415,33 @@ def order_create(request):
 @login_required
 def order_detail(request, order_id):
     """Детали заказа с поиском по наименованию детали"""
-    order = get_object_or_404(Order, id=order_id)
+    try:
+        # Печатные формы снимка карточке не нужны — не читаются
+        order = (Order.objects.select_related('snapshot', 'user__profile').defer('snapshot__reports')
+                 .get(id=order_id))
+    except Order.DoesNotExist:
+        # Заказ перенесен в архив — открывается только для чтения
+        if archive.is_archived(order_id):
+            return redirect('archived_order_detail', order_id=order_id)
+        raise Http404('Заказ не найден')
+    search_query = request.GET.get('search', '')
+    sort_by = request.GET.get('sort', 'sequence_number')
+    snapshot = getattr(order, 'snapshot', None)
+    if snapshot is not None:
+        return frozen_order_detail(request, order, snapshot, search_query, sort_by)
     items = order.items.all().select_related('part_name', 'material', 'stock_item')
     
-    # Поиск по наименованию детали
-    search_query = request.GET.get('search', '')
+    # Поиск по наименованию детали, обозначению и материалу (индекс FTS5)
     if search_query:
-        items = items.filter(part_name__name__icontains=search_query)
+        if search.match_query(search_query) is None:
+            items = items.none()
+        else:
+            items = items.filter(id__in=search.item_ids_sql(search_query, order.id))
     
     # Преобразуем в список для кастомной сортировки
     items_list = list(items)
     
     # Сортировка с учетом числовых значений
-    sort_by = request.GET.get('sort', 'sequence_number')
     if sort_by == 'sequence_number':
         # Кастомная сортировка по числовому значению
         items_list.sort(key=lambda x: x.sort_key)
@@ -258,26 +452,107 @@ def order_detail(request, order_id):
     elif sort_by == 'quantity':
         items_list.sort(key=lambda x: (x.quantity, x.part_name.name, x.sort_key))
     
+    summary = order.summary()
     return render(request, 'calculator/order_detail.html', {
         'order': order, 
         'items': items_list,
+        'totals': {
+            'items_count': summary['items_count'],
+            'total_items_count': summary['total_items_count'],
+            'total_weight': weights.mg_to_kg(summary['total_weight_mg']),
+        },
         'search_query': search_query,
         'sort_by': sort_by
     })
 
+# Сортировка строк снимка выпущенного заказа (те же варианты, что у order_detail)
+SNAPSHOT_SORT_KEYS = {
+    'sequence_number': lambda x: x['sort_key'],
+    'part_name__name': lambda x: (x['part_name'], x['sort_key']),
+    'material__name': lambda x: (x['material'], x['part_name'], x['sort_key']),
+    'quantity': lambda x: (x['quantity'], x['part_name'], x['sort_key']),
+}
+
+def frozen_order_detail(request, order, snapshot, search_query, sort_by):
+    """Карточка выпущенного заказа: строки и итоги из снимка, без пересчета"""
+    items_list = snapshot.items
+    if search_query:
+        if search.match_query(search_query) is None:
+            found = set()
+        else:
+            found = set(OrderItem.objects.filter(id__in=search.item_ids_sql(search_query, order.id))
+                        .values_list('id', flat=True))
+        items_list = [entry for entry in items_list if entry['id'] in found]
+    if sort_by in SNAPSHOT_SORT_KEYS:
+        items_list = sorted(items_list, key=SNAPSHOT_SORT_KEYS[sort_by])
+    return render(request, 'calculator/order_detail.html', {
+        'order': order,
+        'snapshot': snapshot,
+        'items': items_list,
+        'totals': {
+            'items_count': snapshot.items_count,
+            'total_items_count': snapshot.total_items_count,
+            'total_weight': snapshot.total_weight,
+        },
+        'can_reopen': request.user.is_staff or snapshot.user_id == request.user.id,
+        'search_query': search_query,
+        'sort_by': sort_by,
+    })
+
+def is_fragment_request(request):
+    """Запрос со страницы заказа, ожидающий фрагмент вместо перенаправления"""
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+def editable_order(view):
+    """Выпущенный в производство заказ (есть OrderSnapshot) изменять нельзя"""
+    @wraps(view)
+    def wrapper(request, order_id, *args, **kwargs):
+        if OrderSnapshot.objects.filter(order_id=order_id).exists():
+            message = 'Заказ выпущен в производство — изменения запрещены'
+            if is_fragment_request(request):
+                return JsonResponse({'success': False, 'error': message}, status=409)
+            messages.error(request, message)
+            return redirect('order_detail', order_id=order_id)
+        return view(request, order_id, *args, **kwargs)
+    return wrapper
+
+def order_totals(order):
+    """Итоги заказа для обновления страницы без перезагрузки"""
+    summary = order.summary()
+    return {
+        'items_count': summary['items_count'],
+        'total_items_count': str(summary['total_items_count']),
+        'total_weight': weights.format_kg(summary['total_weight_mg']),
+    }
+
+def item_fragment(request, order, item_id, **extra):
+    """Ответ с HTML одной строки таблицы деталей и итогами заказа"""
+    item = OrderItem.objects.select_related('part_name', 'material', 'stock_item').get(id=item_id)
+    item.order = order
+    html = render_to_string('calculator/order_item_row.html', {'item': item, 'order': order}, request=request)
+    totals = order_totals(order)
+    return JsonResponse({
+        'success': True, 'item_id': item.id, 'html': html, 'totals': totals,
+        'next_sequence_number': str(OrderSequence.peek(order, fresh=True)), **extra,
+    })
+
 @login_required
+@editable_order
 def delete_order_item(request, order_id, item_id):
     order = get_object_or_404(Order, id=order_id)
     item = get_object_or_404(OrderItem, id=item_id, order=order)
     
     if request.method == 'POST':
         item.delete()
+        if is_fragment_request(request):
+            return JsonResponse({'success': True, 'item_id': item_id, 'totals': order_totals(order)})
         messages.success(request, 'Деталь удалена из заказа')
         return redirect('order_detail', order_id=order.id)
     
     return render(request, 'calculator/order_item_confirm_delete.html', {'item': item, 'order': order})
 
 @login_required
+@editable_order
 @transaction.atomic
 def copy_order_item(request, order_id, item_id):
     """Копирование детали в заказе"""
@@ -285,7 +560,7 @@ def copy_order_item(request, order_id, item_id):
     item = get_object_or_404(OrderItem, id=item_id, order=order)
     
     try:
-        next_number = str(order.items.count() + 1)
+        next_number = str(OrderSequence.allocate(order)[0])
         new_item = OrderItem(
             order=order,
             part_name=item.part_name,
@@ -301,17 +576,25 @@ def copy_order_item(request, order_id, item_id):
             key_size=item.key_size,
         )
         new_item.save()
+        if is_fragment_request(request):
+            return item_fragment(request, order, new_item.id, source_id=item.id)
         messages.success(request, f'Деталь №{item.sequence_number} скопирована как №{next_number}')
     except Exception as e:
+        if is_fragment_request(request):
+            return JsonResponse({'success': False, 'error': f'Не удалось скопировать деталь: {e}'})
         messages.error(request, f'Не удалось скопировать деталь: {e}')
     
     return redirect('order_detail', order_id=order.id)
 @login_required
+@editable_order
 def delete_order(request, order_id):
     order = get_object_or_404(Order, id=order_id)
     
     if request.method == 'POST':
-        order.delete()
+        with transaction.atomic():
+            # Резерв снимается движением по журналу: после удаления ссылка на заказ в нем обнуляется
+            inventory.release_order(order, user=request.user, comment=f'Удаление заказа №{order.order_number}')
+            order.delete()
         messages.success(request, 'Заказ успешно удален')
         return redirect('order_list')
     
@@ -323,7 +606,10 @@ def get_stock_items_by_material(request):
     material_id = request.GET.get('material_id')
     section_type = request.GET.get('section_type')
     
-    stock_items = StockItem.objects.filter(quantity__gt=0).order_by('material__name', 'section_type', 'width', 'diameter', 'key_size')
+    # Только сортамент со свободным остатком (индекс по available_length_um)
+    stock_items = (StockItem.objects.select_related('material', 'balance')
+                   .filter(balance__available_length_um__gt=0)
+                   .order_by('material__name', 'section_type', 'width', 'diameter', 'key_size'))
     
     if material_id:
         stock_items = stock_items.filter(material_id=material_id)
@@ -333,34 +619,82 @@ def get_stock_items_by_material(request):
     data = [{
         'id': item.id,
         'text': str(item),
-        'section_type': item.section_type
+        'section_type': item.section_type,
+        'available_length_mm': str(weights.um_to_mm(item.balance.available_length_um)),
     } for item in stock_items]
     
     return JsonResponse({'results': data})
 
+@login_required
+def best_fit_stock_items(request):
+    """API подбора сортамента: наименьшие заготовки не меньше размера детали с припуском"""
+    material_id = request.GET.get('material_id')
+    section_type = request.GET.get('section_type')
+    size = stock_index.parse_size(request.GET.get('size'))
+    if not material_id or not material_id.isdigit() or section_type not in stock_index.STOCK_SIZE_FIELDS or size is None:
+        return JsonResponse({'success': False, 'error': 'Укажите материал, тип сортамента и размер детали'}, status=400)
+    
+    allowance = stock_index.parse_size(request.GET.get('allowance'))
+    try:
+        limit = min(max(int(request.GET.get('limit', 3)), 1), 20)
+    except ValueError:
+        limit = 3
+    stocks = stock_index.best_fit(material_id, section_type, size, allowance=allowance, limit=limit)
+    size_field = stock_index.STOCK_SIZE_FIELDS[section_type]
+    data = [{
+        'id': stock['id'],
+        'text': stock_index.stock_label(stock),
+        'section_type': stock['section_type'],
+        'size': str(stock[size_field]),
+    } for stock in stocks]
+    return JsonResponse({'success': True, 'results': data})
+
 @login_required
 def print_order_report(request, order_id):
     """Печатная форма - детальный отчет"""
+    frozen = snapshot_report(order_id, 'report')
+    if frozen is not None:
+        return frozen
     order = get_object_or_404(Order, id=order_id)
-    items = order.items.all().select_related('part_name', 'material', 'stock_item')
-    
-    items_list = list(items)
+    return render_order_report(request, order, report_items(order))
+
+
+def report_items(order):
+    """Детали заказа для печатных форм, по номеру"""
+    items_list = list(order.items.all().select_related('part_name', 'material', 'stock_item'))
     items_list.sort(key=lambda x: (x.sort_key, x.part_name.name))
+    return items_list
+
+
+def snapshot_report(order_id, name):
+    """Печатная форма выпущенного заказа из снимка; None — заказ не выпущен"""
+    reports = OrderSnapshot.objects.filter(order_id=order_id).values_list('reports', flat=True).first()
+    if reports is None:
+        return None
+    return HttpResponse(reports[name])
+
+
+def order_report_context(order, items_list):
+    total_weight_kg = weights.mg_to_kg(
+        sum(item.total_weight_mg for item in items_list) * order.order_quantity
+    )
     
-    total_weight_kg = order.total_weight
-    
-    context = {
+    return {
         'order': order,
         'items': items_list,
         'total_weight_kg': total_weight_kg,
         'date': timezone.now().strftime('%d.%m.%Y'),
         'user': order.user
     }
-    
-    return render(request, 'calculator/print_order_report.html', context)
+
+
+def render_order_report(request, order, items_list):
+    """Детальный отчет по заказу (в том числе архивному)"""
+    return render(request, 'calculator/print_order_report.html', order_report_context(order, items_list))
 
 
 @login_required
+@editable_order
 @transaction.atomic
 def update_order_coefficient(request, order_id):
     """Обновление коэффициента массы (любой пользователь может менять)"""
@@ -376,7 +710,7 @@ def update_order_coefficient(request, order_id):
                     'success': True,
                     'coefficient': str(order.coefficient),
                     'order_quantity': str(order.order_quantity),
-                    'total_weight': f'{order.total_weight:.3f}',
+                    'total_weight': weights.format_kg(order.total_weight_mg),
                     'total_items_count': str(order.total_items_count)
                 })
         else:
@@ -387,6 +721,7 @@ def update_order_coefficient(request, order_id):
 
 
 @login_required
+@editable_order
 @transaction.atomic
 def update_order_quantity(request, order_id):
     """Обновление количества заказов (любой пользователь может менять)"""
@@ -403,7 +738,7 @@ def update_order_quantity(request, order_id):
                     'success': True,
                     'coefficient': str(order.coefficient),
                     'order_quantity': str(order.order_quantity),
-                    'total_weight': f'{order.total_weight:.3f}',
+                    'total_weight': weights.format_kg(order.total_weight_mg),
                     'total_items_count': str(order.total_items_count)
                 })
         else:
@@ -414,6 +749,7 @@ def update_order_quantity(request, order_id):
     return redirect('order_detail', order_id=order.id)
 
 @login_required
+@editable_order
 @transaction.atomic
 def update_order_drawing_number(request, order_id):
     order = get_object_or_404(Order, id=order_id)
@@ -428,11 +764,17 @@ def update_order_drawing_number(request, order_id):
 @login_required
 def print_grouped_report(request, order_id):
     """Печатная форма - группированный отчет"""
+    frozen = snapshot_report(order_id, 'grouped')
+    if frozen is not None:
+        return frozen
     order = get_object_or_404(Order, id=order_id)
-    items = order.items.all().select_related('part_name', 'material', 'stock_item')
-    
-    items_list = list(items)
-    items_list.sort(key=lambda x: (x.material.name if x.material else 'zzz', str(x.stock_item) if x.stock_item else '', x.part_name.name, x.sort_key))
+    context = grouped_report_context(order, report_items(order))
+    return render(request, 'calculator/print_grouped_report.html', context)
+
+
+def grouped_report_context(order, items_list):
+    """Детали, сгруппированные по материалу и сортаменту, с итогами групп"""
+    items_list = sorted(items_list, key=lambda x: (x.material.name if x.material else 'zzz', str(x.stock_item) if x.stock_item else '', x.part_name.name, x.sort_key))
     
     # Группируем по материалу и сортаменту
     grouped_data = {}
@@ -442,7 +784,7 @@ def print_grouped_report(request, order_id):
             grouped_data[key] = {
                 'material': item.material,
                 'stock_item': item.stock_item,
-                'total_weight': 0,
+                'total_weight_mg': 0,
                 'quantity': 0,
                 'weight_per_item': item.weight,
                 'items': [],
@@ -453,10 +795,13 @@ def print_grouped_report(request, order_id):
             }
         if not item.is_special and item.use_iz_prefix:
             grouped_data[key]['use_iz_prefix'] = True
-        grouped_data[key]['total_weight'] += item.total_weight * order.order_quantity
+        grouped_data[key]['total_weight_mg'] += item.total_weight_mg * order.order_quantity
         grouped_data[key]['quantity'] += item.quantity * order.order_quantity
         grouped_data[key]['items'].append(item)
     
+    for group in grouped_data.values():
+        group['total_weight'] = weights.mg_to_kg(group['total_weight_mg'])
+    
     # Сортируем группы
     grouped_list = sorted(
         grouped_data.values(),
@@ -466,68 +811,267 @@ def print_grouped_report(request, order_id):
         ),
     )
     
-    total_weight_kg = order.total_weight
+    total_weight_kg = weights.mg_to_kg(sum(group['total_weight_mg'] for group in grouped_list))
     
-    context = {
+    return {
         'order': order,
         'grouped_items': grouped_list,
         'total_weight_kg': total_weight_kg,
         'date': timezone.now().strftime('%d.%m.%Y'),
         'user': order.user
     }
-    
-    return render(request, 'calculator/print_grouped_report.html', context)
 
 
+@login_required
+@editable_order
+@transaction.atomic
+def finalize_order(request, order_id):
+    """Выпуск заказа в производство: расчет и печатные формы сохраняются в снимок"""
+    order = get_object_or_404(Order.objects.select_related('user'), id=order_id)
+    if request.method == 'POST':
+        items = report_items(order)
+        for item in items:
+            item.order = order
+        rows = {
+            item.id: render_to_string('calculator/order_item_row.html', {'item': item, 'order': order, 'frozen': True})
+            for item in items
+        }
+        grouped = grouped_report_context(order, items)
+        reports = {
+            'report': render_to_string('calculator/print_order_report.html', order_report_context(order, items),
+                                       request=request),
+            'grouped': render_to_string('calculator/print_grouped_report.html', grouped, request=request),
+            'cutting': render_to_string('calculator/print_cutting_task.html', cutting_task_context(order, items),
+                                        request=request),
+        }
+        groups = [{
+            'material': group['material'].name if group['material'] else '',
+            'stock_item': str(group['stock_item']) if group['stock_item'] else '',
+            'quantity': group['quantity'],
+            'total_weight_mg': group['total_weight_mg'],
+        } for group in grouped['grouped_items']]
+        OrderSnapshot.freeze(order, items, rows, groups, reports, user=request.user)
+        messages.success(request, 'Заказ выпущен в производство, расчет зафиксирован')
+    return redirect('order_detail', order_id=order.id)
+
+@login_required
+def reopen_order(request, order_id):
+    """Возврат выпущенного заказа в работу (снимок удаляется)"""
+    snapshot = get_object_or_404(OrderSnapshot, order_id=order_id)
+    if request.method == 'POST':
+        if not (request.user.is_staff or snapshot.user_id == request.user.id):
+            return HttpResponseForbidden()
+        snapshot.delete()
+        messages.success(request, 'Заказ возвращен в работу, расчет снова выполняется по справочникам')
+    return redirect('order_detail', order_id=order_id)
+
+def parse_int(value):
+    """Целое из параметра запроса; None — не число или вне диапазона id (такой объект не найдется)"""
+    return facets.parse_id(value)
+
+@login_required
+def order_history(request, order_id):
+    """Журнал редакций заказа"""
+    order = get_object_or_404(Order, id=order_id)
+    revisions = list(order.revisions.select_related('user').defer('state').order_by('-number')[:200])
+    for revision in revisions:
+        revision.summary = history.summarize(revision.changes)
+    return render(request, 'calculator/order_history.html', {'order': order, 'revisions': revisions})
+
+@login_required
+def order_revision_diff(request, order_id):
+    """Различия между двумя редакциями заказа (по умолчанию — последняя и предыдущая)"""
+    order = get_object_or_404(Order.objects.select_related('history'), id=order_id)
+    last_number = order.history.last_number if hasattr(order, 'history') else 0
+    if not last_number:
+        messages.info(request, 'У заказа еще нет записанных редакций')
+        return redirect('order_history', order_id=order.id)
+    new_number = min(parse_int(request.GET.get('b')) or last_number, last_number)
+    old_number = parse_int(request.GET.get('a'))
+    old_number = min(new_number - 1 if old_number is None else old_number, last_number)
+    diff = history.compare(history.state_at(order.id, old_number), history.state_at(order.id, new_number))
+    return render(request, 'calculator/order_diff.html', {
+        'order': order,
+        'diff': diff,
+        'left': f'Редакция {old_number}' if old_number else 'Пустой заказ',
+        'right': f'Редакция {new_number}',
+        'old_number': old_number,
+        'new_number': new_number,
+        'last_number': last_number,
+    })
+
+@login_required
+def order_compare(request):
+    """Сравнение двух заказов: строки, изменения полей и разница масс по материалам"""
+    first = get_object_or_404(Order, id=parse_int(request.GET.get('a')))
+    second_id = parse_int(request.GET.get('b'))
+    if second_id is None and request.GET.get('number'):
+        second_id = (Order.objects.filter(order_number=request.GET['number'].strip())
+                     .exclude(id=first.id).order_by('-created_at').values_list('id', flat=True).first())
+    second = get_object_or_404(Order, id=second_id)
+    return render(request, 'calculator/order_compare.html', {
+        'first': first,
+        'second': second,
+        'diff': comparison.compare_orders(first, second),
+    })
+
+def job_state(job):
+    """Состояние фоновой задачи для опроса со страницы задачи"""
+    return {
+        'id': job.id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress': job.progress,
+        'total': job.total,
+        'percent': job.percent,
+        'message': job.message,
+        'finished': job.finished,
+        'cancel_requested': job.cancel_requested,
+        'url': (job.result or {}).get('url'),
+    }
+
+@login_required
+def job_detail(request, job_id):
+    """Страница фоновой задачи: ход выполнения обновляется опросом job_status"""
+    job = get_object_or_404(Job, id=job_id)
+    return render(request, 'calculator/job_detail.html', {'job': job, 'state': job_state(job)})
+
+@login_required
+def job_status(request, job_id):
+    return JsonResponse(job_state(get_object_or_404(Job, id=job_id)))
+
+@login_required
+def job_cancel(request, job_id):
+    """Отмена фоновой задачи (POST)"""
+    job = get_object_or_404(Job, id=job_id)
+    if request.method == 'POST':
+        cancelled = jobs.cancel(job.id)
+        if is_fragment_request(request):
+            job.refresh_from_db()
+            return JsonResponse({'success': cancelled, **job_state(job)})
+        if cancelled:
+            messages.info(request, 'Отмена задачи запрошена')
+        else:
+            messages.warning(request, 'Задача уже завершена')
+    return redirect('job_detail', job_id=job.id)
+
+@login_required
+def change_feed(request):
+    """Лента изменений для внешних систем: ?since=<курсор>&limit=<размер порции>"""
+    since = parse_int(request.GET.get('since', '0'))
+    if since is None:
+        return JsonResponse({'success': False, 'error': 'since — номер последней полученной записи'}, status=400)
+    limit = parse_int(request.GET.get('limit')) or changefeed.DEFAULT_LIMIT
+    return JsonResponse(changefeed.changes(since, limit))
+
+@login_required
+@editable_order
+def order_duplicates(request, order_id):
+    """Одинаковые строки заказа и их слияние"""
+    order = get_object_or_404(Order, id=order_id)
+    if request.method == 'POST':
+        keeper_ids = [item_id for item_id in map(parse_int, request.POST.getlist('keep')) if item_id is not None]
+        if keeper_ids:
+            groups, removed = duplicates.merge_duplicates(order.id, keeper_ids)
+            messages.success(request, f'Объединено групп: {groups}, удалено строк: {removed}')
+        else:
+            messages.warning(request, 'Не выбраны группы для объединения')
+        return redirect('order_duplicates', order_id=order.id)
+    return render(request, 'calculator/order_duplicates.html', {
+        'order': order,
+        'groups': duplicates.find_duplicates(order.id),
+    })
+
+@login_required
+def order_stock(request, order_id):
+    """Потребность заказа в сортаменте, свободный остаток и резерв"""
+    order = get_object_or_404(Order, id=order_id)
+    is_issued = order.stock_movements.filter(kind='consumption').exists()
+    plan = remnants.plan_order(order) if not is_issued else {'covered': {}}
+    rows = inventory.order_availability(order, plan['covered'])
+    stock_items = StockItem.objects.select_related('material').in_bulk([row['stock_item_id'] for row in rows])
+    for row in rows:
+        row['stock_item'] = stock_items[row['stock_item_id']]
+        row['need_length_mm'] = weights.um_to_mm(row['need_length_um'])
+        row['need_kg'] = weights.mg_to_kg(row['need_mg'])
+        row['available_length_mm'] = weights.um_to_mm(row['available_length_um'])
+        row['reserved_length_mm'] = weights.um_to_mm(row['reserved_length_um'])
+        row['covered_length_mm'] = weights.um_to_mm(row['covered_length_um'])
+        row['shortage_length_mm'] = weights.um_to_mm(row['shortage_length_um'])
+    rows.sort(key=lambda row: str(row['stock_item']))
+    return render(request, 'calculator/order_stock.html', {
+        'order': order,
+        'rows': rows,
+        'has_shortage': any(row['shortage_length_um'] for row in rows),
+        'is_reserved': any(row['reserved_length_um'] for row in rows),
+        'is_issued': is_issued,
+    })
+
+@login_required
+def order_stock_action(request, order_id, action):
+    """Резервирование, снятие резерва и списание сортамента по заказу"""
+    order = get_object_or_404(Order, id=order_id)
+    if request.method == 'POST':
+        operations = {
+            'reserve': (inventory.reserve_order, 'Сортамент зарезервирован под заказ'),
+            'release': (inventory.release_order, 'Резерв заказа снят'),
+            'issue': (inventory.consume_order, 'Задание на заготовку выдано, сортамент списан'),
+        }
+        if action not in operations:
+            raise Http404('Неизвестная операция')
+        operation, message = operations[action]
+        try:
+            operation(order, user=request.user)
+        except inventory.InventoryError as e:
+            messages.error(request, str(e))
+        else:
+            messages.success(request, message)
+    return redirect('order_stock', order_id=order.id)
+
 @login_required
 def print_cutting_task(request, order_id):
     """Печатная форма - задание на заготовку"""
+    frozen = snapshot_report(order_id, 'cutting')
+    if frozen is not None:
+        return frozen
     order = get_object_or_404(Order, id=order_id)
-    items = order.items.all().select_related('part_name', 'material', 'stock_item')
+    context = cutting_task_context(order, report_items(order))
     
-    items_list = list(items)
-    items_list.sort(key=lambda x: (x.sort_key, x.part_name.name))
-    
-    # Создаем множество материалов, которые должны попасть в кругляк
-    special_materials = {'1.2343', '4Х5МФС'}
+    # Если есть отфильтрованные детали, показываем сообщение
+    if context['excluded_round_count']:
+        messages.info(request, 
+            f'Часть кругляка не включена в задание на заготовку по правилам разделов '
+            f'(исключено {context["excluded_round_count"]} позиций)')
     
-    # Группируем по типу сортамента с фильтрацией
-    grouped_by_section = {
-        'sheet': [],  # Лист
-        'round': [],  # Кругляк (только диаметр > 50, или специальные материалы)
-        'tube': [],   # Труба
-    }
+    return render(request, 'calculator/print_cutting_task.html', context)
+
+
+@login_required
+def cutting_task_printed(request, order_id):
+    """Отметка печати задания на заготовку (POST со страницы печати после вывода на принтер)"""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid method'}, status=405)
+    order = get_object_or_404(Order, id=order_id)
+    with transaction.atomic():
+        webhooks.enqueue([webhooks.event(webhooks.CUTTING_TASK_PRINTED, order.id, user=request.user.username)])
+    return JsonResponse({'success': True})
+
+
+def cutting_task_context(order, items_list):
+    """Детали задания на заготовку по разделам с заготовками из деловых остатков"""
+    # Заготовки, которые можно взять из деловых остатков
+    assignments = remnants.plan_order(order)['assignments']
+    for item in items_list:
+        item.remnant_pieces = sorted(assignments.get(item.id, {}).items())
     
+    # Группируем по разделам задания (правила CuttingRoute, таблица — в cutting.py)
+    grouped_by_section = {section: [] for section in cutting.SECTION_ORDER}
     for item in items_list:
         if item.is_special:
             continue
-            
-        section_type = item.stock_item.section_type
-        material_name = item.material.name.strip().upper() if item.material else ''
-        
-        # Проверяем, содержит ли материал любой из специальных вариантов
-        is_special_material = False
-        special_materials_upper = {m.upper() for m in special_materials}
-        for sm in special_materials_upper:
-            if sm in material_name:
-                is_special_material = True
-                break
-        
-        # Проверяем, нужно ли этот лист отправить в кругляк
-        if section_type == 'sheet' and is_special_material:
-            # Добавляем в кругляк без проверки диаметра >50
-            grouped_by_section['round'].append(item)
-            
-        elif section_type == 'sheet':
-            grouped_by_section['sheet'].append(item)
-            
-        elif section_type == 'round':
-            # Только диаметр >50, независимо от материала
-            if item.diameter and float(item.diameter) > 50:
-                grouped_by_section['round'].append(item)
-                
-        elif section_type == 'tube':
-            grouped_by_section['tube'].append(item)
+        section = cutting.item_section(item)
+        if section is not None:
+            grouped_by_section[section].append(item)
     
     # Внутри каждой группы сортируем по номеру
     for section_type in grouped_by_section:
@@ -538,22 +1082,40 @@ def print_cutting_task(request, order_id):
     total_round_count = sum(1 for item in items_list if not item.is_special and 
                            item.stock_item and item.stock_item.section_type == 'round')
     
-    # Если есть отфильтрованные детали, показываем сообщение
-    if total_round_count > filtered_round_count:
-        messages.info(request, 
-            f'Кругляк диаметром ≤ 50 мм не включен в задание на заготовку '
-            f'(исключено {total_round_count - filtered_round_count} позиций)')
-    
-    context = {
+    return {
         'order': order,
         'sheet_items': grouped_by_section['sheet'],
         'round_items': grouped_by_section['round'],
         'tube_items': grouped_by_section['tube'],
+        'excluded_round_count': total_round_count - filtered_round_count,
         'date': timezone.now().strftime('%d.%m.%Y'),
         'user': order.user
     }
-    
-    return render(request, 'calculator/print_cutting_task.html', context)
+
+
+@login_required
+def cutting_plan(request):
+    """Сводный план раскроя по нескольким заказам (по умолчанию — заказы за неделю)"""
+    today = timezone.localdate()
+    date_from = facets.parse_day(request.GET.get('date_from')) or today - timedelta(days=6)
+    date_to = facets.parse_day(request.GET.get('date_to')) or today
+    selected_ids = {order_id for order_id in map(facets.parse_id, request.GET.getlist('order')) if order_id}
+    # Выбранные заказы остаются в списке и в плане, даже если не попадают в период
+    orders = (Order.objects.filter(Q(created_at__date__gte=date_from, created_at__date__lte=date_to)
+                                   | Q(id__in=selected_ids))
+              .select_related('user').order_by('-created_at'))
+    selected = [order for order in orders if order.id in selected_ids]
+    plan = cutting.consolidated_plan(selected) if selected else []
+    return render(request, 'calculator/cutting_plan.html', {
+        'orders': orders,
+        'selected_ids': selected_ids,
+        'selected': selected,
+        'date_from': date_from,
+        'date_to': date_to,
+        'plan': plan,
+        'total_pieces': sum(group['pieces'] for group in plan),
+        'total_weight': weights.mg_to_kg(sum(group['mass_mg'] for group in plan)),
+    })
 
 
 @login_required
@@ -571,32 +1133,14 @@ def copy_order(request, order_id):
             messages.error(request, 'Необходимо указать номер нового заказа')
             return redirect('order_list')
         
-        # Создаем новый заказ от имени текущего пользователя
-        new_order = Order.objects.create(
-            order_number=new_order_number,
-            order_name=new_order_name or original_order.order_name,
-            drawing_number=original_order.drawing_number,
-            user=request.user,  # Новый заказ создается от имени текущего пользователя
-            coefficient=original_order.coefficient,
-            order_quantity=original_order.order_quantity
-        )
-        
-        # Копируем все детали
-        for item in original_order.items.all():
-            OrderItem.objects.create(
-                order=new_order,
-                sequence_number=item.sequence_number,
-                part_name=item.part_name,
-                material=item.material,
-                quantity=item.quantity,
-                stock_item=item.stock_item,
-                length=item.length,
-                width=item.width,
-                height=item.height,
-                diameter=item.diameter,
-                key_size=item.key_size,
-                is_special=item.is_special
-            )
+        if original_order.items.count() > settings.JOB_INLINE_ITEMS:
+            # Большой заказ копируется фоновой задачей, страница задачи показывает ход копирования
+            job = jobs.submit('copy_order', request.user, order_id=original_order.id,
+                              order_number=new_order_number, order_name=new_order_name)
+            return redirect('job_detail', job_id=job.id)
+
+        # Новый заказ создается от имени текущего пользователя
+        new_order = jobs.copy_order(original_order, new_order_number, new_order_name, request.user)
         
         messages.success(request, f'Заказ успешно скопирован. Новый номер: {new_order_number}')
         return redirect('order_detail', order_id=new_order.id)
@@ -605,6 +1149,7 @@ def copy_order(request, order_id):
 
 
 @login_required
+@editable_order
 @transaction.atomic
 def edit_order_item(request, order_id, item_id):
     """Редактирование детали в заказе"""
@@ -616,10 +1161,14 @@ def edit_order_item(request, order_id, item_id):
         if form.is_valid():
             try:
                 form.save()
+                if is_fragment_request(request):
+                    return item_fragment(request, order, item.id)
                 messages.success(request, 'Деталь успешно обновлена')
                 return redirect('order_detail', order_id=order.id)
             except Exception as e:
                 messages.error(request, f'Ошибка при сохранении: {str(e)}')
+        elif is_fragment_request(request):
+            return JsonResponse({'success': False, 'errors': form.errors})
         else:
             for field, errors in form.errors.items():
                 for error in errors:
@@ -686,46 +1235,24 @@ def search_materials(request):
     data = [{'id': m.id, 'text': f"{m.name} ({m.density} г/см³)"} for m in materials]
     return JsonResponse({'results': data})
 @login_required
+@editable_order
 @transaction.atomic
 def add_order_item(request, order_id):
     """Добавление детали в заказ (без ограничений на дублирование)"""
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.select_related('item_template', 'sequence'), id=order_id)
     
     # ---- ОБЩАЯ ЛОГИКА ДЛЯ ЗНАЧЕНИЙ ПО УМОЛЧАНИЮ (GET и повторный рендер POST) ----
-    last_item = order.items.order_by('-id').first()
-    next_number = order.items.count() + 1
-    initial_data = {'sequence_number': str(next_number)}
+    # Шаблон следующей детали поддерживается сигналами и загружается вместе с заказом
+    item_template = OrderItemTemplate.for_order(order)
+    initial_data = item_template.initial_data()
     last_section_type = None
     last_measurements = {}
     
-    if last_item:
-        if last_item.part_name_id:
-            initial_data['part_name'] = last_item.part_name_id
-        if last_item.material_id:
-            initial_data['material'] = last_item.material_id
-        if last_item.quantity:
-            initial_data['quantity'] = last_item.quantity
-        if last_item.stock_item_id:
-            initial_data['stock_item'] = last_item.stock_item_id
-        initial_data['is_special'] = last_item.is_special
-        if last_item.length:
-            initial_data['length'] = float(last_item.length)
-            last_measurements['length'] = str(last_item.length)
-        if last_item.width:
-            initial_data['width'] = float(last_item.width)
-            last_measurements['width'] = str(last_item.width)
-        if last_item.height:
-            initial_data['height'] = float(last_item.height)
-            last_measurements['height'] = str(last_item.height)
-        if last_item.diameter:
-            initial_data['diameter'] = float(last_item.diameter)
-            last_measurements['diameter'] = str(last_item.diameter)
-        if last_item.key_size:
-            initial_data['key_size'] = float(last_item.key_size)
-            last_measurements['key_size'] = str(last_item.key_size)
-        last_section_type = last_item.stock_item.section_type if last_item.stock_item else None
+    if item_template.last_item_id:
+        last_measurements = item_template.last_measurements()
+        last_section_type = item_template.section_type
     else:
-        last_params = request.session.get('last_item_params', {})
+        last_params = get_last_item_params(request)
         if last_params:
             if 'part_name_id' in last_params and last_params['part_name_id']:
                 initial_data['part_name'] = last_params['part_name_id']
@@ -781,28 +1308,28 @@ def add_order_item(request, order_id):
             try:
                 item = form.save(commit=False)
                 item.order = order
+                # Предложенный номер не изменен — выдаем его из счетчика заказа: если номер
+                # уже занят параллельным запросом, деталь получит следующий свободный
+                suggested = post_data.get('suggested_sequence_number')
+                if suggested and item.sequence_number.strip() == suggested:
+                    item.sequence_number = str(OrderSequence.allocate(order)[0])
                 item.save()
                 
-                # Сохраняем в сессию
-                request.session['last_item_params'] = {
-                    'part_name_id': item.part_name_id,
-                    'material_id': item.material_id if item.material else None,
-                    'quantity': item.quantity,
-                    'stock_item_id': item.stock_item_id if item.stock_item else None,
-                    'length': float(item.length) if item.length else None,
-                    'width': float(item.width) if item.width else None,
-                    'height': float(item.height) if item.height else None,
-                    'diameter': float(item.diameter) if item.diameter else None,
-                    'key_size': float(item.key_size) if item.key_size else None,
-                    'is_special': item.is_special,
-                    'section_type': item.stock_item.section_type if item.stock_item else None,
-                    'sequence_number': item.sequence_number,
-                }
-                
+                if is_fragment_request(request):
+                    # Форма остается открытой для следующей детали
+                    response = item_fragment(request, order, item.id)
+                    set_last_item_params(response, request.user, item)
+                    return response
                 messages.success(request, 'Деталь успешно добавлена')
-                return redirect('order_detail', order_id=order.id)
+                response = redirect('order_detail', order_id=order.id)
+                set_last_item_params(response, request.user, item)
+                return response
             except Exception as e:
+                if is_fragment_request(request):
+                    return JsonResponse({'success': False, 'error': f'Не удалось добавить деталь: {e}'})
                 messages.error(request, f'Ошибка: {str(e)}')
+        elif is_fragment_request(request):
+            return JsonResponse({'success': False, 'errors': form.errors})
         else:
             # При ошибках валидации показываем форму с ошибками
             for field, errors in form.errors.items():
@@ -813,6 +1340,8 @@ def add_order_item(request, order_id):
                 'order': order,
                 'last_section_type': last_section_type,
                 'last_measurements': last_measurements,
+                'next_sequence_number': item_template.next_sequence_number,
+                'part_size_fields': stock_index.PART_SIZE_FIELDS,
             })
     else:
         # GET-запрос: создаём форму БЕЗ параметра order
@@ -823,6 +1352,8 @@ def add_order_item(request, order_id):
         'order': order,
         'last_section_type': last_section_type,
         'last_measurements': last_measurements,
+        'next_sequence_number': item_template.next_sequence_number,
+        'part_size_fields': stock_index.PART_SIZE_FIELDS,
     })
 """
 Добавление детали в заказ, с запретом дублирования деталей в заказе     
@@ -963,13 +1494,56 @@ def add_order_item(request, order_id):
         'last_measurements': last_measurements,
     })   
 """
+def get_last_item_params(request):
+    """Параметры последней добавленной пользователем детали из подписанной cookie"""
+    raw = request.get_signed_cookie(
+        LAST_ITEM_PARAMS_COOKIE, default=None,
+        salt=LAST_ITEM_PARAMS_SALT, max_age=LAST_ITEM_PARAMS_MAX_AGE,
+    )
+    if not raw:
+        return {}
+    try:
+        params = json.loads(raw)
+    except ValueError:
+        return {}
+    # На общем терминале cookie могла остаться от другого пользователя
+    if params.get('user_id') != request.user.id:
+        return {}
+    return params
+
+def set_last_item_params(response, user, item):
+    """Запоминает параметры детали для предзаполнения следующей формы"""
+    params = {
+        'user_id': user.id,
+        'part_name_id': item.part_name_id,
+        'material_id': item.material_id if item.material else None,
+        'quantity': item.quantity,
+        'stock_item_id': item.stock_item_id if item.stock_item else None,
+        'length': float(item.length) if item.length else None,
+        'width': float(item.width) if item.width else None,
+        'height': float(item.height) if item.height else None,
+        'diameter': float(item.diameter) if item.diameter else None,
+        'key_size': float(item.key_size) if item.key_size else None,
+        'is_special': item.is_special,
+        'section_type': item.stock_item.section_type if item.stock_item else None,
+        'sequence_number': item.sequence_number,
+    }
+    response.set_signed_cookie(
+        LAST_ITEM_PARAMS_COOKIE, json.dumps(params, separators=(',', ':')),
+        salt=LAST_ITEM_PARAMS_SALT, max_age=LAST_ITEM_PARAMS_MAX_AGE,
+        httponly=True, samesite='Lax',
+    )
+
 @login_required
 def clear_last_item_params(request):
     """Очистка сохраненных параметров последней детали"""
+    # Старые версии хранили параметры в сессии
     if 'last_item_params' in request.session:
         del request.session['last_item_params']
     messages.success(request, 'Настройки по умолчанию сброшены')
-    return redirect(request.META.get('HTTP_REFERER', 'order_list'))
+    response = redirect(request.META.get('HTTP_REFERER', 'order_list'))
+    response.delete_cookie(LAST_ITEM_PARAMS_COOKIE, samesite='Lax')
+    return response
 
 @login_required
 @transaction.atomic
@@ -1027,7 +1601,9 @@ def update_material(request, pk):
             m = form.save()
         except IntegrityError:
             return JsonResponse({'success': False, 'errors': {'name': ['Такой материал уже существует']}}, status=400)
-        return JsonResponse({'success': True, 'id': m.id, 'name': m.name, 'density': str(m.density)})
+        job = getattr(m, 'job', None)
+        return JsonResponse({'success': True, 'id': m.id, 'name': m.name, 'density': str(m.density),
+                             'job_url': reverse('job_detail', args=[job.id]) if job else None})
     return JsonResponse({'success': False, 'errors': form.errors}, status=400)
 
 @login_required
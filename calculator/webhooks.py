@@ -0,0 +1,132 @@
+"""Исходящие уведомления внешней системе (MES)
+
+События — создание и изменение заказа (в одной транзакции с редакцией
+history.py) и печать задания на заготовку — записываются в очередь
+WebhookEvent в базе: запрос пользователя не ждет внешнюю систему и не теряет
+событие при ее недоступности. Команда deliver_webhooks (отдельная
+служба) отправляет готовые события порциями — одним POST-запросом с JSON
+{"events": [...]} на WEBHOOK_URL. При ошибке порция повторяется с удваивающейся
+задержкой; после WEBHOOK_MAX_ATTEMPTS попыток события помечаются как
+недоставленные.
+
+Доставка «хотя бы один раз» и без гарантии порядка: получатель отбрасывает
+повторы по id события и упорядочивает по created_at.
+"""
+import http.client
+import json
+import logging
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = 'order.created'
+ORDER_UPDATED = 'order.updated'
+CUTTING_TASK_PRINTED = 'cutting_task.printed'
+
+
+def enabled():
+    return bool(settings.WEBHOOK_URL)
+
+
+def event(name, order_id=None, **data):
+    """Событие для enqueue (еще не сохранено)"""
+    return WebhookEvent(event=name, order_id=order_id, payload=data)
+
+
+def enqueue(events):
+    """Ставит события в очередь в текущей транзакции; без WEBHOOK_URL ничего не делает"""
+    if not events or not enabled():
+        return 0
+    now = timezone.now()
+    for item in events:
+        item.next_attempt_at = now
+    WebhookEvent.objects.bulk_create(events)
+    return len(events)
+
+
+# ---- Доставка ----
+
+def _retry_delay(attempts):
+    return timedelta(seconds=min(settings.WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+                                 settings.WEBHOOK_RETRY_MAX_SECONDS))
+
+
+def _claim(limit):
+    """Порция готовых событий; до конца отправки они отложены на время тайм-аута (аренда)
+
+    Если процесс упадет во время отправки, порция будет отправлена повторно после аренды.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(WebhookEvent.objects.filter(status='pending', next_attempt_at__lte=now)
+                   .order_by('id').values_list('id', flat=True)[:limit])
+        if ids:
+            lease = now + timedelta(seconds=settings.WEBHOOK_TIMEOUT * 2)
+            WebhookEvent.objects.filter(id__in=ids).update(next_attempt_at=lease)
+    return list(WebhookEvent.objects.filter(id__in=ids).order_by('id')) if ids else []
+
+
+def _post(events):
+    body = json.dumps({'events': [item.as_message() for item in events]}, cls=DjangoJSONEncoder,
+                      ensure_ascii=False).encode('utf-8')
+    request = urllib.request.Request(settings.WEBHOOK_URL, data=body, method='POST',
+                                     headers={'Content-Type': 'application/json; charset=utf-8'})
+    # Ответ с кодом 4xx/5xx urlopen поднимает как HTTPError
+    with urllib.request.urlopen(request, timeout=settings.WEBHOOK_TIMEOUT) as response:
+        response.read()
+
+
+def _failed(events, error):
+    now = timezone.now()
+    for item in events:
+        item.attempts += 1
+        item.last_error = error[:1000]
+        if item.attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+            item.status = 'failed'
+            item.next_attempt_at = None
+        else:
+            item.next_attempt_at = now + _retry_delay(item.attempts)
+    WebhookEvent.objects.bulk_update(events, ['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def deliver_batch(limit=None):
+    """Отправляет одну порцию готовых событий; возвращает (доставлено, с ошибкой)"""
+    events = _claim(limit or settings.WEBHOOK_BATCH_SIZE)
+    if not events:
+        return 0, 0
+    try:
+        _post(events)
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        logger.warning('Не удалось отправить %s событий: %s', len(events), e)
+        _failed(events, str(e) or e.__class__.__name__)
+        return 0, len(events)
+    WebhookEvent.objects.filter(id__in=[item.id for item in events]).update(
+        status='delivered', delivered_at=timezone.now(), next_attempt_at=None, attempts=F('attempts') + 1,
+    )
+    return len(events), 0
+
+
+def deliver_pending(limit=None):
+    """Отправляет порции, пока есть готовые события и приемник их принимает; возвращает (доставлено, с ошибкой)"""
+    delivered = failed = 0
+    while True:
+        sent, errors = deliver_batch(limit)
+        delivered += sent
+        failed += errors
+        if not sent:
+            return delivered, failed
+
+
+def prune(days=None):
+    """Удаляет доставленные события старше days дней; возвращает число удаленных"""
+    before = timezone.now() - timedelta(days=days or settings.WEBHOOK_KEEP_DAYS)
+    return WebhookEvent.objects.filter(status='delivered', delivered_at__lt=before).delete()[0]
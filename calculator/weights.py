@@ -0,0 +1,229 @@
+"""Расчёт масс в целых числах: размеры в микрометрах, масса в миллиграммах
+
+Размеры переводятся в мкм, плотность — в тысячные доли г/см³, коэффициент —
+в сотые. Площадь сечения хранится дробью (числитель, знаменатель), поэтому
+масса детали получается точно и округляется до миллиграмма один раз
+(половина — вверх). Масса детали сохраняется в OrderItem.weight_mg, а итоги
+заказа и групп складываются из тех же целых значений — в Python или в SQL, —
+так что карточка заказа, отчёты, список и AJAX-ответы совпадают до мг.
+"""
+from decimal import Decimal
+from functools import lru_cache
+
+from django.db import transaction
+from django.db.models import BigIntegerField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Cast, Round
+
+# Те же приближения, что исторически использовались в отчётах: 3.14159 и 1.73205
+PI_NUM, PI_DEN = 314159, 100000
+SQRT3_NUM, SQRT3_DEN = 173205, 100000
+
+# мкм³ · (г/см³ · 1000) → мг: 1 мм³ = 10⁹ мкм³, 1 г/см³ = 1 мг/мм³
+_MG_DEN = 10 ** 9 * 1000
+
+
+@lru_cache(maxsize=8192)
+def _scaled(value, scale):
+    if value is None:
+        return 0
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int(value.scaleb(scale).to_integral_value())
+
+
+def to_um(value):
+    """Миллиметры → целые микрометры"""
+    return _scaled(value, 3)
+
+
+def density_units(value):
+    """Плотность г/см³ → целые тысячные доли"""
+    return _scaled(value, 3)
+
+
+def kg_to_mg(value):
+    """Килограммы → целые миллиграммы"""
+    return _scaled(value, 6)
+
+
+def coefficient_units(value):
+    """Коэффициент массы → целые сотые доли"""
+    return _scaled(value, 2)
+
+
+def round_div(numerator, denominator):
+    """Целочисленное деление с округлением половины вверх (неотрицательные значения)"""
+    return (2 * numerator + denominator) // (2 * denominator)
+
+
+@lru_cache(maxsize=4096)
+def _stock_area(section_type, diameter, outer_diameter, wall_thickness):
+    if section_type == 'round':
+        return PI_NUM * diameter * diameter, 4 * PI_DEN
+    if section_type == 'tube':
+        return PI_NUM * wall_thickness * (outer_diameter - wall_thickness), PI_DEN
+    return 0, 1
+
+
+def section_area(section_type, width, key_size, stock_width, diameter, outer_diameter, wall_thickness):
+    """Площадь сечения в мкм² дробью (числитель, знаменатель); размеры — в мкм
+
+    Для листа сечение — ширина детали на толщину листа, для шестигранника
+    берётся размер под ключ из замеров детали, круг и труба — по сортаменту.
+    """
+    if section_type == 'sheet':
+        return width * stock_width, 1
+    if section_type == 'hexagon':
+        return 3 * SQRT3_NUM * key_size * key_size, 2 * SQRT3_DEN
+    return _stock_area(section_type, diameter, outer_diameter, wall_thickness)
+
+
+def weight_mg(density, length, area):
+    """Масса детали в мг: плотность в тысячных г/см³, длина в мкм, площадь в мкм²"""
+    numerator, denominator = area
+    return round_div(numerator * length * density, denominator * _MG_DEN)
+
+
+def total_mg(weight, quantity, coefficient):
+    """Масса позиции: масса детали × количество × коэффициент (в сотых), округление до мг"""
+    return round_div(weight * quantity * coefficient, 100)
+
+
+# ---- Детали заказа (модели) ----
+
+def item_area(item):
+    stock_item = item.stock_item
+    return section_area(
+        stock_item.section_type, to_um(item.width), to_um(item.key_size), to_um(stock_item.width),
+        to_um(stock_item.diameter), to_um(stock_item.outer_diameter), to_um(stock_item.wall_thickness),
+    )
+
+
+def item_volume(item):
+    """Объём детали в мкм³ дробью (числитель, знаменатель)"""
+    if item.is_special or item.stock_item is None:
+        return 0, 1
+    numerator, denominator = item_area(item)
+    return numerator * to_um(item.length), denominator
+
+
+def item_weight_mg(item):
+    """Масса одной детали заказа в мг"""
+    if item.is_special or item.material is None or item.stock_item is None:
+        return 0
+    return weight_mg(density_units(item.material.density), to_um(item.length), item_area(item))
+
+
+def item_total_mg(item, coefficient):
+    """Масса позиции с учётом количества и коэффициента заказа в мг"""
+    if item.is_special:
+        return 0
+    return total_mg(item_weight_mg(item), item.quantity, coefficient_units(coefficient))
+
+
+# ---- Массовый расчет по строкам запроса ----
+
+def scaled_expression(field, scale):
+    """Поле × 10^scale целым числом, вычисленное в SQL (без float и Decimal в Python)"""
+    return Cast(Round(F(field) * Value(10 ** scale)), BigIntegerField())
+
+
+ROW_FIELDS = {
+    'w_special': F('is_special'),
+    'w_length': scaled_expression('length', 3),
+    'w_width': scaled_expression('width', 3),
+    'w_key_size': scaled_expression('key_size', 3),
+    'w_density': scaled_expression('material__density', 3),
+    'w_section_type': F('stock_item__section_type'),
+    'w_stock_width': scaled_expression('stock_item__width', 3),
+    'w_diameter': scaled_expression('stock_item__diameter', 3),
+    'w_outer_diameter': scaled_expression('stock_item__outer_diameter', 3),
+    'w_wall_thickness': scaled_expression('stock_item__wall_thickness', 3),
+}
+
+
+def row_weight_mg(row):
+    """Масса детали в мг по строке значений ROW_FIELDS (размеры уже в мкм)"""
+    (is_special, length, width, key_size, density,
+     section_type, stock_width, diameter, outer_diameter, wall_thickness) = row
+    if is_special or density is None or section_type is None:
+        return 0
+    area = section_area(section_type, width or 0, key_size or 0, stock_width or 0,
+                        diameter or 0, outer_diameter or 0, wall_thickness or 0)
+    return weight_mg(density, length or 0, area)
+
+
+def refresh_weights(items, batch_size=2000, progress=None):
+    """Пересчитывает сохраненную массу деталей (weight_mg); возвращает число изменённых
+
+    Детали читаются порциями по batch_size кортежами (по возрастанию pk), без
+    создания моделей; записываются только строки, у которых масса изменилась,
+    каждая порция — в своей транзакции. progress(n) вызывается после записи
+    порции из n деталей (фоновая задача jobs.py), поэтому ход выполнения и
+    отмена соответствуют уже записанному.
+    """
+    model = items.model
+    rows = items.order_by('pk').annotate(**ROW_FIELDS).values_list('pk', 'weight_mg', *ROW_FIELDS)
+    total = 0
+    last_pk = None
+    while True:
+        chunk = list((rows if last_pk is None else rows.filter(pk__gt=last_pk))[:batch_size])
+        if not chunk:
+            return total
+        changed = [model(pk=pk, weight_mg=weight) for pk, stored, *row in chunk
+                   if (weight := row_weight_mg(row)) != stored]
+        with transaction.atomic():
+            model.objects.bulk_update(changed, ['weight_mg'], batch_size=batch_size)
+        total += len(changed)
+        last_pk = chunk[-1][0]
+        if progress:
+            progress(len(chunk))
+
+
+def total_expression():
+    """SQL-выражение массы позиции в мг — то же округление, что и total_mg()"""
+    coefficient = scaled_expression('order__coefficient', 2)
+    return ExpressionWrapper(
+        (Value(2) * F('weight_mg') * F('quantity') * coefficient + Value(100)) / Value(200),
+        output_field=BigIntegerField(),
+    )
+
+
+def order_totals_mg(items):
+    """Суммарные массы позиций по заказам в мг (без учёта количества заказов)"""
+    return dict(
+        items.order_by().values('order_id')
+        .annotate(total=Sum(total_expression()))
+        .values_list('order_id', 'total')
+    )
+
+
+def stock_weight_mg(stock_item, length):
+    """Масса заготовки длиной length мм по сечению сортамента; для листа — None"""
+    if stock_item.section_type == 'sheet':
+        return None
+    area = section_area(
+        stock_item.section_type, 0, to_um(stock_item.key_size), 0,
+        to_um(stock_item.diameter), to_um(stock_item.outer_diameter), to_um(stock_item.wall_thickness),
+    )
+    return weight_mg(density_units(stock_item.material.density), to_um(length), area)
+
+
+def mg_to_g(mg):
+    return Decimal(mg).scaleb(-3)
+
+
+def mg_to_kg(mg):
+    return Decimal(mg).scaleb(-6)
+
+
+def um_to_mm(um):
+    return Decimal(um).scaleb(-3)
+
+
+def format_kg(mg, places=3):
+    """Строка массы в кг с округлением половины вверх (как floatformat в шаблонах)"""
+    scaled = round_div(mg, 10 ** (6 - places))
+    if not places:
+        return str(scaled)
+    return f'{scaled // 10 ** places}.{scaled % 10 ** places:0{places}d}'
@@ -35,6 +35,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'calculator.middleware.SlowQueryLogMiddleware',
+    'calculator.middleware.RevisionUserMiddleware',
 ]
 
 ROOT_URLCONF = 'production_calculator.urls'
@@ -70,6 +72,53 @@ DATABASES = {
     }
 }
 
+# Резервные копии базы (manage.py backup_db): каталог рядом с базой и число хранимых копий
+BACKUP_DIR = os.environ.get('BACKUP_DIR', str(Path(DATABASES['default']['NAME']).parent / 'backups'))
+BACKUP_KEEP = 14
+
+# Холодный архив заказов (archive.py): отдельная база рядом с основной и возраст
+# заказа в днях, после которого он переносится в архив командой archive_orders
+ARCHIVE_DB_PATH = os.environ.get('ARCHIVE_DB_PATH', str(Path(DATABASES['default']['NAME']).parent / 'archive.sqlite3'))
+ARCHIVE_AFTER_DAYS = 730
+
+# Исходящие уведомления (webhooks.py, команда deliver_webhooks): адрес приемника MES —
+# без него события не ставятся в очередь; размер порции, тайм-аут запроса (с),
+# задержки повтора (с, удваиваются с каждой попыткой) и срок хранения доставленных (дни)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_BATCH_SIZE = 50
+WEBHOOK_TIMEOUT = 10
+WEBHOOK_MAX_ATTEMPTS = 12
+WEBHOOK_RETRY_BASE_SECONDS = 15
+WEBHOOK_RETRY_MAX_SECONDS = 3600
+WEBHOOK_KEEP_DAYS = 30
+
+# Фоновые задачи (jobs.py, команда run_jobs): операции больше чем над JOB_INLINE_ITEMS
+# деталями (копирование заказа, пересчет масс) выполняются вне запроса;
+# завершенные задачи хранятся JOB_KEEP_DAYS дней
+JOB_INLINE_ITEMS = 2000
+JOB_KEEP_DAYS = 30
+
+# Лента изменений (changefeed.py, команда prune_change_log): вытесненные записи журнала
+# и записи об удалении хранятся CHANGE_LOG_KEEP_DAYS дней
+CHANGE_LOG_KEEP_DAYS = 90
+
+# Кэш в памяти процесса: сессии читаются из него, БД используется только при записи
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'production-calculator',
+    }
+}
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Припуск на обработку при подборе сортамента по размеру детали (мм)
+STOCK_FIT_ALLOWANCE_MM = {'round': 2, 'hexagon': 2, 'tube': 2, 'sheet': 0}
+
+# Ширина реза и минимальный размер делового остатка (мм): меньшие обрезки не учитываются
+REMNANT_CUT_ALLOWANCE_MM = 3
+REMNANT_MIN_SIZE_MM = 50
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -119,3 +168,10 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'index'
 LOGOUT_REDIRECT_URL = 'login'
+
+# Журнал медленных SQL-запросов (с EXPLAIN QUERY PLAN, ротация по размеру)
+SLOW_QUERY_LOG_ENABLED = os.environ.get('SLOW_QUERY_LOG_ENABLED', '1') == '1'
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '100'))
+SLOW_QUERY_LOG_PATH = os.environ.get('SLOW_QUERY_LOG_PATH', str(BASE_DIR / 'logs' / 'slow_queries.log'))
+SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUP_COUNT = 5